@@ -11,7 +11,7 @@ Python library for retrieving free HTTP proxies from online sources.
 
 from .version import __version__
 
-import getters
+import registry
 from pg import ProxyGet
 
 def sources():
@@ -21,11 +21,10 @@ def sources():
     Returns
     -------
     result : list of str
-        List of available proxy retrieval functions in the `getprox.getters`
-        module.
+        Names of the available proxy sources.
     """
 
-    return getters.__all__
+    return registry.available()
 
 def proxy_get(*sources, **kwargs):
     """
@@ -38,10 +37,15 @@ def proxy_get(*sources, **kwargs):
     n : int
         Maximum number of proxies to retrieve. If None (default), all
         available proxies are returned. The total number returned may
-        be less than this number.
+        be less than this number. If specified, retrieval and testing stop
+        as soon as this many proxies have been found.
     test : bool
         If True, return tested proxy URIs; if False (default),
         return URIs without testing.
+    country, exclude_asn
+        Return only proxies in the specified countries and not in the
+        specified autonomous systems; requires an IP range database to be
+        specified with the `geo` argument. See `ProxyGet.get()`.
 
     Returns
     -------
@@ -57,7 +61,45 @@ def proxy_get(*sources, **kwargs):
         test = kwargs['test']
     else:
         test = False
+    country, exclude_asn = kwargs.get('country'), kwargs.get('exclude_asn')
+
+    # Retrieval cannot stop after n proxies if some of them may be filtered
+    # out:
+    if country is not None or exclude_asn is not None:
+        kwargs['n'] = None
     p = ProxyGet(*sources, **kwargs)
     p.wait()
-    return p.get(n, test)
+    return p.get(n, test, country, exclude_asn)
+
+def proxy_get_async(*sources, **kwargs):
+    """
+    Retrieve HTTP proxies from free online lists without blocking.
+
+    Parameters
+    ----------
+    sources : list of str
+        Proxy sources. If None, proxies from all available sources are retrieved.
+    n : int
+        Maximum number of proxies to retrieve. If None (default), all
+        available proxies are returned. The total number returned may
+        be less than this number.
+    test : bool
+        If True, return tested proxy URIs; if False (default),
+        return URIs without testing.
+    country, exclude_asn
+        Filters; see `proxy_get()`.
+
+    Returns
+    -------
+    result : concurrent.futures.Future
+        Future whose result is the list of proxy URIs in http://host:port
+        format.
+    """
+
+    n, country, exclude_asn = \
+        kwargs.get('n'), kwargs.get('country'), kwargs.get('exclude_asn')
+    if country is not None or exclude_asn is not None:
+        kwargs['n'] = None
+    p = ProxyGet(*sources, **kwargs)
+    return p.as_future(n, kwargs.get('test', False), country, exclude_asn)
 
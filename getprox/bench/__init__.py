@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+
+"""
+Offline benchmarks for proxy retrieval and testing.
+
+Notes
+-----
+All benchmarks run against local servers: source pages are replayed from
+fixtures by a server that the fetchers use as their HTTP proxy, and proxy tests
+are run against a fleet of fake proxies with configurable latency and loss.
+The benchmarks may be run from the command line with ::
+
+    python -m getprox.bench -o results.json
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import collections
+import functools
+import platform
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from .. import engine
+from .. import getters
+from .. import pg
+from .. import probe
+from .. import proxy
+from .. import proxytest
+from .. import registry
+import fixtures
+import server
+
+def peak_memory():
+    """
+    Return the peak resident memory of the process in kilobytes, or None if
+    it cannot be determined.
+    """
+
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+class TimingFetcher(engine.Fetcher):
+    """
+    Fetcher that records the time spent parsing each source's pages.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(TimingFetcher, self).__init__(*args, **kwargs)
+        self.parse_time = collections.defaultdict(float)
+        self.pages = collections.Counter()
+        self.bytes = collections.Counter()
+        self._stats_lock = threading.Lock()
+
+    def get(self, uri, parse=None, source=None, **kwargs):
+        if parse is not None:
+            parse = functools.partial(self._timed_parse, parse, source)
+        return super(TimingFetcher, self).get(uri, parse, source, **kwargs)
+
+    def _timed_parse(self, parse, source, page):
+        start = time.time()
+        rows = parse(page)
+        elapsed = time.time()-start
+        with self._stats_lock:
+            self.parse_time[source] += elapsed
+            self.pages[source] += 1
+            self.bytes[source] += len(page.content)
+        return rows
+
+def _fetcher(fixture_server, cls=engine.Fetcher, **kwargs):
+    fetcher = cls(**kwargs)
+    fetcher.session.trust_env = False
+    fetcher.session.proxies = {'http': fixture_server.uri}
+    return fetcher
+
+def _collect(rows, x):
+    if isinstance(x, proxy.ProxyArray):
+        rows.extend(x.uris())
+    else:
+        rows.append(x)
+
+def bench_getters(pages, sources, repeat=3):
+    """
+    Measure the throughput of every getter.
+
+    Parameters
+    ----------
+    pages : dict
+        Fixture pages.
+    sources : list of str
+        Names of the sources to benchmark.
+    repeat : int
+        Number of times each getter is run; the fastest run is reported.
+
+    Returns
+    -------
+    result : dict
+        Maps each source name to the number of proxies it returned, the number
+        and total size of the pages it downloaded, its parse time and
+        wall time in seconds, and its parse throughput in rows per second.
+    """
+
+    fixture_server = server.FixtureServer(pages)
+    results = {}
+    try:
+        for source in sources:
+            best = None
+            for i in xrange(repeat):
+                fetcher = _fetcher(fixture_server, TimingFetcher)
+                rows = []
+                start = time.time()
+                engine.Engine(fetcher).spawn(getattr(getters, source),
+                                             functools.partial(_collect, rows)).result()
+                wall_time = time.time()-start
+                parse_time = fetcher.parse_time[source]
+                result = {'rows': len(rows),
+                          'pages': fetcher.pages[source],
+                          'bytes': fetcher.bytes[source],
+                          'parse_time': parse_time,
+                          'wall_time': wall_time,
+                          'rows_per_sec': len(rows)/parse_time \
+                          if parse_time else None}
+                if best is None or parse_time < best['parse_time']:
+                    best = result
+            results[source] = best
+    finally:
+        fixture_server.close()
+    return results
+
+def bench_proxyget(pages, sources, latency=0.0, parse_workers=None):
+    """
+    Measure the wall time of retrieving proxies from all sources.
+
+    Parameters
+    ----------
+    pages : dict
+        Fixture pages.
+    sources : list of str
+        Names of the sources from which to retrieve proxies.
+    latency : float
+        Delay in seconds added to every page download.
+    parse_workers : int
+        Number of parser worker processes; if None, pages are parsed by the
+        download threads.
+
+    Returns
+    -------
+    result : dict
+        Number of unique proxies retrieved, wall time in seconds, and peak
+        resident memory of the process in kilobytes.
+    """
+
+    fixture_server = server.FixtureServer(pages, latency)
+    try:
+        start = time.time()
+        fetcher = _fetcher(fixture_server, parse_workers=parse_workers)
+        p = pg.ProxyGet(*sources, fetcher=fetcher)
+        p.wait()
+        wall_time = time.time()-start
+        fetcher.close()
+    finally:
+        fixture_server.close()
+    return {'proxies': len(p.get()),
+            'wall_time': wall_time,
+            'page_latency': latency,
+            'parse_workers': parse_workers,
+            'peak_memory_kb': peak_memory()}
+
+def bench_testers(n_probes=2000, n_proxies=200, latency=0.05, jitter=0.01,
+                  loss=0.5, timeout=1.0):
+    """
+    Measure the throughput of the proxy testers.
+
+    Parameters
+    ----------
+    n_probes : int
+        Number of proxy URIs tested by each tester (proxies in the fleet are
+        tested repeatedly).
+    n_proxies : int
+        Number of fake proxies.
+    latency, jitter : float
+        Mean and standard deviation of the fake proxies' latency in seconds.
+    loss : float
+        Fraction of fake proxies that are not alive.
+    timeout : float
+        Tester timeout in seconds.
+
+    Returns
+    -------
+    result : dict
+        Maps each tester to its number of probes, number of live proxies
+        found, number of misclassified probes, wall time in seconds, and
+        throughput in probes per second.
+    """
+
+    fleet = server.ProxyFleet(n_proxies, latency, jitter, loss)
+    uris = [fleet.uris[i % len(fleet.uris)] for i in xrange(n_probes)]
+    testers = collections.OrderedDict([
+        ('requests', proxytest.ProxyTest(timeout, results=None)),
+        ('requests_adaptive', proxytest.ProxyTest(timeout, adaptive=True,
+                                                  results=None)),
+        ('socket', probe.SocketTest(timeout, results=None))])
+    results = {}
+    try:
+        for name, tester in testers.iteritems():
+            start = time.time()
+            alive = tester.test(*uris)
+            wall_time = time.time()-start
+            wrong = sum([(uri in fleet.live) != (uri in alive) for uri in set(uris)])
+            results[name] = {'probes': len(uris),
+                             'alive': len(alive),
+                             'misclassified': wrong,
+                             'wall_time': wall_time,
+                             'probes_per_sec': len(uris)/wall_time,
+                             'stats': tester.stats() \
+                             if hasattr(tester, 'stats') else None}
+    finally:
+        fleet.close()
+    results['fleet'] = {'proxies': n_proxies, 'live': len(fleet.live),
+                        'latency': latency, 'jitter': jitter, 'loss': loss}
+    return results
+
+def bench_recheck(n_proxies=200, rounds=5, latency=0.05, jitter=0.01,
+                  loss=0.5, setup=0.1, timeout=1.0):
+    """
+    Measure the time taken to re-check a pool of proxies.
+
+    Parameters
+    ----------
+    n_proxies : int
+        Number of fake proxies.
+    rounds : int
+        Number of times all proxies are tested.
+    latency, jitter : float
+        Mean and standard deviation of the fake proxies' latency in seconds.
+    loss : float
+        Fraction of fake proxies that are not alive.
+    setup : float
+        Delay added to the first response over every connection to a fake
+        proxy, in seconds.
+    timeout : float
+        Tester timeout in seconds.
+
+    Returns
+    -------
+    result : dict
+        Maps 'close' and 'keepalive' to the wall time in seconds of the
+        first round and the mean wall time of subsequent rounds of tests
+        run by socket testers without and with persistent connections.
+    """
+
+    fleet = server.ProxyFleet(n_proxies, latency, jitter, loss, setup)
+    results = {}
+    try:
+        for name, keepalive in [('close', 0), ('keepalive', n_proxies)]:
+            tester = probe.SocketTest(timeout, keepalive=keepalive, results=None)
+            alive = fleet.uris
+            times = []
+            for i in xrange(rounds):
+                start = time.time()
+                alive = tester.test(*alive)
+                times.append(time.time()-start)
+            tester.close()
+            results[name] = {'alive': len(alive),
+                             'first_round': times[0],
+                             'recheck': sum(times[1:])/max(1, len(times)-1)}
+    finally:
+        fleet.close()
+    return results
+
+def run(sources=None, rows=1000, pages=None, repeat=3, page_latency=0.0,
+        n_probes=2000, n_proxies=200, latency=0.05, loss=0.5, timeout=1.0,
+        parse_workers=None):
+    """
+    Run all benchmarks.
+
+    Parameters
+    ----------
+    sources : list of str
+        Names of the sources to benchmark. If None, all available sources
+        are benchmarked.
+    rows : int
+        Approximate number of proxies listed by each source's synthetic
+        fixtures.
+    pages : dict
+        Fixture pages. If None, synthetic fixtures are generated.
+    repeat : int
+        Number of runs of each getter.
+    page_latency : float
+        Delay in seconds added to every page download in the end-to-end
+        benchmark.
+    n_probes, n_proxies, latency, loss, timeout
+        Proxy tester benchmark parameters; see `bench_testers()`.
+    parse_workers : int
+        Number of parser worker processes used in the end-to-end benchmark.
+
+    Returns
+    -------
+    result : dict
+        JSON-serializable benchmark results.
+    """
+
+    from .. import __version__
+
+    if not sources:
+        sources = registry.available()
+    if pages is None:
+        pages = fixtures.generate(sources, rows)
+    return {'version': __version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.time(),
+            'getters': bench_getters(pages, sources, repeat),
+            'proxyget': bench_proxyget(pages, sources, page_latency,
+                                       parse_workers),
+            'testers': bench_testers(n_probes, n_proxies, latency,
+                                     loss=loss, timeout=timeout),
+            'recheck': bench_recheck(n_proxies, latency=latency, loss=loss,
+                                     timeout=timeout)}
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""
+Run the getprox benchmarks and write the results in JSON format.
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import argparse
+import json
+import sys
+
+from getprox import bench
+from getprox import engine
+from getprox import getters
+from getprox import registry
+from getprox.bench import fixtures
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m getprox.bench',
+                                     description=__doc__.strip())
+    parser.add_argument('sources', nargs='*',
+                        help='sources to benchmark (default: all)')
+    parser.add_argument('-o', '--output',
+                        help='write results to this file (default: stdout)')
+    parser.add_argument('--rows', type=int, default=1000,
+                        help='proxies listed by each synthetic source')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs of each getter')
+    parser.add_argument('--page-latency', type=float, default=0.0,
+                        help='delay added to page downloads (seconds)')
+    parser.add_argument('--parse-workers', type=int,
+                        help='parser worker processes (default: parse in threads)')
+    parser.add_argument('--fixtures', metavar='DIR',
+                        help='replay pages recorded in DIR')
+    parser.add_argument('--record', metavar='DIR',
+                        help='record pages from the live sites in DIR and exit')
+    parser.add_argument('--probes', type=int, default=2000,
+                        help='proxy tests run by each tester')
+    parser.add_argument('--proxies', type=int, default=200,
+                        help='fake proxies in the fleet')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='mean fake proxy latency (seconds)')
+    parser.add_argument('--loss', type=float, default=0.5,
+                        help='fraction of fake proxies that are dead')
+    parser.add_argument('--timeout', type=float, default=1.0,
+                        help='proxy test timeout (seconds)')
+    args = parser.parse_args(argv)
+    sources = args.sources or registry.available()
+
+    if args.record:
+        fetcher = engine.Fetcher()
+        save_index = fixtures.record(fetcher, args.record)
+        e = engine.Engine(fetcher)
+        for f in [e.spawn(getattr(getters, source), lambda uri: None) \
+                  for source in sources]:
+            try:
+                f.result()
+            except Exception as exc:
+                sys.stderr.write('%s: %s\n' % (f, exc))
+        save_index()
+        return
+
+    pages = fixtures.load(args.fixtures) if args.fixtures else None
+    results = bench.run(sources, args.rows, pages, args.repeat,
+                        args.page_latency, args.probes, args.proxies,
+                        args.latency, args.loss, args.timeout,
+                        args.parse_workers)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=1, sort_keys=True)
+        sys.stdout.write('\n')
+
+if __name__ == '__main__':
+    main()
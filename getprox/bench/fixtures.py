@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+"""
+Proxy source page fixtures.
+
+Notes
+-----
+Fixtures are represented as dictionaries that map page URIs to tuples
+containing the page's content type and body. Synthetic fixtures that mimic the
+layout of every supported source may be generated with `generate()`; pages
+downloaded from the actual sites may be recorded with `record()` and loaded
+with `load()`.
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import base64
+import cgi
+import codecs
+import hashlib
+import json
+import os
+import StringIO
+import threading
+import zipfile
+
+HTML = 'text/html; charset=utf-8'
+XML = 'text/xml; charset=utf-8'
+ZIP = 'application/zip'
+
+def _ip(i):
+    return '10.%d.%d.%d' % ((i >> 16) & 255, (i >> 8) & 255, i & 255)
+
+def _page(body, head=''):
+    return '<html><head>%s</head><body>%s</body></html>' % (head, body)
+
+def _freeproxylists(pages, rows, n_lists=4):
+    base = 'http://www.freeproxylists.com/'
+    links = ''.join('<tr><td><a href="standard/d%d.html">list %d</a></td></tr>' % (i, i) \
+                    for i in xrange(n_lists))
+    pages[base+'standard.html'] = \
+        (HTML, _page('<table><tr><th>raw proxy list</th></tr>%s</table>' % links))
+    per_list = rows//n_lists
+    for i in xrange(n_lists):
+        pages[base+'standard/d%d.html' % i] = \
+            (HTML, '<html><body onload="loadData(\'standard\', \'load_standard_d%d.html\');">'
+             '</body></html>' % i)
+        table = '<table><tr><td>IP</td><td>Port</td></tr>%s</table>' % \
+                ''.join('<tr><td>%s</td><td>8080</td></tr>' % _ip(i*per_list+j) \
+                        for j in xrange(per_list))
+        pages[base+'load_standard_d%d.html' % i] = \
+            (XML, '<?xml version="1.0"?><root><quote>%s</quote></root>' % cgi.escape(table))
+
+def _checkerproxy(pages, rows):
+    trs = ''.join('<tr><td>%d</td><td>%s:3128</td><td>-</td><td>HTTP</td></tr>' % \
+                  (i, _ip(i)) for i in xrange(rows))
+    pages['http://checkerproxy.net/all_proxy'] = \
+        (HTML, _page('<table id="result-box-table"><tbody>%s</tbody></table>' % trs))
+
+def _letushide(pages, rows, n_pages=3):
+    per_page = rows//n_pages
+    for p in xrange(1, n_pages+1):
+        trs = ''.join('<tr id="data"><td>%d</td><td>%s</td><td>80</td><td>-</td>'
+                      '<td>-</td><td><span class="s5"></span></td><td>95%%</td></tr>' % \
+                      (i, _ip(p*per_page+i)) for i in xrange(per_page))
+        link = ''
+        if p < n_pages:
+            link = '<a href="/filter/http,all,all/%d/list_of_free_HTTP_proxy_servers">next</a>' % (p+1)
+        pages['http://letushide.com/filter/http,all,all/%d/list_of_free_HTTP_proxy_servers' % p] = \
+            (HTML, _page('<table>%s</table>%s' % (trs, link)))
+
+def _freeproxylist(pages, rows):
+    base = 'http://freeproxylist.co'
+    pages[base] = (HTML, _page('<div class="entry_date"><a href="%s/entry">entry</a></div>' % base))
+    pages[base+'/entry'] = \
+        (HTML, _page('<div class="entry_page"><p><a href="%s/list.zip"> list </a></p></div>' % base))
+    s = StringIO.StringIO()
+    z = zipfile.ZipFile(s, 'w', zipfile.ZIP_DEFLATED)
+    z.writestr('list.txt', '\n'.join('%s:8080' % _ip(i) for i in xrange(rows)))
+    z.close()
+    pages[base+'/list.zip'] = (ZIP, s.getvalue())
+
+def _proxy_ip_list(pages, rows):
+    trs = ''.join('<tr><td>%s:8080</td><td>1</td><td>100</td><td>high-anonymous</td>'
+                  '<td>US</td></tr>' % _ip(i) for i in xrange(rows))
+    pages['http://proxy-ip-list.com/fresh-proxy-list.html'] = \
+        (HTML, _page('<table><tbody>%s</tbody></table>' % trs))
+
+def _aliveproxy(pages, rows):
+    trs = ''.join('<tr class="cw-list"><td>%s:8080</td><td>-</td><td>-</td><td>-</td>'
+                  '<td>00:10</td><td>-</td><td>-</td><td>-</td><td>-</td><td>-</td></tr>' % \
+                  _ip(i) for i in xrange(rows))
+    pages['http://aliveproxy.com/high-anonymity-proxy-list/'] = \
+        (HTML, _page('<table>%s</table>' % trs))
+
+def _cool_proxy(pages, rows, n_pages=5):
+    per_page = rows//n_pages
+    for p in xrange(n_pages):
+        trs = []
+        for i in xrange(per_page):
+            enc = codecs.encode(base64.b64encode(_ip(p*per_page+i)), 'rot13')
+            trs.append('<tr><td><script>document.write(Base64.decode(str_rot13("%s")))</script></td>'
+                       '<td>8080</td><td>-</td><td>-</td><td><img alt="5 star proxy"/></td>'
+                       '<td>-</td><td>95</td><td>1.5</td><td>150</td><td>00:05</td></tr>' % enc)
+        pages['http://www.cool-proxy.net/proxies/http_proxy_list/sort:score/direction:desc/page:%s' % p] = \
+            (HTML, _page('<table><tr><th>IP</th></tr>%s</table>' % ''.join(trs)))
+
+def _proxynova(pages, rows, n_countries=20):
+    base = 'http://www.proxynova.com/proxy-server-list/'
+    options = ''.join('<option value="c%d">c%d</option>' % (i, i) \
+                      for i in xrange(n_countries))
+    pages[base] = (HTML, _page('<select name="proxy_country"><option value="">all</option>'
+                               '%s</select>' % options))
+    per_country = rows//n_countries
+    for c in xrange(n_countries):
+        trs = ''.join('<tr><td>%s</td><td>3128</td><td><time class="icon-check">12 secs</time></td>'
+                      '<td><div class="progress-bar" data-value="90"></div></td><td>95%%</td>'
+                      '<td>-</td><td>-</td></tr>' % _ip(c*per_country+i) \
+                      for i in xrange(per_country))
+        pages[base+'country-c%d' % c] = \
+            (HTML, _page('<table id="tbl_proxy_list"><tbody><tr><th>IP</th></tr>%s</tbody></table>' % trs))
+
+def _proxyhttp(pages, rows, n_pages=9):
+    per_page = rows//n_pages
+    for p in xrange(1, n_pages+1):
+        script = '<script>//<![CDATA[\nx1 = 4417; x2 = 3128^x1;\n//]]></script>'
+        trs = ''.join('<tr><td>%s</td><td><script>//<![CDATA[\ndocument.write(x2^x1);\n//]]>'
+                      '</script></td><td>-</td><td>-</td><td>-</td><td>00:01:10</td></tr>' % \
+                      _ip(p*per_page+i) for i in xrange(per_page))
+        pages['http://proxyhttp.net/free-list/anonymous-server-hide-ip-address/%s' % p] = \
+            (HTML, _page('<table class="proxytbl"><tr><th>IP</th></tr>%s</table>' % trs, script))
+
+def _samair(pages, rows, n_pages=3):
+    base = 'http://www.samair.ru/proxy/'
+    per_page = rows//n_pages
+    links = ''.join('<a class="page" href="proxy-%02d.htm">%d</a>' % (p, p) \
+                    for p in xrange(2, n_pages+1))
+    pages['http://www.samair.ru/js/vars.js'] = \
+        ('application/javascript', 'eval("var a=31;var b=28;")')
+    for p in xrange(1, n_pages+1):
+        trs = ''.join('<tr><td>%s<script type="text/javascript">document.write(":"+a+b)</script></td>'
+                      '<td>-</td><td>-</td><td>-</td></tr>' % _ip(p*per_page+i) \
+                      for i in xrange(per_page))
+        uri = base if p == 1 else base+'proxy-%02d.htm' % p
+        pages[uri] = (HTML, _page('<table id="proxylist"><tr><th>IP</th></tr>%s</table>%s' % \
+                                  (trs, links),
+                                  '<script type="text/javascript" src="/js/vars.js"></script>'))
+
+GENERATORS = {'freeproxylists': _freeproxylists,
+              'checkerproxy': _checkerproxy,
+              'letushide': _letushide,
+              'freeproxylist': _freeproxylist,
+              'proxy_ip_list': _proxy_ip_list,
+              'aliveproxy': _aliveproxy,
+              'cool_proxy': _cool_proxy,
+              'proxynova': _proxynova,
+              'proxyhttp': _proxyhttp,
+              'samair': _samair}
+
+def generate(sources, rows=1000):
+    """
+    Generate synthetic fixtures for proxy sources.
+
+    Parameters
+    ----------
+    sources : list of str
+        Names of the sources for which to generate pages.
+    rows : int
+        Approximate number of proxies listed by each source.
+
+    Returns
+    -------
+    result : dict
+        Fixture pages.
+    """
+
+    pages = {}
+    for source in sources:
+        GENERATORS[source](pages, rows)
+    return pages
+
+def record(fetcher, path):
+    """
+    Record all pages downloaded by a fetcher.
+
+    Parameters
+    ----------
+    fetcher : getprox.engine.Fetcher
+        Fetcher whose downloads are recorded.
+    path : str
+        Directory in which the pages and their index are saved.
+
+    Returns
+    -------
+    result : function
+        Function that saves the index of the recorded pages when called.
+    """
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    index = {}
+    lock = threading.Lock()
+    def save_page(r, *args, **kwargs):
+        name = hashlib.sha1(r.url).hexdigest()
+        with open(os.path.join(path, name), 'wb') as f:
+            f.write(r.content)
+        with lock:
+            index[r.url] = [name, r.headers.get('Content-Type', HTML)]
+        return r
+    def save_index():
+        with lock:
+            with open(os.path.join(path, 'index.json'), 'w') as f:
+                json.dump(index, f, indent=1)
+    fetcher.session.hooks['response'].append(save_page)
+    return save_index
+
+def load(path):
+    """
+    Load recorded fixtures.
+
+    Parameters
+    ----------
+    path : str
+        Directory containing pages saved by `record()`.
+
+    Returns
+    -------
+    result : dict
+        Fixture pages.
+    """
+
+    with open(os.path.join(path, 'index.json')) as f:
+        index = json.load(f)
+    pages = {}
+    for uri, (name, content_type) in index.iteritems():
+        with open(os.path.join(path, name), 'rb') as f:
+            pages[uri] = (content_type, f.read())
+    return pages
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+"""
+Local servers used for benchmarking.
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import BaseHTTPServer
+import random
+import socket
+import SocketServer
+import threading
+import time
+
+def _normalize(uri):
+    return uri.rstrip('/')
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+class _FixtureHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        page = self.server.pages.get(_normalize(self.path))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if page is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        content_type, body = page
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+class FixtureServer(object):
+    """
+    HTTP proxy server that serves fixture pages in place of the actual sites.
+
+    Parameters
+    ----------
+    pages : dict
+        Fixture pages; see `getprox.bench.fixtures`.
+    latency : float
+        Delay in seconds added to every response.
+
+    Notes
+    -----
+    Fetchers are directed to the server by using its `uri` as their HTTP
+    proxy, so that the getters' hard-coded site URIs need not be changed.
+    """
+
+    def __init__(self, pages, latency=0.0):
+        self.server = _ThreadingHTTPServer(('127.0.0.1', 0), _FixtureHandler)
+        self.server.pages = dict((_normalize(uri), page) \
+                                 for uri, page in pages.iteritems())
+        self.server.latency = latency
+        self.uri = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        t = threading.Thread(target=self.server.serve_forever)
+        t.daemon = True
+        t.start()
+
+    def close(self):
+        """
+        Stop the server.
+        """
+
+        self.server.shutdown()
+        self.server.server_close()
+
+class _ProxyHandler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        self.request.settimeout(10.0)
+        delay = self.server.setup
+        try:
+            while True:
+                data = self.request.recv(4096)
+                if not data:
+                    return
+                if self.server.blackhole:
+
+                    # Accept the request but never respond:
+                    time.sleep(10.0)
+                    return
+                time.sleep(delay+max(0.0, random.gauss(self.server.latency,
+                                                       self.server.jitter)))
+                delay = 0.0
+                keepalive = 'connection: keep-alive' in data.lower()
+                self.request.sendall('HTTP/1.1 200 OK\r\nContent-Length: 0\r\n'
+                                     'Connection: %s\r\n\r\n' % \
+                                     ('keep-alive' if keepalive else 'close'))
+                if not keepalive:
+                    return
+        except socket.error:
+            pass
+
+class _ProxyServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+class ProxyFleet(object):
+    """
+    Fleet of fake HTTP proxies listening on the loopback interface.
+
+    Parameters
+    ----------
+    n : int
+        Number of proxies.
+    latency : float
+        Mean response latency in seconds of live proxies.
+    jitter : float
+        Standard deviation of the response latency in seconds.
+    loss : float
+        Fraction of proxies that are not alive. Half of these refuse
+        connections and the other half accept connections but never respond.
+    setup : float
+        Delay in seconds added to the first response over every connection,
+        which simulates the cost of establishing connections to distant
+        proxies. Live proxies keep connections open if requested.
+
+    Attributes
+    ----------
+    uris : list of str
+        URIs of all proxies in the fleet.
+    live : set of str
+        URIs of the proxies that respond.
+    """
+
+    def __init__(self, n=100, latency=0.05, jitter=0.01, loss=0.5, setup=0.0):
+        self.servers = []
+        self.uris = []
+        self.live = set()
+        n_dead = int(round(n*loss))
+        for i in xrange(n):
+            if i < n_dead//2:
+
+                # Reserve a port that refuses connections:
+                s = socket.socket()
+                s.bind(('127.0.0.1', 0))
+                port = s.getsockname()[1]
+                s.close()
+                self.uris.append('http://127.0.0.1:%d' % port)
+                continue
+            server = _ProxyServer(('127.0.0.1', 0), _ProxyHandler)
+            server.latency = latency
+            server.jitter = jitter
+            server.setup = setup
+            server.blackhole = i < n_dead
+            t = threading.Thread(target=server.serve_forever)
+            t.daemon = True
+            t.start()
+            self.servers.append(server)
+            uri = 'http://127.0.0.1:%d' % server.server_address[1]
+            self.uris.append(uri)
+            if not server.blackhole:
+                self.live.add(uri)
+
+    def close(self):
+        """
+        Stop all proxies.
+        """
+
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
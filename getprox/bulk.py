@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+
+"""
+Streaming ingestion of bulk proxy lists.
+
+Notes
+-----
+Bulk lists are plain text files with one `host:port` address per line,
+optionally compressed with gzip or packed in zip archives. Lists are read in
+chunks (downloads with `stream=True`, local files through `mmap`) that are
+decompressed and scanned for addresses incrementally, so that a list of any
+size is ingested in constant memory.
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import itertools
+import mmap
+import os
+import re
+import struct
+import zlib
+
+import proxy
+
+CHUNK_SIZE = 65536
+
+# Lines longer than this are assumed not to contain an address:
+_MAX_LINE = 4096
+
+# Lines containing a single address (optionally as a URI); IPv4 addresses are
+# matched by their octets:
+_address = re.compile(r'^[ \t]*(?:https?://)?(?:(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})|'
+                      r'([\w.\-]+)):(\d{1,5})/?[ \t\r]*$', re.M)
+
+def read_file(path):
+    """
+    Read a local file in chunks through a memory map.
+
+    Parameters
+    ----------
+    path : str
+        File path.
+
+    Returns
+    -------
+    result : iterator of str
+        Consecutive chunks of the file.
+    """
+
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for i in xrange(0, size, CHUNK_SIZE):
+                yield m[i:i+CHUNK_SIZE]
+        finally:
+            m.close()
+
+class _Reader(object):
+    """
+    Reader of a stream of chunks that supports pushing data back.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buf = ''
+
+    def read(self, n):
+        parts = [self.buf]
+        size = len(self.buf)
+        while size < n:
+            chunk = next(self.chunks, '')
+            if not chunk:
+                break
+            parts.append(chunk)
+            size += len(chunk)
+        data = ''.join(parts)
+        self.buf = data[n:]
+        return data[:n]
+
+    def chunk(self):
+        if self.buf:
+            data, self.buf = self.buf, ''
+            return data
+        return next(self.chunks, '')
+
+    def unread(self, data):
+        self.buf = data+self.buf
+
+def _gunzip(chunks):
+    d = zlib.decompressobj(16+zlib.MAX_WBITS)
+    for chunk in chunks:
+        while chunk:
+            yield d.decompress(chunk)
+
+            # Concatenated gzip members are decompressed in turn:
+            chunk = d.unused_data
+            if chunk:
+                yield d.flush()
+                d = zlib.decompressobj(16+zlib.MAX_WBITS)
+    yield d.flush()
+
+# Zip local file header and compression methods:
+_local_header = struct.Struct('<IHHHHHIIIHH')
+_LOCAL_SIGNATURE = 0x04034b50
+_DESCRIPTOR_SIGNATURE = 'PK\x07\x08'
+_STORED = 0
+_DEFLATED = 8
+
+def _unzip(chunks):
+
+    # Members are read sequentially from their local headers so that the
+    # central directory at the end of the archive is not needed:
+    r = _Reader(chunks)
+    while True:
+        header = r.read(_local_header.size)
+        if len(header) < _local_header.size:
+            return
+        signature, version, flags, method, mtime, mdate, crc, compressed, \
+            size, name_length, extra_length = _local_header.unpack(header)
+        if signature != _LOCAL_SIGNATURE:
+            return
+        r.read(name_length+extra_length)
+        if method == _DEFLATED:
+            d = zlib.decompressobj(-zlib.MAX_WBITS)
+        elif method == _STORED and not flags & 8:
+            d = None
+        else:
+            raise ValueError('unsupported zip member compression method')
+        remaining = None if flags & 8 else compressed
+        while remaining != 0:
+            data = r.chunk()
+            if not data:
+                raise ValueError('truncated zip archive')
+            if remaining is not None:
+                if len(data) > remaining:
+                    r.unread(data[remaining:])
+                    data = data[:remaining]
+                remaining -= len(data)
+            if d is None:
+                yield data
+                continue
+            yield d.decompress(data)
+            if d.unused_data:
+                r.unread(d.unused_data)
+                break
+        if d is not None:
+            yield d.flush()
+
+        # Lines of consecutive members are not joined:
+        yield '\n'
+
+        # Skip the data descriptor that follows members of unknown size:
+        if flags & 8:
+            descriptor = r.read(4)
+            r.read(12 if descriptor == _DESCRIPTOR_SIGNATURE else 8)
+
+def decompress(chunks):
+    """
+    Decompress a stream of chunks.
+
+    Parameters
+    ----------
+    chunks : iterable of str
+        Chunks of a gzip file, zip archive, or uncompressed file; the format
+        is determined from the first bytes.
+
+    Returns
+    -------
+    result : iterator of str
+        Chunks of the decompressed data; the contents of all members of zip
+        archives are concatenated, separated by newlines.
+    """
+
+    chunks = iter(chunks)
+    head = ''
+    for chunk in chunks:
+        head += chunk
+        if len(head) >= 4:
+            break
+    chunks = itertools.chain([head], chunks)
+    if head.startswith('PK\x03\x04'):
+        decoded = _unzip(chunks)
+    elif head.startswith('\x1f\x8b'):
+        decoded = _gunzip(chunks)
+    else:
+        decoded = chunks
+    for chunk in decoded:
+        if chunk:
+            yield chunk
+
+def _array(addresses):
+    result = proxy.ProxyArray()
+    ips, ports = result.ips, result.ports
+    for a, b, c, d, host, port in addresses:
+        port = int(port)
+        if not 0 < port < 65536:
+            continue
+        if not host:
+            a, b, c, d = int(a), int(b), int(c), int(d)
+            if a and a < 256 and b < 256 and c < 256 and d < 256:
+                ips.append(a << 24 | b << 16 | c << 8 | d)
+                ports.append(port)
+            continue
+        result.append(proxy.Proxy(host, port))
+    return result
+
+def proxies(chunks):
+    """
+    Extract proxies from a stream of text chunks.
+
+    Parameters
+    ----------
+    chunks : iterable of str
+        Chunks of text with one `host:port` address (or proxy URI) per line.
+        Other lines are ignored.
+
+    Returns
+    -------
+    result : iterator of getprox.proxy.ProxyArray
+        Proxies listed in each chunk.
+    """
+
+    tail = ''
+    for chunk in chunks:
+        data = tail+chunk
+        end = data.rfind('\n')+1
+        tail = data[end:]
+        if len(tail) > _MAX_LINE:
+            tail = ''
+        if end:
+            yield _array(_address.findall(data, 0, end))
+    if tail:
+        yield _array(_address.findall(tail))
+
+def ingest(fetcher, chunks):
+    """
+    Extract proxies from a stream of chunks of a bulk list.
+
+    Parameters
+    ----------
+    fetcher : getprox.engine.Fetcher
+        Fetcher whose I/O workers read the chunks.
+    chunks : iterable of str
+        Chunks of a possibly compressed bulk list.
+
+    Returns
+    -------
+    result : getprox.engine.Stream
+        Stream whose batches each contain a single `getprox.proxy.ProxyArray`.
+    """
+
+    return fetcher.stream(proxies(decompress(chunks)), 1)
+
+def is_bulk(source):
+    """
+    Return True if a source refers to a bulk list rather than a getter.
+    """
+
+    return '://' in source or os.sep in source or os.path.isfile(source)
+
+def getter(source):
+    """
+    Return a getter that ingests a bulk list.
+
+    Parameters
+    ----------
+    source : str
+        URI or path of a bulk list; paths may also be specified as `file://`
+        URIs.
+
+    Returns
+    -------
+    result : function
+        Getter named after the source.
+    """
+
+    def get(fetcher):
+        r = None
+        if '://' not in source or source.startswith('file://'):
+            stream = ingest(fetcher, read_file(source.split('file://', 1)[-1]))
+        else:
+            r = yield fetcher.get(source, stream=True)
+            stream = ingest(fetcher, r.iter_content(CHUNK_SIZE))
+        try:
+            while True:
+                batch = yield stream.next()
+                if batch is None:
+                    break
+                yield batch[0]
+        finally:
+            if r is not None:
+                r.close()
+    get.__name__ = str(source)
+    return get
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+"""
+Persistent cache of downloaded proxy source pages.
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import requests
+
+def _response(uri, content, encoding):
+    """
+    Construct a response object for a cached page.
+    """
+
+    r = requests.Response()
+    r.status_code = 200
+    r.url = uri
+    r.encoding = encoding
+    r._content = content
+    return r
+
+def parser_key(parse):
+    """
+    Return a string that identifies a page parsing function and its bound
+    arguments.
+    """
+
+    if isinstance(parse, functools.partial):
+        return '%s%r%r' % (parser_key(parse.func), parse.args,
+                           sorted((parse.keywords or {}).items()))
+    return '%s.%s' % (parse.__module__, parse.__name__)
+
+class PageCache(object):
+    """
+    Persistent cache of downloaded pages and parsed results.
+
+    Pages are stored in an SQLite database together with their validators
+    and a hash of their contents. A page that was downloaded within the TTL of
+    its source is served from the cache without contacting the site; older
+    pages are revalidated with a conditional request. If a page's contents
+    have not changed since it was last parsed, the previously parsed rows are
+    returned without parsing it again.
+
+    Parameters
+    ----------
+    path : str
+        Database file. If None, `~/.getprox/cache.sqlite` is used.
+    ttl : float
+        Default time in seconds during which cached pages are used without
+        revalidation.
+    source_ttl : dict
+        TTLs in seconds for specific sources that override `ttl`.
+    """
+
+    def __init__(self, path=None, ttl=300.0, source_ttl=None):
+        if path is None:
+            path = os.path.join(os.path.expanduser('~'), '.getprox',
+                                'cache.sqlite')
+        d = os.path.dirname(path)
+        if d and not os.path.isdir(d):
+            os.makedirs(d)
+        self.path = path
+        self.ttl = ttl
+        if source_ttl is None:
+            source_ttl = {}
+        self.source_ttl = source_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.executescript('''
+                CREATE TABLE IF NOT EXISTS pages (
+                    uri TEXT PRIMARY KEY,
+                    fetched REAL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    digest TEXT,
+                    encoding TEXT,
+                    content BLOB);
+                CREATE TABLE IF NOT EXISTS parsed (
+                    uri TEXT,
+                    parser TEXT,
+                    digest TEXT,
+                    rows TEXT,
+                    PRIMARY KEY (uri, parser));
+            ''')
+            self._conn.commit()
+
+    def ttl_for(self, source):
+        """
+        Return the TTL of the specified source.
+        """
+
+        return self.source_ttl.get(source, self.ttl)
+
+    def fetch(self, session, uri, source=None, **kwargs):
+        """
+        Retrieve a page from the cache or from its site.
+
+        Parameters
+        ----------
+        session : requests.Session
+            Session used to download the page.
+        uri : str
+            Page URI.
+        source : str
+            Name of the source that requested the page.
+        kwargs : dict
+            Extra arguments passed to `requests.Session.get`.
+
+        Returns
+        -------
+        r : requests.Response
+            Page response.
+        digest : str
+            Hash of the page contents, or None if the page was not cached.
+        """
+
+        with self._lock:
+            entry = self._conn.execute('SELECT fetched, etag, last_modified, '
+                                       'digest, encoding, content FROM pages '
+                                       'WHERE uri=?', (uri,)).fetchone()
+        if entry is not None:
+            fetched, etag, last_modified, digest, encoding, content = entry
+            if time.time()-fetched < self.ttl_for(source):
+                return _response(uri, str(content), encoding), digest
+
+            # Revalidate the cached page:
+            headers = dict(kwargs.pop('headers', None) or {})
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+            kwargs['headers'] = headers
+
+        r = session.get(uri, **kwargs)
+        if entry is not None and r.status_code == 304:
+            with self._lock:
+                self._conn.execute('UPDATE pages SET fetched=? WHERE uri=?',
+                                   (time.time(), uri))
+                self._conn.commit()
+            return _response(uri, str(content), encoding), digest
+        if r.status_code != 200:
+            return r, None
+
+        digest = hashlib.sha1(r.content).hexdigest()
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO pages VALUES '
+                               '(?, ?, ?, ?, ?, ?, ?)',
+                               (uri, time.time(), r.headers.get('ETag'),
+                                r.headers.get('Last-Modified'), digest,
+                                r.encoding, sqlite3.Binary(r.content)))
+            self._conn.commit()
+        return r, digest
+
+    def parse(self, uri, digest, parse, r, call=None):
+        """
+        Parse a page unless its contents have already been parsed.
+
+        Parameters
+        ----------
+        uri : str
+            Page URI.
+        digest : str
+            Hash of the page contents returned by `fetch()`. If None, the page
+            is always parsed.
+        parse : function
+            Function that accepts a response and returns JSON-serializable rows.
+        r : requests.Response
+            Page response.
+        call : function
+            Function that accepts `parse` and `r` and returns the parsed rows;
+            used to parse pages elsewhere (e.g., in another process). If None,
+            `parse` is called directly.
+
+        Returns
+        -------
+        rows : object
+            Parsed rows.
+        """
+
+        if call is None:
+            call = lambda parse, r: parse(r)
+        if digest is None:
+            return call(parse, r)
+        key = parser_key(parse)
+        with self._lock:
+            entry = self._conn.execute('SELECT digest, rows FROM parsed '
+                                       'WHERE uri=? AND parser=?',
+                                       (uri, key)).fetchone()
+        if entry is not None and entry[0] == digest:
+            return json.loads(entry[1])
+        rows = call(parse, r)
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO parsed VALUES '
+                               '(?, ?, ?, ?)',
+                               (uri, key, digest, json.dumps(rows)))
+            self._conn.commit()
+        return rows
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+"""
+Adaptive concurrency and timeout control for proxy testing.
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import collections
+import errno
+import threading
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Errors that indicate exhaustion of local resources rather than a dead proxy:
+LOCAL_ERRNOS = set([errno.EMFILE, errno.ENFILE, errno.ENOBUFS,
+                    errno.EADDRNOTAVAIL, errno.ENOMEM])
+
+def is_local_error(e):
+    """
+    Return True if an exception was caused by exhaustion of local resources.
+
+    Parameters
+    ----------
+    e : Exception
+        Exception raised by a probe; exceptions wrapped by `requests` and
+        `urllib3` are examined recursively.
+    """
+
+    seen = set()
+    while e is not None and id(e) not in seen:
+        seen.add(id(e))
+        if isinstance(e, EnvironmentError) and e.errno in LOCAL_ERRNOS:
+            return True
+        nested = getattr(e, 'reason', None)
+        if nested is None and getattr(e, 'args', None):
+            nested = e.args[0]
+        e = nested if isinstance(nested, Exception) else None
+    return False
+
+class AdaptiveController(object):
+    """
+    Adjust probe concurrency and timeout to observed network conditions.
+
+    Concurrency is controlled with an additive-increase/multiplicative-decrease
+    (AIMD) rule applied after every window of probes: it is decreased
+    whenever probes fail because of local resource exhaustion or the fraction
+    of timed out probes rises above its smoothed baseline, and increased
+    otherwise. The probe timeout is set to a multiple of the 95th percentile of
+    the latencies of recent successful probes.
+
+    Parameters
+    ----------
+    concurrency : int
+        Initial number of concurrent probes.
+    min_concurrency, max_concurrency : int
+        Bounds on the number of concurrent probes. The upper bound is reduced
+        to half the limit on open file descriptors if the latter is lower.
+    increase : int
+        Additive increase applied after a window without congestion.
+    decrease : float
+        Multiplicative decrease factor applied after a congested window.
+    window : int
+        Number of probes in each window.
+    tolerance : float
+        Increase in the timeout fraction over its baseline that is treated as
+        congestion.
+    timeout : float
+        Initial probe timeout in seconds.
+    min_timeout, max_timeout : float
+        Bounds on the probe timeout in seconds.
+    k : float
+        Multiple of the 95th latency percentile used as the probe timeout.
+    samples : int
+        Number of recent successful probe latencies kept.
+    """
+
+    def __init__(self, concurrency=10, min_concurrency=2, max_concurrency=256,
+                 increase=2, decrease=0.5, window=50, tolerance=0.1,
+                 timeout=1.0, min_timeout=0.25, max_timeout=10.0, k=3.0,
+                 samples=500):
+        if resource is not None:
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            if soft != resource.RLIM_INFINITY:
+                max_concurrency = max(min_concurrency,
+                                      min(max_concurrency, soft//2))
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.increase = increase
+        self.decrease = decrease
+        self.window = window
+        self.tolerance = tolerance
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.k = k
+        self._lock = threading.Lock()
+        self._concurrency = max(min_concurrency, min(concurrency, max_concurrency))
+        self._timeout = timeout
+        self._latencies = collections.deque(maxlen=samples)
+        self._baseline = None
+        self._counts = collections.Counter()
+        self._window_counts = collections.Counter()
+
+    @property
+    def concurrency(self):
+        """
+        Current number of concurrent probes.
+        """
+
+        return self._concurrency
+
+    @property
+    def timeout(self):
+        """
+        Current probe timeout in seconds.
+        """
+
+        return self._timeout
+
+    def record(self, ok, latency, timed_out=False, local_error=False):
+        """
+        Record the outcome of a probe.
+
+        Parameters
+        ----------
+        ok : bool
+            True if the proxy responded.
+        latency : float
+            Time in seconds taken by the probe.
+        timed_out : bool
+            True if the probe timed out.
+        local_error : bool
+            True if the probe failed because of exhaustion of local resources.
+        """
+
+        if ok:
+            outcome = 'ok'
+        elif timed_out:
+            outcome = 'timeout'
+        elif local_error:
+            outcome = 'local_error'
+        else:
+            outcome = 'error'
+        with self._lock:
+            self._counts[outcome] += 1
+            self._window_counts[outcome] += 1
+            if ok:
+                self._latencies.append(latency)
+            if sum(self._window_counts.values()) >= self.window:
+                self._adjust()
+
+    def _adjust(self):
+        n = float(sum(self._window_counts.values()))
+        timeout_rate = self._window_counts['timeout']/n
+        congested = self._window_counts['local_error'] > 0 or \
+            (self._baseline is not None and \
+             timeout_rate > self._baseline+self.tolerance)
+        if congested:
+            self._concurrency = max(self.min_concurrency,
+                                    int(self._concurrency*self.decrease))
+        else:
+            self._concurrency = min(self.max_concurrency,
+                                    self._concurrency+self.increase)
+            if self._baseline is None:
+                self._baseline = timeout_rate
+            else:
+                self._baseline = 0.8*self._baseline+0.2*timeout_rate
+        self._window_counts.clear()
+
+        # Derive the timeout from the latencies of live proxies:
+        if len(self._latencies) >= 20:
+            latencies = sorted(self._latencies)
+            p95 = latencies[int(0.95*(len(latencies)-1))]
+            self._timeout = max(self.min_timeout,
+                                min(self.max_timeout, self.k*p95))
+
+    def stats(self):
+        """
+        Return the current control values and outcome counts.
+
+        Returns
+        -------
+        result : dict
+            Current concurrency and timeout, the 95th latency percentile of
+            recent live probes, the baseline timeout fraction, and the number
+            of probes with each outcome.
+        """
+
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {'concurrency': self._concurrency,
+                    'timeout': self._timeout,
+                    'p95_latency': latencies[int(0.95*(len(latencies)-1))] \
+                    if latencies else None,
+                    'baseline_timeout_rate': self._baseline,
+                    'outcomes': dict(self._counts)}
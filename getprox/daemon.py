@@ -0,0 +1,481 @@
+#!/usr/bin/env python
+
+"""
+Long-running proxy pool with a local query API.
+
+Notes
+-----
+A `Pool` keeps a set of live proxies current in the background and can be
+served to other processes over HTTP on a local TCP port or Unix socket with
+`serve()`; the daemon may be started from the command line with ::
+
+    python -m getprox.daemon --port 8765 --target 100
+
+Clients obtain proxies with `GET /proxies?k=5`, report proxies that failed with
+`POST /failed?uri=http://host:port`, and may inspect the pool with `GET /stats`
+and `GET /metrics` (Prometheus text format). `Client` implements these
+requests over a persistent connection.
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import argparse
+import BaseHTTPServer
+import collections
+import httplib
+import json
+import os
+import socket
+import SocketServer
+import threading
+import time
+import urllib
+import urlparse
+
+import pg
+import proxy
+
+class Pool(object):
+    """
+    Pool of live proxies maintained in the background.
+
+    Parameters
+    ----------
+    sources : list of str
+        Proxy sources. If None, proxies from all available sources are
+        retrieved.
+    target : int
+        Number of live proxies to maintain. Whenever the pool holds fewer
+        proxies, all sources are retrieved again (at most once every
+        `min_refresh_interval` seconds) and the listed proxies that are not
+        pooled, including those that failed earlier tests, are tested
+        again.
+    refresh_interval : float
+        Interval in seconds between refreshes of stale sources.
+    min_refresh_interval : float
+        Minimum interval in seconds between refreshes.
+    retest_interval : float
+        Interval in seconds between tests of the pooled proxies; proxies that
+        fail are evicted.
+    max_failures : int
+        Number of failures reported by clients after which a proxy is
+        evicted.
+    evict_ttl : float
+        Time in seconds after which an evicted proxy may rejoin the pool if
+        it is still listed and passes a test.
+    kwargs : dict
+        Extra arguments passed to `getprox.ProxyGet`; proxies are always
+        tested, and unless a result cache is specified, re-tests always
+        probe the pooled proxies.
+
+    Notes
+    -----
+    Lookups only read the in-memory pool; retrieval and testing happen in
+    the background.
+    """
+
+    def __init__(self, *sources, **kwargs):
+        self.target = kwargs.pop('target', 100)
+        self.refresh_interval = kwargs.pop('refresh_interval', 600.0)
+        self.min_refresh_interval = kwargs.pop('min_refresh_interval', 60.0)
+        self.retest_interval = kwargs.pop('retest_interval', 300.0)
+        self.max_failures = kwargs.pop('max_failures', 3)
+        self.evict_ttl = kwargs.pop('evict_ttl', 1800.0)
+        kwargs['test'] = True
+        kwargs.setdefault('results', None)
+        self._lock = threading.Lock()
+        self._live = collections.OrderedDict()
+        self._order = []
+        self._next = 0
+        self._evicted = {}
+        self._retesting = False
+        self._recovering = False
+        self._closed = threading.Event()
+        self.proxy_get = pg.ProxyGet(*sources, **kwargs)
+        self.proxy_get.subscribe(self._add, test=True)
+        t = threading.Thread(target=self._maintain)
+        t.daemon = True
+        t.start()
+
+    def __len__(self):
+        return len(self._live)
+
+    def _add(self, uri):
+        with self._lock:
+            if uri in self._live:
+                return
+            if uri in self._evicted:
+                if self._evicted[uri] > time.time():
+                    return
+                del self._evicted[uri]
+            self._live[uri] = 0
+            if self._order is not None:
+                self._order.append(uri)
+
+    def _evict(self, uri):
+        if self._live.pop(uri, None) is not None:
+            self._order = None
+            self._evicted[uri] = time.time()+self.evict_ttl
+
+    def take(self, k=1):
+        """
+        Return pooled proxies.
+
+        Parameters
+        ----------
+        k : int
+            Number of proxies to return. Consecutive calls cycle through the
+            pool so that load is spread over all proxies.
+
+        Returns
+        -------
+        result : list of str
+            At most `k` proxy URIs.
+        """
+
+        with self._lock:
+            if self._order is None:
+                self._order = list(self._live)
+            n = len(self._order)
+            k = min(k, n)
+            result = [self._order[(self._next+i) % n] for i in xrange(k)]
+            self._next = (self._next+k) % n if n else 0
+        return result
+
+    def report_failed(self, uri):
+        """
+        Report that a proxy failed.
+
+        Parameters
+        ----------
+        uri : str
+            Proxy URI.
+
+        Returns
+        -------
+        result : bool
+            True if the proxy was evicted from the pool.
+        """
+
+        if self.proxy_get.health is not None:
+            self.proxy_get.health.record(uri, False, None, 'client')
+        with self._lock:
+            if uri not in self._live:
+                return False
+            self._live[uri] += 1
+            if self._live[uri] < self.max_failures:
+                return False
+            self._evict(uri)
+        return True
+
+    def stats(self):
+        """
+        Return the state of the pool.
+
+        Returns
+        -------
+        result : dict
+            Number of live and evicted proxies and the target size.
+        """
+
+        with self._lock:
+            return {'live': len(self._live), 'evicted': len(self._evicted),
+                    'target': self.target}
+
+    def close(self):
+        """
+        Stop maintaining the pool.
+        """
+
+        self._closed.set()
+        self.proxy_get.stop()
+        if hasattr(self.proxy_get.tester, 'close'):
+            self.proxy_get.tester.close()
+
+    def _maintain(self):
+        last_refresh = last_retest = time.time()
+        while not self._closed.wait(1.0):
+            now = time.time()
+            if now-last_refresh >= self.refresh_interval:
+                self._refresh(None)
+                last_refresh = now
+            elif len(self) < self.target and \
+                 now-last_refresh >= self.min_refresh_interval:
+                self._refresh(0)
+                last_refresh = now
+            if now-last_retest >= self.retest_interval:
+                self._retest()
+                last_retest = now
+
+    def _refresh(self, max_age):
+        self.proxy_get.refresh(max_age).add_done_callback(self._refreshed)
+
+    def _refreshed(self, f):
+
+        # Drop proxies that are no longer listed by any source and evictions
+        # that have expired:
+        listed = self.proxy_get.get(test=False)
+        current = set(listed)
+        now = time.time()
+        with self._lock:
+            for uri in [uri for uri in self._live if uri not in current]:
+                del self._live[uri]
+                self._order = None
+            self._evicted = dict((uri, expires) for uri, expires in \
+                                 self._evicted.iteritems() \
+                                 if expires > now and uri in current)
+
+            # ProxyGet only tests newly listed proxies; when the pool is too
+            # small, the other listed proxies are tested again:
+            if len(self._live) >= self.target or self._recovering:
+                return
+            uris = [uri for uri in listed \
+                    if uri not in self._live and uri not in self._evicted]
+            if not uris:
+                return
+            self._recovering = True
+        def tested(f):
+            if f.exception() is None:
+                for uri in f.result().uris():
+                    self._add(uri)
+            with self._lock:
+                self._recovering = False
+        self.proxy_get.tester.test_async(proxy.ProxyArray(uris)).add_done_callback(tested)
+
+    def _retest(self):
+        with self._lock:
+            if self._retesting or not self._live:
+                return
+            self._retesting = True
+            uris = list(self._live)
+        def tested(f):
+            alive = set(f.result().uris()) if f.exception() is None else set(uris)
+            with self._lock:
+                for uri in uris:
+                    if uri not in alive:
+                        self._evict(uri)
+                self._retesting = False
+        self.proxy_get.tester.test_async(proxy.ProxyArray(uris)).add_done_callback(tested)
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # Buffer each response so that it is sent in a single segment:
+    wbufsize = -1
+
+    def log_message(self, *args):
+        pass
+
+    def address_string(self):
+        return 'local'
+
+    def _send(self, code, body, content_type='application/json'):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, query, post=False):
+        pool = self.server.pool
+        path = urlparse.urlsplit(self.path).path
+        try:
+            if path == '/proxies':
+                body = json.dumps(pool.take(int(query.get('k', ['1'])[0])))
+            elif path == '/failed':
+
+                # Requests that change the pool must not be sent with GET:
+                if not post:
+                    self._send(405, json.dumps({'error': 'method not allowed'}))
+                    return
+                body = json.dumps({'evicted': pool.report_failed(query['uri'][0])})
+            elif path == '/stats':
+                body = json.dumps(pool.stats())
+            elif path == '/metrics':
+                self._send(200, pool.proxy_get.metrics.prometheus(),
+                           'text/plain; version=0.0.4')
+                return
+            else:
+                self._send(404, json.dumps({'error': 'not found'}))
+                return
+        except (KeyError, ValueError) as e:
+            self._send(400, json.dumps({'error': 'bad request: %s' % e}))
+            return
+        self._send(200, body)
+
+    def do_GET(self):
+        self._handle(urlparse.parse_qs(urlparse.urlsplit(self.path).query))
+
+    def do_POST(self):
+        query = urlparse.parse_qs(urlparse.urlsplit(self.path).query)
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            for k, v in urlparse.parse_qs(self.rfile.read(length)).iteritems():
+                query.setdefault(k, []).extend(v)
+        self._handle(query, True)
+
+class _TCPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+def serve(pool, address):
+    """
+    Create a server for a proxy pool.
+
+    Parameters
+    ----------
+    pool : Pool
+        Proxy pool.
+    address : tuple or str
+        Host and port on which to listen, or path of a Unix socket.
+
+    Returns
+    -------
+    server : SocketServer.BaseServer
+        Server; call its `serve_forever()` method to handle requests.
+    """
+
+    if isinstance(address, basestring):
+        if os.path.exists(address):
+            os.unlink(address)
+        server = _UnixServer(address, _Handler)
+    else:
+        server = _TCPServer(address, _Handler)
+    server.pool = pool
+    return server
+
+class _UnixHTTPConnection(httplib.HTTPConnection):
+    def __init__(self, path, timeout):
+        httplib.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+class Client(object):
+    """
+    Client of a proxy pool server.
+
+    Parameters
+    ----------
+    address : tuple or str
+        Host and port of the server, or path of its Unix socket.
+    timeout : float
+        Request timeout in seconds.
+
+    Notes
+    -----
+    Requests are sent over a single persistent connection; instances should
+    not be shared between threads.
+    """
+
+    def __init__(self, address, timeout=5.0):
+        if isinstance(address, basestring):
+            self.conn = _UnixHTTPConnection(address, timeout)
+        else:
+            self.conn = httplib.HTTPConnection(address[0], address[1],
+                                               timeout=timeout)
+
+    def _request(self, method, path):
+        try:
+            self.conn.request(method, path)
+            r = self.conn.getresponse()
+        except (httplib.HTTPException, socket.error):
+
+            # Reconnect once if the persistent connection was closed:
+            self.conn.close()
+            self.conn.request(method, path)
+            r = self.conn.getresponse()
+        body = r.read()
+        if r.status != 200:
+            raise ValueError('request failed: %s' % body)
+        return body
+
+    def take(self, k=1):
+        """
+        Return at most `k` proxy URIs from the pool.
+        """
+
+        return json.loads(self._request('GET', '/proxies?k=%d' % k))
+
+    def report_failed(self, uri):
+        """
+        Report that a proxy failed; returns True if it was evicted.
+        """
+
+        return json.loads(self._request('POST', '/failed?' + \
+                                        urllib.urlencode({'uri': uri})))['evicted']
+
+    def stats(self):
+        """
+        Return the state of the pool.
+        """
+
+        return json.loads(self._request('GET', '/stats'))
+
+    def close(self):
+        """
+        Close the connection to the server.
+        """
+
+        self.conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m getprox.daemon',
+                                     description='Maintain a pool of live '
+                                     'proxies and serve it to local clients.')
+    parser.add_argument('sources', nargs='*',
+                        help='proxy sources (default: all)')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address on which to listen')
+    parser.add_argument('--port', type=int, default=8765,
+                        help='port on which to listen')
+    parser.add_argument('--unix', metavar='PATH',
+                        help='listen on a Unix socket instead of a TCP port')
+    parser.add_argument('--target', type=int, default=100,
+                        help='number of live proxies to maintain')
+    parser.add_argument('--refresh', type=float, default=600.0,
+                        help='interval between source refreshes (seconds)')
+    parser.add_argument('--retest', type=float, default=300.0,
+                        help='interval between proxy re-tests (seconds)')
+    parser.add_argument('--max-failures', type=int, default=3,
+                        help='client failure reports before eviction')
+    parser.add_argument('--evict-ttl', type=float, default=1800.0,
+                        help='time before an evicted proxy may rejoin the '
+                        'pool (seconds)')
+    parser.add_argument('--tester', default='requests',
+                        choices=['requests', 'socket'], help='proxy tester')
+    parser.add_argument('--keepalive', type=int, default=0, metavar='N',
+                        help='persistent connections kept to live proxies '
+                        'for re-tests (socket tester only)')
+    parser.add_argument('--cache', action='store_true',
+                        help='keep a persistent page cache')
+    parser.add_argument('--health', action='store_true',
+                        help='keep a persistent proxy health database')
+    args = parser.parse_args(argv)
+
+    pool = Pool(*args.sources, target=args.target,
+                refresh_interval=args.refresh, retest_interval=args.retest,
+                max_failures=args.max_failures, evict_ttl=args.evict_ttl,
+                tester=args.tester,
+                keepalive=args.keepalive,
+                cache=args.cache or None, health=args.health or None)
+    server = serve(pool, args.unix or (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,405 @@
+#!/usr/bin/env python
+
+"""
+Deobfuscation of JavaScript used to hide proxy ports.
+
+Notes
+-----
+Sites obfuscate ports with short scripts that assign numbers to variables
+and compute ports with arithmetic, bitwise, and string concatenation
+expressions. Such scripts are interpreted by a small evaluator that does not
+execute any scraped code; scripts and expressions that it does not support
+are rejected with `ParserError`. Scripts compressed with Dean Edwards'
+packer are unpacked without running the packer's code. Unpacked scripts and
+the variables assigned by each script are cached by the hash of the script.
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import hashlib
+import math
+import re
+import threading
+
+
+_token = re.compile(r'''\s*(?:
+    (?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?) |
+    (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*') |
+    (?P<name>[A-Za-z_$][\w$]*) |
+    (?P<op>>>>|<<|>>|[-+*/%&|^~(),]))''', re.VERBOSE | re.DOTALL)
+
+_escape = re.compile(r'\\(x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|.)', re.DOTALL)
+_escapes = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', 'v': '\v',
+            '0': '\0'}
+
+class ParserError(ValueError):
+    """
+    Raised when a script or expression is not supported by the evaluator.
+    """
+
+    pass
+
+def _unescape(m):
+    c = m.group(1)
+    if len(c) > 1:
+        return unichr(int(c[1:], 16))
+    return _escapes.get(c, c)
+
+def _int32(x):
+
+    # NaN and infinities are converted to 0 as in JavaScript:
+    if x != x or x in (float('inf'), float('-inf')):
+        return 0
+    x = int(x) & 0xffffffff
+    return x-0x100000000 if x & 0x80000000 else x
+
+def _to_number(x):
+    if isinstance(x, basestring):
+        x = x.strip()
+        if not x:
+            return 0
+        try:
+            return int(x, 16) if x[:2] in ('0x', '0X') else float(x)
+        except ValueError:
+            return float('nan')
+    return x
+
+def to_string(x):
+    """
+    Convert a value to a string in the same way as JavaScript's `String()`.
+    """
+
+    if isinstance(x, basestring):
+        return x
+    if isinstance(x, float):
+        if x != x:
+            return 'NaN'
+        if x == int(x) and abs(x) < 1e21:
+            return '%d' % x
+        return repr(x)
+    return '%d' % x
+
+def _add(a, b):
+    if isinstance(a, basestring) or isinstance(b, basestring):
+        return to_string(a)+to_string(b)
+    return a+b
+
+def _div(a, b):
+    a, b = _to_number(a), _to_number(b)
+    if b == 0:
+        return float('nan') if a == 0 or a != a else math.copysign(float('inf'), a)
+    return float(a)/b
+
+def _mod(a, b):
+    a, b = _to_number(a), _to_number(b)
+    if b == 0:
+        return float('nan')
+    r = math.fmod(a, b)
+    return int(r) if isinstance(a, (int, long)) and isinstance(b, (int, long)) else r
+
+# Binary operators and their precedence:
+_binary = {'|': (1, lambda a, b: _int32(_to_number(a)) | _int32(_to_number(b))),
+           '^': (2, lambda a, b: _int32(_to_number(a)) ^ _int32(_to_number(b))),
+           '&': (3, lambda a, b: _int32(_to_number(a)) & _int32(_to_number(b))),
+           '<<': (4, lambda a, b: _int32(_int32(_to_number(a)) << (_int32(_to_number(b)) & 31))),
+           '>>': (4, lambda a, b: _int32(_to_number(a)) >> (_int32(_to_number(b)) & 31)),
+           '>>>': (4, lambda a, b: (_int32(_to_number(a)) & 0xffffffff) >> \
+                   (_int32(_to_number(b)) & 31)),
+           '+': (5, _add),
+           '-': (5, lambda a, b: _to_number(a)-_to_number(b)),
+           '*': (6, lambda a, b: _to_number(a)*_to_number(b)),
+           '/': (6, _div),
+           '%': (6, _mod)}
+
+_unary = {'-': lambda a: -_to_number(a),
+          '+': _to_number,
+          '~': lambda a: ~_int32(_to_number(a))}
+
+_functions = {'String': to_string,
+              'Number': _to_number}
+
+def _tokenize(expr):
+    tokens = []
+    pos = 0
+    expr = expr.rstrip()
+    while pos < len(expr):
+        m = _token.match(expr, pos)
+        if m is None:
+            raise ParserError('unsupported expression: %r' % expr)
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == 'number':
+            if value[:2] in ('0x', '0X'):
+                value = int(value, 16)
+            elif re.match(r'^\d+$', value):
+                value = int(value)
+            else:
+                value = float(value)
+        elif kind == 'string':
+            value = _escape.sub(_unescape, value[1:-1])
+        tokens.append((kind, value))
+        pos = m.end()
+    tokens.append((None, None))
+    return tokens
+
+class _Parser(object):
+    def __init__(self, expr, env):
+        self.tokens = _tokenize(expr)
+        self.i = 0
+        self.env = env
+        self.expr = expr
+
+    def error(self):
+        return ParserError('unsupported expression: %r' % self.expr)
+
+    def next(self):
+        token = self.tokens[self.i]
+        self.i += 1
+        return token
+
+    def peek(self):
+        return self.tokens[self.i]
+
+    def expect(self, op):
+        if self.next() != ('op', op):
+            raise self.error()
+
+    def expression(self, precedence=0):
+        value = self.operand()
+        while True:
+            kind, op = self.peek()
+            if kind != 'op' or op not in _binary or _binary[op][0] <= precedence:
+                return value
+            self.next()
+            p, f = _binary[op]
+            value = f(value, self.expression(p))
+
+    def operand(self):
+        kind, value = self.next()
+        if kind in ('number', 'string'):
+            return value
+        if kind == 'name':
+            if self.peek() == ('op', '('):
+                if value not in _functions:
+                    raise self.error()
+                self.next()
+                arg = self.expression()
+                self.expect(')')
+                return _functions[value](arg)
+            try:
+                return self.env[value]
+            except KeyError:
+                raise self.error()
+        if kind == 'op' and value == '(':
+            result = self.expression()
+            self.expect(')')
+            return result
+        if kind == 'op' and value in _unary:
+            return _unary[value](self.operand())
+        raise self.error()
+
+def evaluate(expr, env=None):
+    """
+    Evaluate a JavaScript expression without executing it.
+
+    Parameters
+    ----------
+    expr : str
+        Expression consisting of number and string literals, variables,
+        parentheses, the arithmetic, bitwise, and shift operators, and calls
+        of `String()` and `Number()`.
+    env : dict
+        Values of variables.
+
+    Returns
+    -------
+    result : int, float, or str
+        Value of the expression.
+
+    Raises
+    ------
+    ParserError
+        If the expression is not supported or refers to an unknown variable.
+    """
+
+    parser = _Parser(expr, env or {})
+    result = parser.expression()
+    if parser.peek() != (None, None):
+        raise parser.error()
+    return result
+
+_statement = re.compile(r'\s*(?:var\s+)?([A-Za-z_$][\w$]*)\s*=([^;]*)(?:;|$)')
+
+def assignments(script, env=None):
+    """
+    Evaluate a script that only assigns values to variables.
+
+    Parameters
+    ----------
+    script : str
+        Sequence of statements of the form `var name = expression;`, where
+        every expression is supported by `evaluate()`.
+    env : dict
+        Values of previously assigned variables.
+
+    Returns
+    -------
+    result : dict
+        Values of all variables.
+
+    Raises
+    ------
+    ParserError
+        If the script contains any other kind of statement.
+    """
+
+    env = dict(env or {})
+    pos = 0
+    script = script.strip()
+    while pos < len(script):
+        m = _statement.match(script, pos)
+        if m is None:
+            raise ParserError('unsupported script: %r' % script)
+        env[m.group(1)] = evaluate(m.group(2), env)
+        pos = m.end()
+    return env
+
+def evaluate_all(exprs, env=None):
+    """
+    Evaluate several JavaScript expressions.
+
+    Parameters
+    ----------
+    exprs : list of str
+        Expressions.
+    env : dict
+        Values of variables.
+
+    Returns
+    -------
+    result : list
+        Values of the expressions; the values of expressions not supported by
+        `evaluate()` or whose evaluation fails are None.
+    """
+
+    env = env or {}
+    results = []
+    for expr in exprs:
+        try:
+            results.append(evaluate(expr, env))
+        except (ValueError, ArithmeticError):
+            results.append(None)
+    return results
+
+_lock = threading.Lock()
+_cache = {}
+_max_cached = 256
+
+def _cached(kind, text, f):
+    key = (kind, hashlib.sha1(text.encode('utf-8') \
+                              if isinstance(text, unicode) else text).hexdigest())
+    with _lock:
+        if key in _cache:
+            return _cache[key]
+    result = f(text)
+    with _lock:
+        if len(_cache) >= _max_cached:
+            _cache.clear()
+        _cache[key] = result
+    return result
+
+# Arguments passed to the decoding function of Dean Edwards' packer:
+_packed = re.compile(r"""\}\s*\(\s*'((?:[^'\\]|\\.)*)'\s*,\s*(\d+)\s*,\s*(\d+)\s*,"""
+                     r"""\s*'((?:[^'\\]|\\.)*)'\.split\('\|'\)""", re.DOTALL)
+_word = re.compile(r'\b\w+\b')
+_digits = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+def _unpack_packer(expr):
+    """
+    Unpack a script compressed with Dean Edwards' packer without running it.
+
+    Returns
+    -------
+    result : str
+        Unpacked script, or None if the expression was not produced by the
+        packer.
+    """
+
+    m = _packed.search(expr)
+    if m is None:
+        return None
+    payload = _escape.sub(_unescape, m.group(1))
+    radix, count = int(m.group(2)), int(m.group(3))
+    words = _escape.sub(_unescape, m.group(4)).split('|')
+    if not 2 <= radix <= len(_digits) or len(words) < count:
+        return None
+    digits = dict((c, i) for i, c in enumerate(_digits[:radix]))
+
+    # Every word in the payload is the index of its replacement in the
+    # packer's encoding; words without a replacement are kept as they are:
+    def replace(w):
+        i = 0
+        for c in w.group(0):
+            if c not in digits:
+                return w.group(0)
+            i = i*radix+digits[c]
+        return words[i] if i < count and words[i] else w.group(0)
+    return _word.sub(replace, payload)
+
+def _unpack(expr):
+    result = _unpack_packer(expr)
+    if result is not None:
+        return result
+    result = evaluate(expr)
+    if not isinstance(result, basestring):
+        raise ParserError('packed script did not evaluate to a string')
+    return result
+
+def unpack(expr):
+    """
+    Return the script produced by the argument of a call to `eval()`.
+
+    Parameters
+    ----------
+    expr : str
+        JavaScript expression that evaluates to a script, such as a string
+        literal or a call to a packing function.
+
+    Returns
+    -------
+    result : str
+        Script source. Results are cached.
+
+    Raises
+    ------
+    ParserError
+        If the expression is neither output of Dean Edwards' packer nor a
+        string expression supported by `evaluate()`.
+    """
+
+    return _cached('unpack', expr, _unpack)
+
+def variables(script):
+    """
+    Return the values of the variables assigned by a script.
+
+    Parameters
+    ----------
+    script : str
+        Script source.
+
+    Returns
+    -------
+    result : dict
+        Values of the variables. Results are cached.
+
+    Raises
+    ------
+    ParserError
+        If the script is not supported by `assignments()`.
+    """
+
+    return dict(_cached('variables', script, assignments))
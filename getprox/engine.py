@@ -0,0 +1,735 @@
+#!/usr/bin/env python
+
+"""
+Asynchronous proxy retrieval engine.
+
+Notes
+-----
+Proxy getters are generator functions that accept a `Fetcher` instance. A
+getter waits for a page by yielding the future returned by `Fetcher.get()`;
+the engine resumes the getter with the response (or with the rows returned by
+the page's parsing function) once the page has been downloaded, or raises the
+corresponding exception inside the getter if the download failed. Any other
+value yielded by a getter is treated as a retrieved proxy URI. Since getters
+only occupy the engine while they are parsing, a single event loop thread can
+drive any number of sources while their page downloads are multiplexed over
+one bounded pool of I/O workers.
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import collections
+import email.utils
+import functools
+import itertools
+import random
+import threading
+import time
+import urlparse
+import Queue
+
+from concurrent import futures
+import requests
+import requests.adapters
+
+import cache
+import extract
+
+def parse_page(parse, uri, content, encoding):
+    """
+    Parse a page in a parser worker process.
+
+    Parameters
+    ----------
+    parse : function
+        Module-level page parsing function (or partial application thereof).
+    uri : str
+        Page URI.
+    content : str
+        Undecoded page content.
+    encoding : str
+        Page encoding.
+
+    Returns
+    -------
+    rows : object
+        Rows returned by `parse`.
+    counts : collections.Counter
+        Outcomes of the table rows extracted by `parse`.
+    """
+
+    counts = collections.Counter()
+    extract.count_rows(counts)
+    try:
+        rows = parse(cache._response(uri, content, encoding))
+    finally:
+        extract.count_rows(None)
+    return rows, counts
+
+# HTTP status codes of responses that are retried:
+RETRY_STATUS = frozenset([429, 500, 502, 503, 504])
+
+def _retry_after(r):
+    """
+    Return the delay in seconds requested by the Retry-After header of a
+    response, or None if it is absent or invalid.
+    """
+
+    value = r.headers.get('Retry-After')
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    t = email.utils.parsedate_tz(value)
+    if t is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(t)-time.time())
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter.
+
+    Parameters
+    ----------
+    rate : float
+        Rate in tokens per second at which the bucket is refilled.
+    burst : int
+        Capacity of the bucket.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+
+    def take(self, now=None):
+        """
+        Take a token from the bucket.
+
+        Returns
+        -------
+        delay : float
+            0 if a token was taken, or the time in seconds until one becomes
+            available.
+        """
+
+        if now is None:
+            now = time.time()
+        self.tokens = min(self.burst, self.tokens+(now-self.updated)*self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1-self.tokens)/self.rate
+
+class Fetcher(object):
+    """
+    Concurrent HTTP page fetcher.
+
+    Parameters
+    ----------
+    max_concurrency : int
+        Maximum number of page downloads in flight across all hosts.
+    max_per_host : int
+        Maximum number of page downloads in flight to a single host.
+    pool_connections : int
+        Number of hosts for which persistent connections are kept.
+    pool_maxsize : int
+        Maximum number of persistent connections kept per host. If None,
+        `max_per_host` connections are kept.
+    timeout : float
+        Default connect/read timeout in seconds for page downloads.
+    cache : getprox.cache.PageCache
+        Persistent page cache. If None, pages are always downloaded.
+    metrics : getprox.metrics.Metrics
+        If specified, the latency, size, and parse time of every downloaded
+        page, the number of pages served from `cache`, and the outcomes of
+        extracted table rows are recorded for each source. Download and parse
+        errors are recorded by the `Engine` that drives the getters.
+    parse_workers : int
+        If specified, pages are parsed by a pool of this many worker
+        processes instead of by the I/O threads that downloaded them.
+    rate : float or dict
+        Maximum rate in requests per second at which downloads are started
+        for each host, or dict mapping host names to rates; hosts that are
+        not in the dict are not rate limited. If None, downloads are not
+        rate limited.
+    burst : int
+        Number of downloads that may be started at once for a host before its
+        rate limit applies.
+    retries : int
+        Number of times a download is retried after a timeout, connection
+        error, or response with a status in `RETRY_STATUS`.
+    backoff : float
+        Base delay in seconds before retrying a download; the delay before
+        each retry is drawn uniformly between 0 and an exponentially
+        increasing bound.
+    max_backoff : float
+        Maximum delay in seconds before retrying a download. Downloads whose
+        responses request a longer delay with a Retry-After header are not
+        retried, but their hosts are still not sent any further requests
+        until the requested delay has passed.
+
+    Notes
+    -----
+    All downloads share a single `requests.Session` so that consecutive pages
+    from the same site reuse keep-alive connections and are transferred with
+    gzip/deflate compression.
+
+    Since parsing is CPU-bound, the I/O threads contend for the interpreter
+    lock when many pages are parsed at once. With `parse_workers`, the I/O
+    threads hand the raw page contents to worker processes and wait for the
+    rows that they extract, so that parsing scales with the number of cores.
+
+    A host that responds with status 429 or with a Retry-After header is not
+    sent any further requests until the requested delay (or the retry delay)
+    has passed.
+    """
+
+    def __init__(self, max_concurrency=100, max_per_host=8,
+                 pool_connections=20, pool_maxsize=None, timeout=30.0,
+                 cache=None, metrics=None, parse_workers=None, rate=None,
+                 burst=1, retries=3, backoff=0.5, max_backoff=60.0):
+        self.max_concurrency = max_concurrency
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.cache = cache
+        self.metrics = metrics
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        if pool_maxsize is None:
+            pool_maxsize = max_per_host
+        self.session = requests.Session()
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections,
+                                                pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = futures.ThreadPoolExecutor(max_concurrency)
+        if parse_workers:
+            self.parse_executor = futures.ProcessPoolExecutor(parse_workers)
+        else:
+            self.parse_executor = None
+        self._lock = threading.Lock()
+        self._pending = collections.defaultdict(collections.deque)
+        self._active = collections.defaultdict(int)
+
+        # Rate limiters and times until which hosts are paused, and timers
+        # that resume dispatching for hosts or requeue retried downloads:
+        self._buckets = {}
+        self._paused = {}
+        self._wakeups = {}
+        self._retrying = {}
+
+    def bind(self, source):
+        """
+        Return a fetcher that attributes its downloads to a source.
+
+        Parameters
+        ----------
+        source : str
+            Source name.
+
+        Returns
+        -------
+        result : SourceFetcher
+            Fetcher passed to the getter of the specified source.
+        """
+
+        return SourceFetcher(self, source)
+
+    def get(self, uri, parse=None, source=None, **kwargs):
+        """
+        Schedule the download of a page.
+
+        Parameters
+        ----------
+        uri : str
+            Page URI.
+        parse : function
+            Module-level function that accepts the page response and returns
+            JSON-serializable rows extracted from it. If specified, the page is
+            parsed in the worker that downloaded it.
+        source : str
+            Name of the source that requested the page.
+        kwargs : dict
+            Extra arguments passed to `requests.Session.get`.
+
+        Returns
+        -------
+        result : concurrent.futures.Future
+            Future whose result is the `requests.Response` for the page, or the
+            rows returned by `parse`.
+
+        Notes
+        -----
+        If `stream` is set in `kwargs`, the page is neither cached nor parsed
+        and the body of the response is not read.
+        """
+
+        f = futures.Future()
+        host = urlparse.urlsplit(uri).netloc
+        with self._lock:
+            self._pending[host].append((f, uri, parse, source, kwargs, 0))
+        self._dispatch(host)
+        return f
+
+    def stream(self, rows, batch_size=10000):
+        """
+        Consume an iterable of rows in batches in the I/O workers.
+
+        Parameters
+        ----------
+        rows : iterable
+            Rows produced incrementally, e.g., from a streamed response.
+        batch_size : int
+            Maximum number of rows in each batch.
+
+        Returns
+        -------
+        result : Stream
+            Stream of row batches.
+        """
+
+        return Stream(self.executor, rows, batch_size)
+
+    def cancel(self):
+        """
+        Cancel all downloads that have not started yet.
+        """
+
+        with self._lock:
+            pending = [item for q in self._pending.values() for item in q]
+            self._pending.clear()
+            timers = list(self._wakeups.values())+list(self._retrying)
+            pending.extend(self._retrying.itervalues())
+            self._wakeups.clear()
+            self._retrying.clear()
+        for t in timers:
+            t.cancel()
+        for item in pending:
+
+            # Downloads waiting to be retried have already started:
+            if item[-1]:
+                item[0].set_exception(futures.CancelledError())
+            else:
+                item[0].cancel()
+
+    def close(self):
+        """
+        Cancel pending downloads and shut down the worker pools.
+        """
+
+        self.cancel()
+        self.executor.shutdown(False)
+        if self.parse_executor is not None:
+            self.parse_executor.shutdown(False)
+
+    def _bucket(self, host):
+        if host not in self._buckets:
+            rate = self.rate.get(host) if isinstance(self.rate, dict) \
+                   else self.rate
+            self._buckets[host] = TokenBucket(rate, self.burst) \
+                                  if rate is not None else None
+        return self._buckets[host]
+
+    def _dispatch(self, host):
+
+        # Only hand downloads to the worker pool when the host has a free slot
+        # and its rate limit allows so that a busy host cannot tie up workers
+        # needed by other hosts:
+        with self._lock:
+            pending = self._pending[host]
+            delay = 0.0
+            while pending and self._active[host] < self.max_per_host:
+                item = pending[0]
+                if not item[-1] and item[0].cancelled():
+                    pending.popleft()
+                    continue
+                now = time.time()
+                delay = self._paused.get(host, now)-now
+                if delay <= 0:
+                    bucket = self._bucket(host)
+                    delay = bucket.take(now) if bucket is not None else 0.0
+                if delay > 0:
+                    break
+                pending.popleft()
+                if not item[-1] and not item[0].set_running_or_notify_cancel():
+                    continue
+                self._active[host] += 1
+                self.executor.submit(self._fetch, host, *item)
+
+            # Resume dispatching once the host may be sent another request:
+            if delay > 0 and pending and host not in self._wakeups:
+                t = self._wakeups[host] = \
+                    threading.Timer(delay, self._wakeup, (host,))
+                t.daemon = True
+                t.start()
+
+    def _wakeup(self, host):
+        with self._lock:
+            self._wakeups.pop(host, None)
+        self._dispatch(host)
+
+    def _requeue(self, host, t):
+        with self._lock:
+            item = self._retrying.pop(t, None)
+            if item is None:
+                return
+            self._pending[host].appendleft(item)
+        self._dispatch(host)
+
+    def _retry_delay(self, host, e, attempt):
+        """
+        Return the delay in seconds before retrying a failed download, or None
+        if it should not be retried.
+        """
+
+        retry_after = None
+        if isinstance(e, requests.exceptions.HTTPError):
+            if e.response is None or e.response.status_code not in RETRY_STATUS:
+                return None
+            retry_after = _retry_after(e.response)
+            pause = e.response.status_code == 429 or retry_after is not None
+        elif isinstance(e, (requests.exceptions.Timeout,
+                            requests.exceptions.ConnectionError)):
+            pause = False
+        else:
+            return None
+
+        # The delay requested by the host is honoured by the other downloads
+        # from it even if this one is not retried:
+        if attempt >= self.retries or \
+           retry_after is not None and retry_after > self.max_backoff:
+            if retry_after is not None:
+                self._pause(host, retry_after)
+            return None
+        delay = random.uniform(0, min(self.max_backoff, self.backoff*2**attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if pause:
+            self._pause(host, delay)
+        return delay
+
+    def _pause(self, host, delay):
+        with self._lock:
+            self._paused[host] = max(self._paused.get(host, 0.0),
+                                     time.time()+delay)
+
+    def _download(self, uri, parse, source, kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        labels = {'source': source}
+        start = time.time()
+        if kwargs.get('stream'):
+            r = self.session.get(uri, **kwargs)
+            if self.metrics is not None:
+                self.metrics.inc('pages_total', labels)
+            if r.status_code in RETRY_STATUS:
+                r.close()
+                raise requests.exceptions.HTTPError('%s error for url: %s' % \
+                                                    (r.status_code, uri), response=r)
+            return r
+        if self.cache is None:
+            r = self.session.get(uri, **kwargs)
+        else:
+            r, digest = self.cache.fetch(self.session, uri, source, **kwargs)
+        if self.metrics is not None:
+
+            # Responses constructed from cached pages have no connection:
+            if r.raw is None:
+                self.metrics.inc('page_cache_hits_total', labels)
+            else:
+                self.metrics.observe('page_fetch_seconds', time.time()-start,
+                                     labels)
+                self.metrics.inc('pages_total', labels)
+                self.metrics.inc('page_bytes_total', labels, len(r.content))
+        if r.status_code in RETRY_STATUS:
+            raise requests.exceptions.HTTPError('%s error for url: %s' % \
+                                                (r.status_code, uri), response=r)
+        if parse is None:
+            return r
+
+        # Count the outcomes of the table rows extracted by the parser:
+        counts = collections.Counter()
+        call = functools.partial(self._parse, counts=counts)
+        start = time.time()
+        if self.cache is None:
+            rows = call(parse, r)
+        else:
+            rows = self.cache.parse(uri, digest, parse, r, call)
+        if self.metrics is not None:
+            self.metrics.observe('parse_seconds', time.time()-start, labels)
+            for outcome, n in counts.iteritems():
+                self.metrics.inc('rows_total',
+                                 {'source': source, 'outcome': outcome}, n)
+        return rows
+
+    def _parse(self, parse, r, counts):
+        if self.parse_executor is None:
+            extract.count_rows(counts)
+            try:
+                return parse(r)
+            finally:
+                extract.count_rows(None)
+        rows, worker_counts = \
+            self.parse_executor.submit(parse_page, parse, r.url, r.content,
+                                       r.encoding).result()
+        counts.update(worker_counts)
+        return rows
+
+    def _fetch(self, host, f, uri, parse, source, kwargs, attempt):
+        try:
+            r = self._download(uri, parse, source, kwargs)
+        except Exception as e:
+            delay = self._retry_delay(host, e, attempt)
+            if delay is not None:
+                if self.metrics is not None:
+                    self.metrics.inc('retries_total', {'source': source,
+                                                       'type': type(e).__name__})
+                with self._lock:
+                    self._active[host] -= 1
+                    t = threading.Timer(delay, self._requeue)
+                    t.args = (host, t)
+                    t.daemon = True
+                    self._retrying[t] = (f, uri, parse, source, kwargs, attempt+1)
+                t.start()
+                self._dispatch(host)
+                return
+            result = (None, e)
+        else:
+            result = (r, None)
+        with self._lock:
+            self._active[host] -= 1
+        self._dispatch(host)
+        if result[1] is not None:
+            f.set_exception(result[1])
+        else:
+            f.set_result(result[0])
+
+class SourceFetcher(object):
+    """
+    Fetcher view that attributes downloads to a single source.
+
+    Parameters
+    ----------
+    fetcher : Fetcher
+        Underlying fetcher.
+    source : str
+        Source name.
+    """
+
+    def __init__(self, fetcher, source):
+        self.fetcher = fetcher
+        self.source = source
+
+    def get(self, uri, parse=None, **kwargs):
+        """
+        Schedule the download of a page; see `Fetcher.get()`.
+        """
+
+        return self.fetcher.get(uri, parse, self.source, **kwargs)
+
+    def stream(self, rows, batch_size=10000):
+        """
+        Consume rows in batches; see `Fetcher.stream()`.
+        """
+
+        return self.fetcher.stream(rows, batch_size)
+
+class Stream(object):
+    """
+    Batches of rows consumed from an iterable in a worker pool.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+        Pool in which the rows are consumed.
+    rows : iterable
+        Rows.
+    batch_size : int
+        Maximum number of rows in each batch.
+
+    Notes
+    -----
+    A getter waits for each batch by yielding the future returned by
+    `next()`, so that only one batch is held in memory at a time and reading
+    the rows does not block the event loop.
+    """
+
+    def __init__(self, executor, rows, batch_size=10000):
+        self.executor = executor
+        self.rows = iter(rows)
+        self.batch_size = batch_size
+
+    def next(self):
+        """
+        Return a future whose result is the next list of rows, or None once
+        all rows have been consumed.
+        """
+
+        return self.executor.submit(self._next)
+
+    def _next(self):
+        return list(itertools.islice(self.rows, self.batch_size)) or None
+
+class _Task(object):
+    def __init__(self, gen, callback, source):
+        self.gen = gen
+        self.callback = callback
+        self.source = source
+        self.future = futures.Future()
+        self.cancelled = False
+        self.done = False
+
+class Engine(object):
+    """
+    Event loop that drives proxy getters.
+
+    Parameters
+    ----------
+    fetcher : Fetcher
+        Page fetcher passed to the getters. If None, a fetcher with the
+        default limits is created. If the fetcher has metrics, every exception
+        that a getter raises or receives is recorded once for its source.
+    """
+
+    def __init__(self, fetcher=None):
+        if fetcher is None:
+            fetcher = Fetcher()
+        self.fetcher = fetcher
+        self._ready = Queue.Queue()
+        self._lock = threading.Lock()
+        self._tasks = set()
+        self._running = False
+
+    def spawn(self, getter, callback):
+        """
+        Run a getter on the event loop.
+
+        Parameters
+        ----------
+        getter : function
+            Generator function that accepts a `Fetcher` instance. Its
+            downloads are attributed to the source named after the function.
+        callback : function
+            Function invoked in the event loop thread with every proxy URI
+            (or `getprox.proxy.ProxyArray` batch) yielded by the getter.
+
+        Returns
+        -------
+        result : concurrent.futures.Future
+            Future that completes when the getter finishes; if the getter or
+            the callback raised an exception, the future is set to that
+            exception.
+        """
+
+        task = _Task(getter(self.fetcher.bind(getter.__name__)), callback,
+                     getter.__name__)
+        with self._lock:
+            self._tasks.add(task)
+            self._ready.put((task, None, None))
+            if not self._running:
+                self._running = True
+                t = threading.Thread(target=self._run)
+                t.daemon = True
+                t.start()
+        return task.future
+
+    def cancel(self):
+        """
+        Stop all running getters.
+
+        Notes
+        -----
+        A `concurrent.futures.CancelledError` is raised inside every getter
+        the next time it runs; getters that catch it are stopped the next time
+        they wait for a page.
+        """
+
+        with self._lock:
+            tasks = list(self._tasks)
+        for task in tasks:
+            task.cancelled = True
+            self._ready.put((task, None, futures.CancelledError()))
+
+    def _run(self):
+
+        # The loop thread exits when no getters remain so that idle engines
+        # do not hold on to any threads:
+        while True:
+            with self._lock:
+                if not self._tasks:
+                    self._running = False
+                    return
+            task, value, exc = self._ready.get()
+            self._step(task, value, exc)
+
+    def _wakeup(self, task, f):
+        try:
+            value = f.result()
+        except Exception as e:
+            self._ready.put((task, None, e))
+        else:
+            self._ready.put((task, value, None))
+
+    def _step(self, task, value, exc):
+
+        # Ignore pages downloaded for getters that have already finished:
+        if task.done:
+            return
+        while True:
+            try:
+                if exc is not None:
+                    self._record(task, exc)
+                    x = task.gen.throw(exc)
+                else:
+                    x = task.gen.send(value)
+            except StopIteration:
+                self._finish(task, None)
+                return
+            except Exception as e:
+
+                # Exceptions thrown into the getter were already recorded:
+                if e is not exc:
+                    self._record(task, e)
+                self._finish(task, e)
+                return
+            value = exc = None
+            if isinstance(x, futures.Future):
+                if task.cancelled:
+                    task.gen.close()
+                    self._finish(task, futures.CancelledError())
+                    return
+                x.add_done_callback(functools.partial(self._wakeup, task))
+                return
+
+            # A failing callback stops its getter rather than the loop:
+            try:
+                task.callback(x)
+            except Exception as e:
+                self._record(task, e)
+                task.gen.close()
+                self._finish(task, e)
+                return
+
+    def _record(self, task, e):
+        metrics = self.fetcher.metrics
+        if metrics is not None and not isinstance(e, futures.CancelledError):
+            metrics.exception(task.source, e)
+
+    def _finish(self, task, exc):
+        task.done = True
+        with self._lock:
+            self._tasks.discard(task)
+        if exc is not None:
+            task.future.set_exception(exc)
+        else:
+            task.future.set_result(None)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+
+"""
+Declarative extraction of proxies from HTML tables.
+
+Notes
+-----
+A source's table is described once by a `Table` whose rows, cells, and
+`Column` paths are compiled to `lxml.etree.XPath` objects and whose patterns
+are compiled to regular expressions when the table is declared; extracting
+proxies from a page then only requires a single pass over the selected rows.
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import collections
+import re
+import threading
+
+import lxml.etree
+import lxml.html
+
+_parsers = threading.local()
+_counts = threading.local()
+
+def count_rows(counts):
+    """
+    Count the rows extracted by tables in the current thread.
+
+    Parameters
+    ----------
+    counts : collections.Counter
+        Counter incremented with the number of accepted rows (`accepted`),
+        rows skipped because they could not be decoded (`malformed`), and rows
+        rejected by each named filter. If None, rows are no longer counted.
+    """
+
+    _counts.counts = counts
+
+def reject(outcome, n=1):
+    """
+    Count accepted rows that were rejected after their extraction.
+
+    Parameters
+    ----------
+    outcome : str
+        Reason for which the rows were rejected.
+    n : int
+        Number of rows.
+    """
+
+    counts = getattr(_counts, 'counts', None)
+    if counts is not None:
+        counts['accepted'] -= n
+        counts[outcome] += n
+
+def parse_html(page):
+    """
+    Parse the HTML document in a page response.
+
+    Notes
+    -----
+    If the encoding of the page is known, the undecoded content is passed
+    directly to the parser to avoid decoding it in Python.
+    """
+
+    encoding = page.encoding
+    if encoding is None:
+        return lxml.html.fromstring(page.text)
+    parsers = getattr(_parsers, 'parsers', None)
+    if parsers is None:
+        parsers = _parsers.parsers = {}
+    parser = parsers.get(encoding)
+    if parser is None:
+        try:
+            parser = lxml.html.HTMLParser(encoding=encoding)
+        except LookupError:
+            return lxml.html.fromstring(page.text)
+        parsers[encoding] = parser
+    return lxml.html.fromstring(page.content, parser=parser)
+
+class Column(object):
+    """
+    Value extracted from a table cell.
+
+    Parameters
+    ----------
+    index : int
+        Index of the cell in its row.
+    path : str
+        XPath expression evaluated relative to the cell; the first result is
+        used as the value. If None, the cell's text is used.
+    pattern : str
+        Regular expression searched for in the value. If the pattern contains
+        a single group, the value is set to that group; if it contains several
+        groups, the value is set to a tuple of all groups.
+    decode : callable
+        Function applied to the value.
+    text_content : bool
+        If True, the text of the cell includes that of its descendants;
+        otherwise, only the text preceding the cell's first child is used.
+
+    Notes
+    -----
+    The value of a column is None if the path has no results or the pattern
+    is not found.
+    """
+
+    def __init__(self, index, path=None, pattern=None, decode=None,
+                 text_content=True):
+        self.index = index
+        self.path = lxml.etree.XPath(path, smart_strings=False) \
+                    if path is not None else None
+        self.pattern = re.compile(pattern) if pattern is not None else None
+        self.decode = decode
+        self.text_content = text_content
+
+    def __call__(self, cell):
+        if self.path is not None:
+            values = self.path(cell)
+            value = values[0] if values else None
+        elif self.text_content:
+            value = cell.text_content()
+        else:
+            value = cell.text
+        if value is None:
+            return None
+        value = value.strip()
+        if self.pattern is not None:
+            m = self.pattern.search(value)
+            if m is None:
+                return None
+            groups = m.groups()
+            if not groups:
+                value = m.group(0)
+            elif len(groups) == 1:
+                value = groups[0]
+            else:
+                value = groups
+        if self.decode is not None:
+            value = self.decode(value)
+        return value
+
+class Table(object):
+    """
+    Extract proxies from the rows of an HTML table.
+
+    Parameters
+    ----------
+    rows : str
+        XPath expression that selects the table's rows in a document.
+    columns : dict
+        Maps field names to `Column` instances.
+    format : str
+        Format string applied to the fields of each row to obtain a proxy URI.
+    filter : callable or list of tuple
+        Function that accepts the fields of a row and returns False if the
+        row should be skipped, or list of (name, function) pairs that are
+        applied in order; rows rejected by each named filter are counted
+        separately (see `count_rows()`).
+    cells : str
+        XPath expression that selects the cells of a row.
+    n_cells : int
+        If specified, rows with a different number of cells are skipped.
+    skip : int
+        Number of leading rows to skip (e.g., headers).
+
+    Notes
+    -----
+    Rows for which any column has no value, or whose decoders raise
+    `ValueError`, are skipped.
+    """
+
+    def __init__(self, rows, columns, format='http://%(ip)s:%(port)s',
+                 filter=None, cells='.//td', n_cells=None, skip=0):
+        self.rows = lxml.etree.XPath(rows)
+        self.cells = lxml.etree.XPath(cells)
+        self.columns = sorted(columns.items(), key=lambda c: c[1].index)
+        self.format = format
+        if filter is None:
+            self.filters = []
+        elif callable(filter):
+            self.filters = [('filter', filter)]
+        else:
+            self.filters = list(filter)
+        self.n_cells = n_cells
+        self.skip = skip
+
+    def records(self, tree):
+        """
+        Extract the fields of all rows in a document.
+
+        Parameters
+        ----------
+        tree : lxml.etree._Element
+            Parsed document.
+
+        Returns
+        -------
+        result : list of dict
+            Fields of the rows that pass the filter.
+        """
+
+        results = []
+        rejected = collections.Counter()
+        for row in self.rows(tree)[self.skip:]:
+            cells = self.cells(row)
+            if self.n_cells is not None and len(cells) != self.n_cells:
+                rejected['malformed'] += 1
+                continue
+            record = {}
+            for name, column in self.columns:
+                try:
+                    value = column(cells[column.index])
+                except (IndexError, ValueError):
+                    value = None
+                if value is None:
+                    rejected['malformed'] += 1
+                    break
+                record[name] = value
+            else:
+                for name, f in self.filters:
+                    if not f(record):
+                        rejected[name] += 1
+                        break
+                else:
+                    results.append(record)
+        counts = getattr(_counts, 'counts', None)
+        if counts is not None:
+            counts['accepted'] += len(results)
+            counts.update(rejected)
+        return results
+
+    def extract(self, tree):
+        """
+        Extract proxy URIs from a document.
+
+        Parameters
+        ----------
+        tree : lxml.etree._Element
+            Parsed document.
+
+        Returns
+        -------
+        result : list of str
+            Proxy URIs.
+        """
+
+        return [self.format % r for r in self.records(tree)]
+
+    def __call__(self, page):
+        return self.extract(parse_html(page))
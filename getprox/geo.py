@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+
+"""
+Offline country and network lookups of proxy addresses.
+
+Notes
+-----
+An `IPRanges` index is loaded from a local database of IPv4 address ranges
+and kept in sorted arrays, so that addresses are looked up by binary search
+without any network access. Proxies are enriched in bulk as they are
+retrieved; their country codes and autonomous system numbers are stored in a
+`GeoArray` parallel to the `getprox.proxy.ProxyArray` holding the proxies.
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import array
+import bisect
+import itertools
+import re
+import socket
+import struct
+
+import bulk
+
+_UINT32 = 'I' if array.array('I').itemsize >= 4 else 'L'
+
+_asn = re.compile(r'^(?:AS)?(\d+)$', re.I)
+_country = re.compile(r'^[A-Za-z]{2}$')
+
+def _address(s):
+    if s.isdigit():
+        return int(s)
+    return struct.unpack('>I', socket.inet_aton(s))[0]
+
+def parse_asn(asn):
+    """
+    Convert an autonomous system number such as 'AS15169' to an integer.
+    """
+
+    if isinstance(asn, basestring):
+        m = _asn.match(asn.strip())
+        if m is None:
+            raise ValueError('invalid autonomous system number: %r' % asn)
+        return int(m.group(1))
+    return int(asn)
+
+def _lines(chunks):
+    tail = ''
+    for chunk in chunks:
+        lines = (tail+chunk).split('\n')
+        tail = lines.pop()
+        for line in lines:
+            yield line
+    if tail:
+        yield tail
+
+class IPRanges(object):
+    """
+    Sorted index of IPv4 address ranges and their countries and networks.
+
+    Attributes
+    ----------
+    starts, ends : array.array
+        First and last addresses of the ranges as unsigned 32-bit integers,
+        in increasing order; ranges may not overlap.
+    countries : array.array
+        Index of the country code of each range in `codes`.
+    asns : array.array
+        Autonomous system number of each range (0 if unknown).
+    codes : list of str
+        Country codes; the first code is the empty string, which denotes an
+        unknown country.
+    """
+
+    def __init__(self, ranges=()):
+        self.codes = ['']
+        self._code_index = {'': 0}
+        rows = sorted((start, end, self.code_index(country), asn) \
+                      for start, end, country, asn in ranges)
+        self.starts = array.array(_UINT32, [r[0] for r in rows])
+        self.ends = array.array(_UINT32, [r[1] for r in rows])
+        self.countries = array.array('H', [r[2] for r in rows])
+        self.asns = array.array(_UINT32, [r[3] for r in rows])
+
+    def code_index(self, country, add=True):
+        """
+        Return the index of a country code in `codes`.
+
+        Parameters
+        ----------
+        country : str
+            Two-letter country code (case-insensitive), or None.
+        add : bool
+            If True, unknown codes are added; otherwise, None is returned for
+            unknown codes.
+        """
+
+        country = (country or '').upper()
+        i = self._code_index.get(country)
+        if i is None and add:
+            i = self._code_index[country] = len(self.codes)
+            self.codes.append(country)
+        return i
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load an index from a database file.
+
+        Parameters
+        ----------
+        path : str
+            Path of a MaxMind DB file (`.mmdb`, which requires the `maxminddb`
+            package), or of a comma- or tab-separated file (optionally
+            compressed with gzip or zip) with one range per line.
+
+        Returns
+        -------
+        result : IPRanges
+            Index of the IPv4 ranges in the file.
+
+        Notes
+        -----
+        Every line of a delimited file must start with either a network in
+        CIDR notation or the first and last addresses of a range (dotted or
+        as integers), e.g. the formats of the DB-IP Lite and iptoasn.com
+        databases. The first two-letter field that follows is taken as the
+        country code and the first numeric field (optionally prefixed with
+        'AS') as the autonomous system number. Other lines, such as headers
+        and IPv6 ranges, are skipped.
+        """
+
+        if path.endswith('.mmdb'):
+            return cls(_mmdb_ranges(path))
+        return cls(_delimited_ranges(bulk.decompress(bulk.read_file(path))))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def find(self, ip):
+        """
+        Return the index of the range containing an address, or -1.
+        """
+
+        i = bisect.bisect_right(self.starts, ip)-1
+        if i >= 0 and ip <= self.ends[i]:
+            return i
+        return -1
+
+    def lookup(self, ip):
+        """
+        Return the country code and autonomous system number of an address.
+
+        Parameters
+        ----------
+        ip : int or str
+            IPv4 address.
+
+        Returns
+        -------
+        country, asn : str, int
+            Country code and autonomous system number; None if unknown.
+        """
+
+        if isinstance(ip, basestring):
+            ip = _address(ip)
+        i = self.find(ip)
+        if i < 0:
+            return None, None
+        return self.codes[self.countries[i]] or None, self.asns[i] or None
+
+    def enrich(self, proxies):
+        """
+        Look up the countries and networks of proxies.
+
+        Parameters
+        ----------
+        proxies : getprox.proxy.ProxyArray
+            Proxies; those with host names rather than addresses are not
+            resolved and are treated as unknown.
+
+        Returns
+        -------
+        result : GeoArray
+            Country and network of every proxy.
+        """
+
+        result = GeoArray(self)
+        starts, ends = self.starts, self.ends
+        countries, asns = self.countries, self.asns
+        search = bisect.bisect_right
+        n = len(starts)
+
+        # Consecutive proxies often belong to the same range, so the last
+        # range found is tried before searching:
+        last = -1
+        country_list, asn_list = [], []
+        for ip in proxies.ips:
+            if not (last >= 0 and starts[last] <= ip <= ends[last]):
+                last = search(starts, ip)-1
+                if last < 0 or ip > ends[last]:
+                    last = -1
+            if last < 0:
+                country_list.append(0)
+                asn_list.append(0)
+            else:
+                country_list.append(countries[last])
+                asn_list.append(asns[last])
+        for i in proxies.hosts:
+            country_list[i] = asn_list[i] = 0
+        result.countries.fromlist(country_list)
+        result.asns.fromlist(asn_list)
+        return result
+
+def _delimited_ranges(chunks):
+    for line in _lines(chunks):
+        fields = [f.strip().strip('"') for f in
+                  line.split('\t' if '\t' in line else ',')]
+        try:
+            if '/' in fields[0]:
+                network, prefix = fields[0].split('/')
+                start = _address(network)
+                end = start | (1 << (32-int(prefix)))-1
+                rest = fields[1:]
+            else:
+                start, end = _address(fields[0]), _address(fields[1])
+                rest = fields[2:]
+        except (IndexError, ValueError, socket.error):
+            continue
+        country = asn = None
+        for f in rest:
+            if asn is None and _asn.match(f):
+                asn = parse_asn(f)
+            elif country is None and _country.match(f):
+                country = f
+        yield start, end, country, asn or 0
+
+def _mmdb_ranges(path):
+    import maxminddb
+
+    with maxminddb.open_database(path) as reader:
+        for network, record in reader:
+            if network.version != 4 or not isinstance(record, dict):
+                continue
+            country = record.get('country')
+            if isinstance(country, dict):
+                country = country.get('iso_code')
+            country = country or record.get('country_code')
+            asn = record.get('autonomous_system_number') or record.get('asn')
+            try:
+                asn = parse_asn(asn) if asn else 0
+            except ValueError:
+                asn = 0
+            yield (int(network.network_address), int(network.broadcast_address),
+                   country, asn)
+
+class GeoArray(object):
+    """
+    Countries and networks of the proxies in a `getprox.proxy.ProxyArray`.
+
+    Parameters
+    ----------
+    ranges : IPRanges
+        Index whose country codes are referenced.
+    """
+
+    def __init__(self, ranges):
+        self.ranges = ranges
+        self.countries = array.array('H')
+        self.asns = array.array(_UINT32)
+
+    def __len__(self):
+        return len(self.countries)
+
+    def extend(self, other):
+        """
+        Append the entries of another array.
+        """
+
+        self.countries.extend(other.countries)
+        self.asns.extend(other.asns)
+
+    def take(self, indices):
+        """
+        Return the entries at the specified indices.
+        """
+
+        result = GeoArray(self.ranges)
+        countries, asns = self.countries, self.asns
+        result.countries.fromlist([countries[i] for i in indices])
+        result.asns.fromlist([asns[i] for i in indices])
+        return result
+
+    def __getitem__(self, s):
+        result = GeoArray(self.ranges)
+        result.countries = self.countries[s]
+        result.asns = self.asns[s]
+        return result
+
+    def select(self, country=None, exclude_asn=None):
+        """
+        Return the indices of the entries that match filters.
+
+        Parameters
+        ----------
+        country : str or list of str
+            Country code or codes (case-insensitive) of the entries to select.
+        exclude_asn : int, str, or list
+            Autonomous system number or numbers of the entries to reject.
+
+        Returns
+        -------
+        result : list of int
+            Indices of the matching entries in increasing order; entries whose
+            country is unknown do not match any country.
+        """
+
+        indices = xrange(len(self.countries))
+        if country is not None:
+            if isinstance(country, basestring):
+                country = [country]
+            wanted = set(self.ranges.code_index(c, False) for c in country)
+            wanted.discard(None)
+            wanted.discard(0)
+            indices = [i for i, c in itertools.izip(indices, self.countries) \
+                       if c in wanted]
+        if exclude_asn is not None:
+            if isinstance(exclude_asn, (basestring, int, long)):
+                exclude_asn = [exclude_asn]
+            excluded = set(parse_asn(a) for a in exclude_asn)
+            asns = self.asns
+            indices = [i for i in indices if asns[i] not in excluded]
+        return list(indices)
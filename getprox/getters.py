@@ -5,8 +5,17 @@ Proxy retrieval functions.
 
 Notes
 -----
-All retrieval functions must be listed in `__all__` in order to be exposed to
-the rest of the package.
+All retrieval functions must be listed in `getprox.registry` in order to be
+exposed to the rest of the package. Each function is a generator that accepts a
+`getprox.engine.Fetcher` instance, yields the futures returned by the
+fetcher in order to wait for downloaded pages, and yields retrieved proxy URIs
+(or `getprox.proxy.ProxyArray` batches of proxies) as soon as it finds them.
+
+Pages are parsed by module-level functions passed to the fetcher; these
+accept a page response and must return JSON-serializable rows so that their
+results can be cached. Proxy tables are declared once with
+`getprox.extract.Table` so that their XPath expressions and patterns are
+compiled when the module is imported.
 """
 
 # Copyright (c) 2014-2015, Lev Givon
@@ -16,23 +25,20 @@ the rest of the package.
 
 import base64
 import codecs
+import functools
 import re
-import StringIO
 import urllib
-import zipfile
 
+import lxml.etree
 import lxml.html
-import requests
-
-__all__ = ['freeproxylists',
-           'checkerproxy',
-           'letushide',
-           'freeproxylist',
-           'proxy_ip_list',
-           'aliveproxy',
-           'cool_proxy',
-           'proxynova',
-           'proxyhttp']
+
+import bulk
+import deobfuscate
+import extract
+from extract import Column, Table, parse_html
+import registry
+
+__all__ = registry.SOURCES
 
 #def gatherproxy():
 #    """
@@ -42,48 +48,82 @@ __all__ = ['freeproxylists',
 #    page = requests.post('http://gatherproxy.com/proxylist/anonymity/?t=Elite',
 #                         data={'Type':'elite','PageIdx':"1"})
 
-def freeproxylists():
+def _freeproxylists_lists(page):
     """
-    http://www.freeproxylists.com
+    Parse the URIs of the lists with standard HTTP ports.
     """
 
-    # Retrieve proxies from the list with standard HTTP ports:
-    page = requests.get('http://www.freeproxylists.com/standard.html')
-    tree = lxml.html.fromstring(page.text)
-
+    tree = parse_html(page)
     rows = tree.xpath('.//th[text()="raw proxy list"]/../..')[0].xpath('.//tr')
     list_uris = []
     for row in rows[1:]:
         list_uris.append('http://www.freeproxylists.com/'+\
                          row.xpath('.//td[1]/a/@href')[0])
-    results = []
-    for uri in list_uris:
-        page = requests.get(uri)
-        tree = lxml.html.fromstring(page.text)
-        
-        # The page loads the proxy data from a separate HTML fragment embedded
-        # in an XML file using JavaScript; to avoid the need for JavaScript, we
-        # just find the URI, grab the data, and parse it:
-        onload = tree.xpath('.//body/@onload')[0]
-        table_uri = 'http://www.freeproxylists.com/'+\
-                    re.search('loadData\(\'.+\', \'(.+)\'\);', onload).group(1)
-        page = requests.get(table_uri)
-        tree = lxml.etree.fromstring(codecs.encode(page.text, 'utf-8'))
-        table = lxml.html.fromstring(tree.xpath('//root/quote')[0].text)
-
-        rows = table.xpath('.//tr')
-        for row in rows[1:]:
-            td_list = row.xpath('.//td')
-            if len(td_list) != 2:
-                continue
-            ip = td_list[0].text_content().strip()
-            if not re.search('(\d+)\.(\d+)\.(\d+)\.(\d+)', ip):
-                continue
-            port = td_list[1].text_content().strip()
-            results.append('http://'+ip+':'+port)
-    return results
+    return list_uris
+
+_freeproxylists_load = re.compile('loadData\(\'.+\', \'(.+)\'\);')
+
+def _freeproxylists_table_uri(page):
+    """
+    Parse the URI of the XML file containing the data for a list.
+    """
+
+    tree = parse_html(page)
+
+    # The page loads the proxy data from a separate HTML fragment embedded
+    # in an XML file using JavaScript; to avoid the need for JavaScript, we
+    # just find the URI, grab the data, and parse it:
+    onload = tree.xpath('.//body/@onload')[0]
+    return 'http://www.freeproxylists.com/'+\
+        _freeproxylists_load.search(onload).group(1)
 
-def checkerproxy():
+_freeproxylists_rows = Table('.//tr',
+                             {'ip': Column(0, pattern='\d+\.\d+\.\d+\.\d+'),
+                              'port': Column(1)},
+                             n_cells=2, skip=1)
+
+def _freeproxylists_table(page):
+    """
+    Parse proxies from a list's XML file.
+    """
+
+    tree = lxml.etree.fromstring(page.content)
+    return _freeproxylists_rows.extract(
+        lxml.html.fromstring(tree.findtext('quote')))
+
+def freeproxylists(fetcher):
+    """
+    http://www.freeproxylists.com
+    """
+
+    # Retrieve proxies from the list with standard HTTP ports:
+    list_uris = yield fetcher.get('http://www.freeproxylists.com/standard.html',
+                                  _freeproxylists_lists)
+    list_pages = [fetcher.get(uri, _freeproxylists_table_uri) \
+                  for uri in list_uris]
+    table_pages = []
+    for f in list_pages:
+        table_uri = yield f
+        table_pages.append(fetcher.get(table_uri, _freeproxylists_table))
+    for f in table_pages:
+        uris = yield f
+        for uri in uris:
+            yield uri
+
+_checkerproxy_rows = Table('.//table[@id="result-box-table"]/tbody/tr',
+                           {'addr': Column(1, text_content=False),
+                            'type': Column(3, text_content=False)},
+                           format='http://%(addr)s',
+                           filter=[('type', lambda r: r['type'] == 'HTTP')])
+
+def _checkerproxy(page):
+    """
+    Parse proxies from the list page.
+    """
+
+    return _checkerproxy_rows(page)
+
+def checkerproxy(fetcher):
     """
     http://checkerproxy.net
 
@@ -93,19 +133,34 @@ def checkerproxy():
     information in the list.
     """
 
-    page = requests.get('http://checkerproxy.net/all_proxy')
-    tree = lxml.html.fromstring(page.text)
+    uris = yield fetcher.get('http://checkerproxy.net/all_proxy', _checkerproxy)
+    for uri in uris:
+        yield uri
+
+# Only save those proxies with a speed of at least 4 and a reliability
+# greater than 90:
+_letushide_rows = Table('.//tr[@id="data"]',
+                        {'ip': Column(1),
+                         'port': Column(2),
+                         'speed': Column(5, path='.//@class',
+                                         decode=lambda s: int(s[1]) if len(s) == 2 else 0),
+                         'reliability': Column(6, decode=lambda s: int(s[:-1]))},
+                        filter=[('speed', lambda r: r['speed'] >= 4),
+                                ('reliability', lambda r: r['reliability'] >= 90)])
+_letushide_next = lxml.etree.XPath('.//a[contains(@href, $href)]')
+
+def _letushide(page, i):
+    """
+    Parse proxies from the i-th list page and determine whether a next page
+    exists.
+    """
 
-    results = []
-    for tr in tree.xpath('.//table[@id="result-box-table"]/tbody/tr'):
-        td_list = tr.xpath('.//td')
-        ipport = td_list[1].text
-        proxytype = td_list[3].text
-        if proxytype == 'HTTP':
-            results.append('http://'+ipport)
-    return results
+    tree = parse_html(page)
+    results = _letushide_rows.extract(tree)
+    has_next = bool(_letushide_next(tree, href='/filter/http,all,all/%s/list_of_free_HTTP_proxy_servers' % (i+1)))
+    return [results, has_next]
 
-def letushide():
+def letushide(fetcher):
     """
     http://letushide.com
 
@@ -114,41 +169,54 @@ def letushide():
     As of 12/2014, lists speed, reliability, and last time checked.
     """
 
-    results = []
+    failures = 0
     for i in xrange(1, 20):
         uri = \
               'http://letushide.com/filter/http,all,all/%s/list_of_free_HTTP_proxy_servers' % i
 
-        # Downloading of some of the pages may eventually fail:
+        # Downloading of some of the pages may eventually fail even after
+        # being retried; skip them, but stop after several consecutive
+        # failures since whether further pages exist is then unknown:
         try:
-            page = requests.get(uri)
-        except:
-            break
-
-        tree = lxml.html.fromstring(page.text)
-        for tr in tree.xpath('.//tr[@id="data"]'):
-            td_list = tr.xpath('.//td')
-            host = td_list[1].text_content()
-            port = td_list[2].text_content()
-            s = td_list[5].xpath('.//@class')[0]
-            if len(s) == 2:
-                speed = int(s[1])
-            else:
-                speed = 0
-            reliability = int(td_list[6].text_content()[:-1])
-
-            # Only save those proxies with a speed of at least 4 and a
-            # reliability greater than 90:
-            if speed >= 4 and reliability >= 90:
-                results.append('http://%s:%s' % (host, port))
+            uris, has_next = \
+                yield fetcher.get(uri, functools.partial(_letushide, i=i))
+        except Exception:
+            failures += 1
+            if failures == 3:
+                break
+            continue
+        failures = 0
+        for uri in uris:
+            yield uri
 
         # Leave loop if there isn't any link to the next page present:
-        if not tree.xpath('.//a[contains(@href,"/filter/http,all,all/%s/list_of_free_HTTP_proxy_servers")]' % (i+1)):
+        if not has_next:
             break
 
-    return results
+def _freeproxylist_entry(page):
+    """
+    Parse the URI of the most recent list, or None if no list is linked.
+    """
 
-def freeproxylist():
+    tree = parse_html(page)
+    try:
+        return tree.xpath('.//div[@class="entry_date"]')[0].xpath('.//a/@href')[0]
+    except IndexError:
+        return None
+
+def _freeproxylist_zip_uri(page):
+    """
+    Parse the URI of the zip file containing a list, or None if no file is
+    linked.
+    """
+
+    tree = parse_html(page)
+    try:
+        return tree.xpath('.//div[@class="entry_page"]/p/a/@href')[0].strip()
+    except IndexError:
+        return None
+
+def freeproxylist(fetcher):
     """
     http://freeproxylist.co
 
@@ -158,28 +226,46 @@ def freeproxylist():
     check status.
     """
 
-    # Get URI of most recent list:
+    # Get URI of most recent list; download errors are left to propagate so
+    # that the retrieval is recorded as failed:
+    uri = yield fetcher.get('http://freeproxylist.co', _freeproxylist_entry)
+    if uri is None:
+        return
+    zip_uri = yield fetcher.get(uri, _freeproxylist_zip_uri)
+    if zip_uri is None:
+        return
+
+    # The zipped list is decompressed and parsed as it is downloaded:
+    r = yield fetcher.get(zip_uri, stream=True)
     try:
-        page = requests.get('http://freeproxylist.co')
-    except:
-        return []
-    tree = lxml.html.fromstring(page.text)
-    uri = tree.xpath('.//div[@class="entry_date"]')[0].xpath('.//a/@href')[0]
-    try:
-        page = requests.get(uri)
-    except:
-        return []
-    tree = lxml.html.fromstring(page.text)
-    zip_uri = tree.xpath('.//div[@class="entry_page"]/p/a/@href')[0].strip()
-    try:
-        r = requests.get(zip_uri)
-    except:
-        return []
-    z = zipfile.ZipFile(StringIO.StringIO(r.content))
-    data = z.read(z.namelist()[0])
-    return ['http://'+u.strip() for u in data.split('\n')]
+        stream = bulk.ingest(fetcher, r.iter_content(bulk.CHUNK_SIZE))
+        while True:
+            batch = yield stream.next()
+            if batch is None:
+                break
+            yield batch[0]
+    finally:
+        r.close()
+
+_proxy_ip_list_rows = Table('.//tbody/tr',
+                            {'addr': Column(0, text_content=False),
+                             'response': Column(1, text_content=False),
+                             'speed': Column(2, text_content=False),
+                             'type': Column(3, text_content=False)},
+                            format='http://%(addr)s',
+                            filter=[('response', lambda r: r['response'] != '0'),
+                                    ('speed', lambda r: r['speed'] != '0'),
+                                    ('type', lambda r: r['type'] == 'high-anonymous')],
+                            n_cells=5)
+
+def _proxy_ip_list(page):
+    """
+    Parse proxies from the list page.
+    """
+
+    return _proxy_ip_list_rows(page)
 
-def proxy_ip_list():
+def proxy_ip_list(fetcher):
     """
     http://proxy-ip-list.com
 
@@ -189,18 +275,30 @@ def proxy_ip_list():
     """
 
     # This page lists proxies that were ostensibly checked within the past hour:
-    page = requests.get("http://proxy-ip-list.com/fresh-proxy-list.html")
-    tree = lxml.html.fromstring(page.text)
+    uris = yield fetcher.get("http://proxy-ip-list.com/fresh-proxy-list.html",
+                             _proxy_ip_list)
+    for uri in uris:
+        yield uri
+
+# Only return proxies successfully checked in last 30 minutes:
+_aliveproxy_rows = Table(".//tr[@class='cw-list']",
+                         {'addr': Column(0, pattern='(\d+\.\d+\.\d+\.\d+\:\d+)',
+                                         text_content=False),
+                          'last_check': Column(4, pattern='(\d+)\:(\d+)',
+                                               decode=lambda t: int(t[0])*60+int(t[1]),
+                                               text_content=False)},
+                         format='http://%(addr)s',
+                         filter=[('last_check', lambda r: r['last_check'] < 30)],
+                         n_cells=10)
+
+def _aliveproxy(page):
+    """
+    Parse proxies from the list page.
+    """
 
-    results = []
-    for tr in tree.findall('.//tbody/tr'):
-        addr, response, speed, proxy_type, country = \
-            map(lambda x: x.text, tr.findall('.//td'))
-        if response != '0' and speed != '0' and proxy_type == 'high-anonymous':
-            results.append('http://'+addr)
-    return results
+    return _aliveproxy_rows(page)
 
-def aliveproxy():
+def aliveproxy(fetcher):
     """
     http://aliveproxy.com
 
@@ -209,23 +307,41 @@ def aliveproxy():
     As of 12/2014, lists uptime, response time, and last good check time.
     """
 
-    page = requests.get("http://aliveproxy.com/high-anonymity-proxy-list/")
-    tree = lxml.html.fromstring(page.text)
+    uris = yield fetcher.get("http://aliveproxy.com/high-anonymity-proxy-list/",
+                             _aliveproxy)
+    for uri in uris:
+        yield uri
+
+_rot13 = codecs.getdecoder('rot13')
+
+# Only return highest rating, working >= 90%, response time within 2 s, speed
+# higher than 100 kb/s, and last check within 10 minutes:
+_cool_proxy_rows = Table('.//table/tr',
+                         {'ip': Column(0, pattern='"(.*)"',
+                                       decode=lambda s: base64.decodestring(_rot13(s)[0])),
+                          'port': Column(1),
+                          'rating': Column(4, path='.//img/@alt'),
+                          'working': Column(6, decode=float),
+                          'response_time': Column(7, decode=float),
+                          'speed': Column(8, decode=float),
+
+                          # Convert to seconds:
+                          'last_check': Column(9, decode=lambda s: int(s[0:2])*60+int(s[3:5]))},
+                         filter=[('rating', lambda r: r['rating'] == '5 star proxy'),
+                                 ('working', lambda r: r['working'] >= 90),
+                                 ('response_time', lambda r: r['response_time'] <= 2.0),
+                                 ('speed', lambda r: r['speed'] >= 100),
+                                 ('last_check', lambda r: r['last_check'] < 600)],
+                         n_cells=10, skip=1)
+
+def _cool_proxy(page):
+    """
+    Parse proxies from a list page.
+    """
 
-    results = []
-    for tr in tree.findall(".//tr[@class='cw-list']"):
-        addr, _, _, _, last_check, _, _, _, _, _ = \
-            map(lambda x: x.text, tr.findall('.//td'))
-        addr = re.search('(\d+\.\d+\.\d+\.\d+\:\d+)', addr).group(1)
-        temp = re.search('(\d+)\:(\d+)', last_check)
-        last_check = int(temp.group(1))*60+int(temp.group(2))
-
-        # Only return proxies successfully checked in last 30 minutes:
-        if last_check < 30:
-            results.append('http://'+addr)
-    return results
+    return _cool_proxy_rows(page)
 
-def cool_proxy():
+def cool_proxy(fetcher):
     """
     http://www.cool-proxy.net
 
@@ -236,163 +352,192 @@ def cool_proxy():
     """
 
     # Only look at first 5 pages of proxies:
-    results = []
-    for i in xrange(5):
-        page = requests.get('http://www.cool-proxy.net/proxies/http_proxy_list/sort:score/direction:desc/page:%s' % i)
-                 
-        tree = lxml.html.fromstring(page.text)
-        for tr in tree.xpath('.//table/tr')[1:]:
-            td_list = tr.xpath('.//td')
-            if len(td_list) != 10:
-                continue
-            ip_enc = re.search('"(.*)"', td_list[0].text_content()).group(1)
-            ip = base64.decodestring(codecs.getdecoder('rot13')(ip_enc)[0])
-            port = td_list[1].text_content()
-            rating = td_list[4].xpath('.//img/@alt')[0]
-            working = td_list[6].text_content()
-            response_time = td_list[7].text_content()
-            speed = td_list[8].text_content()
-            last_check = td_list[9].text_content()
-
-            # Convert to seconds:
-            last_check = int(last_check[0:2])*60+int(last_check[3:5])
-
-            # Only return highest rating, working >= 90%, response time within 2
-            # s, speed higher than 100 kb/s, and last check within 10 minutes:
-            if rating == '5 star proxy' and float(working) >= 90 and \
-               float(response_time) <= 2.0 and \
-               float(speed) >= 100 and last_check < 600:
-                results.append('http://'+ip+':'+port)
-    return results
+    pages = [fetcher.get('http://www.cool-proxy.net/proxies/http_proxy_list/sort:score/direction:desc/page:%s' % i,
+                         _cool_proxy) for i in xrange(5)]
+    for f in pages:
+        uris = yield f
+        for uri in uris:
+            yield uri
+
+def _proxynova_countries(page):
+    """
+    Parse the codes of the countries for which proxies are listed.
+    """
+
+    tree = parse_html(page)
+    return [e.attrib['value'] \
+            for e in tree.xpath('.//select[@name="proxy_country"]/option') \
+            if e.attrib.has_key('value') and e.attrib['value']]
 
-def proxynova():
+_proxynova_secs = re.compile('(\d+) secs')
+_proxynova_mins = re.compile('(\d+) min')
+
+def _proxynova_age(s):
+    """
+    Convert the time since a proxy was last checked to seconds.
+    """
+
+    m = _proxynova_secs.search(s)
+    if m is not None:
+        return int(m.group(1))
+    m = _proxynova_mins.search(s)
+    if m is not None:
+        return 60*int(m.group(1))
+    return None
+
+_proxynova_rows = Table('.//table[@id="tbl_proxy_list"]/tbody/tr',
+                        {'ip': Column(0),
+                         'port': Column(1),
+                         'last_check': Column(2, decode=_proxynova_age),
+                         'alive': Column(2, path='.//time/@class',
+                                         decode=lambda s: 'icon-dead' not in s),
+                         'speed': Column(3, path='.//div[@class="progress-bar"]/@data-value',
+                                         decode=float),
+                         'uptime': Column(4, decode=lambda s: int(s[:-1]))},
+                        filter=[('last_check', lambda r: r['last_check'] <= 300),
+                                ('alive', lambda r: r['alive']),
+                                ('speed', lambda r: r['speed'] >= 80),
+                                ('uptime', lambda r: r['uptime'] >= 80)],
+                        n_cells=7, skip=1)
+
+def _proxynova(page):
+    """
+    Parse proxies from a country's list page.
+    """
+
+    return _proxynova_rows(page)
+
+def proxynova(fetcher):
     """
     http://www.proxynova.com
     """
 
-    page = requests.get('http://www.proxynova.com/proxy-server-list/')
-    tree = lxml.html.fromstring(page.text)
-    country_list = [e.attrib['value'] \
-                    for e in tree.xpath('.//select[@name="proxy_country"]/option') \
-                    if e.attrib.has_key('value') and e.attrib['value']]
+    country_list = yield fetcher.get('http://www.proxynova.com/proxy-server-list/',
+                                     _proxynova_countries)
+    pages = [fetcher.get('http://www.proxynova.com/proxy-server-list/country-%s' % c,
+                         _proxynova) for c in country_list]
+    for f in pages:
+        uris = yield f
+        for uri in uris:
+            yield uri
+
+_proxyhttp_vars = lxml.etree.XPath('.//script[contains(text(),"<![CDATA")]')
+_proxyhttp_cdata = re.compile('CDATA\[(.*)\]\]')
+_proxyhttp_rows = Table('.//table[@class="proxytbl"]/tr',
+                        {'ip': Column(0),
+                         'port': Column(1, pattern='document\.write\((.*)\);'),
+                         'checked': Column(5, pattern='(\d+):(\d+):(\d+)',
+                                           decode=lambda t: 360*int(t[0])+60*int(t[1])+int(t[2]))},
+                        filter=[('checked', lambda r: r['checked'] < 300)],
+                        skip=1)
+
+def _proxyhttp(page):
+    """
+    Parse proxies from a list page.
+    """
+
+    tree = parse_html(page)
 
+    # Get variables used for obfuscation; pages whose scripts are not
+    # supported by the evaluator are rejected rather than run:
+    try:
+        s = _proxyhttp_vars(tree)[0].text.replace('\n','').replace(' ', '').replace('//','')
+    except (IndexError, AttributeError):
+        return []
+    m = _proxyhttp_cdata.search(s)
+    if m is None:
+        raise deobfuscate.ParserError('obfuscation script not found')
+    env = deobfuscate.variables(m.group(1))
+
+    # Deobfuscate port info:
     results = []
-    for c in country_list:
-        page = \
-            requests.get('http://www.proxynova.com/proxy-server-list/country-%s' % c)
-        tree = lxml.html.fromstring(page.text)
-        rows = tree.xpath('.//table[@id="tbl_proxy_list"]/tbody/tr')
-        for row in rows[1:]:
-            td_list = row.xpath('.//td')
-            if len(td_list) != 7:
-                continue
-            ip = td_list[0].text_content().strip()
-            port = td_list[1].text_content().strip()
-            last_check = td_list[2].text_content().strip()
-            s = re.search('(\d+) secs', last_check)
-            if s is not None:
-                last_check = int(s.group(1))
-            else:
-                s = re.search('(\d+) min', last_check)
-                if s is not None:
-                    last_check = 60*int(s.group(1))
-            alive = td_list[2].xpath('.//time/@class')[0]
-            if re.search('icon-dead', alive):
-                alive = False
-            else:
-                alive = True
-            speed = \
-                float(td_list[3].xpath('.//div[@class="progress-bar"]/@data-value')[0])
-            uptime = int(td_list[4].text_content().strip()[:-1])
-
-            if last_check <= 300 and alive and speed >= 80 and uptime >= 80:
-                results.append('http://'+ip+':'+port)
+    for r in _proxyhttp_rows.records(tree):
+        try:
+            port = deobfuscate.evaluate(r['port'], env)
+        except deobfuscate.ParserError:
+            extract.reject('unsupported')
+            continue
+        results.append('http://%s:%s' % (r['ip'], deobfuscate.to_string(port)))
     return results
 
-def proxyhttp():
+def proxyhttp(fetcher):
     """
     http://proxyhttp.net
     """
 
     # Need to use real user agent to access site:
     headers = {'User-Agent': 'Mozilla/5.0 (X11; OpenBSD amd64; rv:28.0) Gecko/20100101 Firefox/28.0'}
-    results = []
-    for i in xrange(1, 10):
-        page = \
-            requests.get('http://proxyhttp.net/free-list/anonymous-server-hide-ip-address/%s' % i, headers=headers)
-        tree = lxml.html.fromstring(page.text)
+    pages = [fetcher.get('http://proxyhttp.net/free-list/anonymous-server-hide-ip-address/%s' % i,
+                         _proxyhttp, headers=headers) for i in xrange(1, 10)]
 
-        # Get variables used for obfuscation and evaluate them in the current
-        # namespace (the ^ operator is XOR in both JavaScript and Python):
+    # Skip pages that could not be downloaded or deobfuscated:
+    for f in pages:
         try:
-            s = tree.xpath('.//script[contains(text(),"<![CDATA")]')[0].text.replace('\n','').replace(' ', '').replace('//','')
-        except:
+            uris = yield f
+        except Exception:
             continue
-        s = re.search('CDATA\[(.*)\]\]',s).group(1)
-        exec(s)
-
-        rows = tree.xpath('.//table[@class="proxytbl"]/tr')[1:]
-        for row in rows:
-            td_list = row.xpath('.//td')
-            ip = td_list[0].text_content().strip()
-
-            # Deobfuscate port info:
-            s = td_list[1].text_content().replace('\n', '').replace(' ', '').replace('//', '')
-            s = re.search('CDATA\[document\.write\((.*)\)\;\]\]', s).group(1)
-            port = str(eval(s))
-
-            checked = td_list[5].text_content().strip()
-            h, m, s = re.search('(\d+):(\d+):(\d+)', checked).groups()
-            checked = 360*int(h)+60*int(m)+int(s)
-            if checked >= 300:
-                continue
-            results.append('http://'+ip+':'+port)
-    return results
+        for uri in uris:
+            yield uri
 
-try:
-    import execjs
-except:
-    pass
-else:
-    if execjs.available_runtimes():    
-        def samair():
-            """
-            http://www.samair.ru/proxy
-            """
-
-            base_uri = 'http://www.samair.ru/proxy/'
-            page = requests.get(base_uri)
-            tree = lxml.html.fromstring(page.text)
-
-            js_uri = urllib.basejoin(base_uri,
-                                     tree.xpath('.//script[@type="text/javascript"]/@src')[0])
-            js_vars = re.search('eval\((.*)\)', requests.get(js_uri).text.strip()).group(1)
-            js_vars = execjs.eval(js_vars)
-
-            uri_list = [base_uri]+[urllib.basejoin(base_uri, u) \
-                        for u in tree.xpath('.//a[@class="page"]/@href')]
-            results = []
-            for uri in uri_list:
-                page = requests.get(base_uri)
-                tree = lxml.html.fromstring(page.text)
-                rows = tree.xpath('.//table[@id="proxylist"]/tr')[1:]
-                for row in rows:
-                    td_list = row.xpath('.//td')
-                    if len(td_list) != 4:
-                        continue
-                    ip = td_list[0].text
-
-                    # Get the JavaScript that corresponds to the obfuscated port:
-                    port_js = td_list[0].xpath('.//script')[0].text
-                    port_js = re.search('document\.write\(\":\"\+(.+)\)', port_js).group(1)
-                    port_vars = port_js.split('+')
-                    p = '+'.join(['(%s).toString()' % v for v in port_vars])
-
-                    # Construct function to interpret to get the actual port value:
-                    f = 'function(){'+js_vars+'return '+p+'}()'
-                    port = str(execjs.eval(f))
-
-                    results.append('http://'+ip+':'+port)
-            return results
-
-        __all__.append('samair')
+def _samair_index(page):
+    """
+    Parse the URIs of the obfuscation script and of the list pages.
+    """
+
+    base_uri = 'http://www.samair.ru/proxy/'
+    tree = parse_html(page)
+    js_uri = urllib.basejoin(base_uri,
+                             tree.xpath('.//script[@type="text/javascript"]/@src')[0])
+    uri_list = [base_uri]+[urllib.basejoin(base_uri, u) \
+                for u in tree.xpath('.//a[@class="page"]/@href')]
+    return [js_uri, uri_list]
+
+_samair_eval = re.compile('eval\((.*)\)')
+
+def _samair_vars(page):
+    """
+    Evaluate the variables used to obfuscate ports.
+    """
+
+    packed = _samair_eval.search(page.text.strip()).group(1)
+    return deobfuscate.variables(deobfuscate.unpack(packed))
+
+_samair_records = Table('.//table[@id="proxylist"]/tr',
+                        {'ip': Column(0, text_content=False),
+                         'port': Column(0, path='.//script/text()',
+                                        pattern='document\.write\(\":\"\+(.+)\)')},
+                        n_cells=4, skip=1).records
+
+def _samair(page, js_vars):
+    """
+    Parse proxies from a list page.
+    """
+
+    # Every variable in a port expression is converted to a string; rows
+    # whose expressions are not supported by the evaluator are skipped:
+    records = _samair_records(parse_html(page))
+    ports = deobfuscate.evaluate_all(['+'.join(['String(%s)' % v for v in r['port'].split('+')]) \
+                                      for r in records], js_vars)
+    unsupported = ports.count(None)
+    if unsupported:
+        extract.reject('unsupported', unsupported)
+    return ['http://%s:%s' % (r['ip'], port) for r, port in zip(records, ports) \
+            if port is not None]
+
+def samair(fetcher):
+    """
+    http://www.samair.ru/proxy
+    """
+
+    js_uri, uri_list = yield fetcher.get('http://www.samair.ru/proxy/',
+                                         _samair_index)
+    js_vars = yield fetcher.get(js_uri, _samair_vars)
+    pages = [fetcher.get(uri, functools.partial(_samair, js_vars=js_vars)) \
+             for uri in uri_list]
+    for f in pages:
+        try:
+            uris = yield f
+        except Exception:
+            continue
+        for uri in uris:
+            yield uri
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+"""
+Persistent proxy health database.
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import os
+import sqlite3
+import threading
+import time
+
+class HealthDB(object):
+    """
+    Persistent record of proxy test results.
+
+    Every probe of a proxy is recorded together with its latency, outcome, and
+    the source that listed the proxy. Each proxy is assigned a score computed
+    from exponentially weighted moving averages of its success rate and of its
+    latency when alive; proxies that are reliable and fast have the highest
+    scores.
+
+    Parameters
+    ----------
+    path : str
+        Database file. If None, `~/.getprox/health.sqlite` is used.
+    alpha : float
+        Weight of the most recent probe in the moving averages.
+    max_failures : int
+        Number of consecutive failed probes after which a proxy is considered
+        dead.
+    retry_after : float
+        Time in seconds after which dead proxies are probed again.
+    """
+
+    def __init__(self, path=None, alpha=0.3, max_failures=5,
+                 retry_after=86400.0):
+        if path is None:
+            path = os.path.join(os.path.expanduser('~'), '.getprox',
+                                'health.sqlite')
+        d = os.path.dirname(path)
+        if d and not os.path.isdir(d):
+            os.makedirs(d)
+        self.path = path
+        self.alpha = alpha
+        self.max_failures = max_failures
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.executescript('''
+                CREATE TABLE IF NOT EXISTS probes (
+                    uri TEXT,
+                    ts REAL,
+                    latency REAL,
+                    ok INTEGER,
+                    source TEXT);
+                CREATE INDEX IF NOT EXISTS probes_uri ON probes (uri);
+                CREATE TABLE IF NOT EXISTS scores (
+                    uri TEXT PRIMARY KEY,
+                    probes INTEGER,
+                    failures INTEGER,
+                    success_rate REAL,
+                    latency REAL,
+                    score REAL,
+                    last_probe REAL);
+            ''')
+            self._conn.commit()
+
+    def _score(self, success_rate, latency):
+        if latency is None:
+            return success_rate
+        return success_rate/(1.0+latency)
+
+    def record(self, uri, ok, latency, source=None):
+        """
+        Record the result of a probe.
+
+        Parameters
+        ----------
+        uri : str
+            Proxy URI.
+        ok : bool
+            True if the proxy responded to the probe.
+        latency : float
+            Time in seconds taken by the probe.
+        source : str
+            Name of the source that listed the proxy.
+        """
+
+        now = time.time()
+        with self._lock:
+            self._conn.execute('INSERT INTO probes VALUES (?, ?, ?, ?, ?)',
+                               (uri, now, latency, int(ok), source))
+            row = self._conn.execute('SELECT probes, failures, success_rate, '
+                                     'latency FROM scores WHERE uri=?',
+                                     (uri,)).fetchone()
+            if row is None:
+                probes, failures = 1, int(not ok)
+                success_rate = float(ok)
+                avg_latency = latency if ok else None
+            else:
+                probes, failures, success_rate, avg_latency = row
+                probes += 1
+                failures = 0 if ok else failures+1
+                success_rate = self.alpha*ok+(1-self.alpha)*success_rate
+                if ok:
+                    if avg_latency is None:
+                        avg_latency = latency
+                    else:
+                        avg_latency = self.alpha*latency+(1-self.alpha)*avg_latency
+            self._conn.execute('INSERT OR REPLACE INTO scores VALUES '
+                               '(?, ?, ?, ?, ?, ?, ?)',
+                               (uri, probes, failures, success_rate, avg_latency,
+                                self._score(success_rate, avg_latency), now))
+            self._conn.commit()
+
+    def scores(self, uris):
+        """
+        Return the scores of the specified proxies.
+
+        Parameters
+        ----------
+        uris : list of str
+            Proxy URIs.
+
+        Returns
+        -------
+        result : dict
+            Maps the URIs of previously probed proxies to their scores.
+        """
+
+        result = {}
+        uris = list(uris)
+        with self._lock:
+            for i in xrange(0, len(uris), 500):
+                chunk = uris[i:i+500]
+                q = 'SELECT uri, score FROM scores WHERE uri IN (%s)' % \
+                    ','.join('?'*len(chunk))
+                result.update(self._conn.execute(q, chunk).fetchall())
+        return result
+
+    def rank(self, uris):
+        """
+        Sort proxies by decreasing score.
+
+        Parameters
+        ----------
+        uris : list of str
+            Proxy URIs.
+
+        Returns
+        -------
+        result : list of str
+            Proxy URIs; proxies without any recorded probes are placed after
+            those with a nonzero score.
+        """
+
+        scores = self.scores(uris)
+        return sorted(uris, key=lambda uri: -scores.get(uri, 0.0))
+
+    def is_dead(self, uri):
+        """
+        Return True if a proxy has recently failed too many consecutive probes.
+        """
+
+        with self._lock:
+            row = self._conn.execute('SELECT failures, last_probe FROM scores '
+                                     'WHERE uri=?', (uri,)).fetchone()
+        if row is None:
+            return False
+        failures, last_probe = row
+        return failures >= self.max_failures and \
+            time.time()-last_probe < self.retry_after
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+
+"""
+Deferred module imports.
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import importlib
+
+class LazyModule(object):
+    """
+    Module that is only imported when one of its attributes is accessed.
+
+    Parameters
+    ----------
+    name : str
+        Absolute name of the module.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return '<lazy module %r>' % self._name
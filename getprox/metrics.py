@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+"""
+Metrics of proxy retrieval and testing.
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import bisect
+import collections
+import threading
+
+# Default histogram bucket bounds in seconds:
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram(object):
+    """
+    Histogram of observed values.
+
+    Parameters
+    ----------
+    buckets : sequence of float
+        Upper bounds of the buckets in increasing order; an unbounded bucket
+        is always added.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0]*(len(self.buckets)+1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """
+        Record a value.
+        """
+
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        Return the cumulative count of each bucket.
+
+        Returns
+        -------
+        result : list of tuple
+            Upper bound of each bucket (`float('inf')` for the last one) and
+            the number of values less than or equal to it.
+        """
+
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets+(float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+def _labels(labels):
+    return tuple(sorted((labels or {}).items()))
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % \
+        (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) \
+        for k, v in labels)
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metrics(object):
+    """
+    Thread-safe collection of counters and histograms.
+
+    Every metric is identified by a name and a dict of labels (e.g., the
+    source or tester to which it applies).
+
+    Parameters
+    ----------
+    prefix : str
+        Prefix of metric names in the Prometheus export.
+    max_exceptions : int
+        Number of recent exceptions kept for each source.
+    """
+
+    def __init__(self, prefix='getprox', max_exceptions=10):
+        self.prefix = prefix
+        self.max_exceptions = max_exceptions
+        self._lock = threading.Lock()
+        self._counters = collections.defaultdict(collections.Counter)
+        self._histograms = collections.defaultdict(dict)
+        self._exceptions = collections.defaultdict(
+            lambda: collections.deque(maxlen=self.max_exceptions))
+
+    def inc(self, name, labels=None, value=1):
+        """
+        Increment a counter.
+
+        Parameters
+        ----------
+        name : str
+            Counter name.
+        labels : dict
+            Counter labels.
+        value : int or float
+            Increment.
+        """
+
+        with self._lock:
+            self._counters[name][_labels(labels)] += value
+
+    def value(self, name, labels=None):
+        """
+        Return the value of a counter (0 if it was never incremented).
+        """
+
+        with self._lock:
+            return self._counters.get(name, {}).get(_labels(labels), 0)
+
+    def observe(self, name, value, labels=None, buckets=BUCKETS):
+        """
+        Record a value in a histogram.
+
+        Parameters
+        ----------
+        name : str
+            Histogram name.
+        value : float
+            Observed value.
+        labels : dict
+            Histogram labels.
+        buckets : sequence of float
+            Bucket bounds used if the histogram does not exist yet.
+        """
+
+        key = _labels(labels)
+        with self._lock:
+            h = self._histograms[name].get(key)
+            if h is None:
+                h = self._histograms[name][key] = Histogram(buckets)
+            h.observe(value)
+
+    def exception(self, source, e):
+        """
+        Record an exception raised while retrieving proxies from a source.
+
+        Parameters
+        ----------
+        source : str
+            Source name.
+        e : Exception
+            Captured exception.
+        """
+
+        self.inc('exceptions_total', {'source': source,
+                                      'type': type(e).__name__})
+        with self._lock:
+            self._exceptions[source].append('%s: %s' % (type(e).__name__, e))
+
+    def as_dict(self):
+        """
+        Return all metrics.
+
+        Returns
+        -------
+        result : dict
+            Dict with the keys `counters` and `histograms`, which map metric
+            names to lists of dicts containing the labels and values of the
+            metric, and `exceptions`, which maps source names to their most
+            recent exceptions.
+        """
+
+        with self._lock:
+            counters = dict((name, [{'labels': dict(k), 'value': v} \
+                                    for k, v in sorted(values.items())]) \
+                            for name, values in self._counters.iteritems())
+            histograms = dict((name, [{'labels': dict(k),
+                                       'buckets': h.cumulative(),
+                                       'sum': h.sum,
+                                       'count': h.count} \
+                                      for k, h in sorted(values.items())]) \
+                              for name, values in self._histograms.iteritems())
+            exceptions = dict((source, list(e)) \
+                              for source, e in self._exceptions.iteritems())
+        for values in histograms.itervalues():
+            for h in values:
+                h['buckets'] = [[_format_value(bound), count] \
+                                for bound, count in h['buckets']]
+        return {'counters': counters, 'histograms': histograms,
+                'exceptions': exceptions}
+
+    def prometheus(self):
+        """
+        Return all metrics in the Prometheus text exposition format.
+
+        Returns
+        -------
+        result : str
+            Metrics text.
+        """
+
+        lines = []
+        with self._lock:
+            for name in sorted(self._counters):
+                full_name = '%s_%s' % (self.prefix, name)
+                lines.append('# TYPE %s counter' % full_name)
+                for labels, value in sorted(self._counters[name].items()):
+                    lines.append('%s%s %s' % (full_name, _format_labels(labels),
+                                              _format_value(value)))
+            for name in sorted(self._histograms):
+                full_name = '%s_%s' % (self.prefix, name)
+                lines.append('# TYPE %s histogram' % full_name)
+                for labels, h in sorted(self._histograms[name].items()):
+                    for bound, count in h.cumulative():
+                        le = labels+(('le', _format_value(bound)),)
+                        lines.append('%s_bucket%s %d' % \
+                                     (full_name, _format_labels(le), count))
+                    lines.append('%s_sum%s %s' % (full_name, _format_labels(labels),
+                                                  _format_value(h.sum)))
+                    lines.append('%s_count%s %d' % (full_name, _format_labels(labels),
+                                                    h.count))
+        return '\n'.join(lines)+'\n'
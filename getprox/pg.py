@@ -9,15 +9,30 @@ Proxy retrieval class.
 # Distributed under the terms of the BSD license:
 # http://www.opensource.org/licenses/bsd-license
 
+import collections
+import functools
+import itertools
 import numbers
+import threading
+import time
 import Queue
 
 from concurrent import futures
-import requests
-import requests_futures.sessions
 
-import proxytest
-import getters
+import lazy
+import metrics
+import proxy
+import registry
+
+# Modules that require libraries that are slow to import are only imported
+# once they are used:
+cache = lazy.LazyModule('getprox.cache')
+engine = lazy.LazyModule('getprox.engine')
+geo = lazy.LazyModule('getprox.geo')
+health = lazy.LazyModule('getprox.health')
+probe = lazy.LazyModule('getprox.probe')
+proxytest = lazy.LazyModule('getprox.proxytest')
+schedule = lazy.LazyModule('getprox.schedule')
 
 class ProxyGet(object):
     """
@@ -27,9 +42,93 @@ class ProxyGet(object):
     ----------
     sources : list of str
         Proxy sources. If None, proxies from all available sources are
-        retrieved.
+        retrieved. URIs and local paths of bulk lists with one `host:port`
+        address per line (optionally compressed with gzip or zip) may also
+        be specified.
     test : bool
         If True, test retrieved proxies.
+    n : int
+        If specified, stop retrieving (and testing) proxies as soon as this
+        many unique proxies (or live proxies, if `test` is set) have been found.
+    max_concurrency : int
+        Maximum number of page downloads in flight across all sources.
+    max_per_host : int
+        Maximum number of page downloads in flight to a single host.
+    pool_connections : int
+        Number of hosts for which persistent connections are kept.
+    pool_maxsize : int
+        Maximum number of persistent connections kept per host.
+    fetch_timeout : float
+        Connect/read timeout in seconds for page downloads.
+    parse_workers : int
+        If specified, pages are parsed by a pool of this many worker
+        processes rather than by the download threads.
+    rate : float or dict
+        Maximum rate in requests per second at which pages are requested
+        from each host, or dict mapping host names to rates.
+    retries : int
+        Number of times a page download is retried after a timeout,
+        connection error, or server error.
+    cache : getprox.cache.PageCache, str, or bool
+        Persistent page cache, or the path of its database file. If True, a
+        cache is created in the default location; if None (default), pages are
+        not cached.
+    fetcher : getprox.engine.Fetcher
+        Preconfigured page fetcher. If specified, the download, retry, and
+        cache settings above are ignored.
+    health : getprox.health.HealthDB, str, or bool
+        Database in which proxy test results are recorded, or the path of its
+        database file. If True, a database is created in the default location.
+        If specified, proxies with the best record are tested first and
+        tested proxies are returned in order of decreasing score.
+    tester : str or object
+        Proxy tester: 'requests' (default) selects `getprox.proxytest.ProxyTest`
+        and 'socket' selects `getprox.probe.SocketTest`. A tester instance with
+        the same interface may also be specified; its `submit()` method is
+        passed `getprox.proxy.Proxy` instances.
+    adaptive : bool
+        If True, the default tester adjusts its concurrency and timeout to
+        the observed network conditions.
+    keepalive : int
+        Maximum number of persistent connections to live proxies kept open by
+        the 'socket' tester so that later tests of the same proxies (such as
+        the periodic re-tests of `getprox.daemon.Pool`) reuse them.
+    results : getprox.testcache.ResultCache or bool
+        Cache of recent test results used by the default testers; proxies
+        tested recently (e.g., by a previous instance) are not probed again.
+        If True (default), the cache shared by all testers in the process is
+        used; if None, every proxy is probed.
+    test_queue_size : int
+        Maximum number of retrieved proxies waiting to be tested; retrieval
+        pauses while the queue is full.
+    geo : getprox.geo.IPRanges or str
+        Index of IPv4 address ranges, or the path of a database file from
+        which to load it (see `getprox.geo.IPRanges.load()`). If specified,
+        the country and network of every proxy are looked up as it is
+        retrieved, and proxies may be filtered by them in `get()`.
+    stats : getprox.schedule.SourceStats, str, or bool
+        Record of the cost and yield of sources, or the path of its database
+        file. If True, a database is created in the default location; if None
+        (default), statistics are only kept in memory by the current process.
+    metrics : getprox.metrics.Metrics
+        Metrics in which page downloads, parsing, proxy yields, exceptions,
+        and proxy tests are recorded. If None, a new instance is created.
+
+    Notes
+    -----
+    Sources are started in order of decreasing expected yield per second,
+    which is learned from previous retrievals. If `n` is specified, further
+    sources are only started while the proxies found so far and the expected
+    yield of the running sources fall short of `n`, so that small requests are
+    served by a few cheap sources.
+
+    Attributes
+    ----------
+    proxies_untested, proxies_tested : getprox.proxy.ProxyArray
+        Unique retrieved and live proxies in the order in which they were
+        found.
+    metrics : getprox.metrics.Metrics
+        Per-source and per-tester metrics.
     """
 
     def __init__(self, *sources, **kwargs):
@@ -37,24 +136,113 @@ class ProxyGet(object):
             self.test = kwargs['test']
         else:
             self.test = False
-        self.q_untested = Queue.Queue()
-        self.q_tested = Queue.Queue()
+        self.n = kwargs.get('n')
 
         if not sources:
-            sources = getters.__all__
-        self.executor = futures.ThreadPoolExecutor(len(sources)+1)
-        self.tester = proxytest.ProxyTest()
-        self._executing_getters = []
-        self._executing_queues = []
+            sources = registry.available()
+
+        # Look up all getters before any retrieval starts so that unknown
+        # sources are reported immediately:
+        self._getters = dict((source, registry.getter(source)) \
+                             for source in sources)
+        page_cache = kwargs.get('cache')
+        if page_cache is True:
+            page_cache = cache.PageCache()
+        elif isinstance(page_cache, basestring):
+            page_cache = cache.PageCache(page_cache)
+        self.metrics = kwargs.get('metrics')
+        if self.metrics is None:
+            self.metrics = metrics.Metrics()
+        self.fetcher = kwargs.get('fetcher')
+        if self.fetcher is None:
+            self.fetcher = engine.Fetcher(kwargs.get('max_concurrency', 100),
+                                          kwargs.get('max_per_host', 8),
+                                          kwargs.get('pool_connections', 20),
+                                          kwargs.get('pool_maxsize'),
+                                          kwargs.get('fetch_timeout', 30.0),
+                                          page_cache, self.metrics,
+                                          kwargs.get('parse_workers'),
+                                          kwargs.get('rate'),
+                                          retries=kwargs.get('retries', 3))
+        elif self.fetcher.metrics is None:
+            self.fetcher.metrics = self.metrics
+        self.engine = engine.Engine(self.fetcher)
+        self.health = kwargs.get('health')
+        if self.health is True:
+            self.health = health.HealthDB()
+        elif isinstance(self.health, basestring):
+            self.health = health.HealthDB(self.health)
+        self.geo = kwargs.get('geo')
+        if isinstance(self.geo, basestring):
+            self.geo = geo.IPRanges.load(self.geo)
+        self.tester = kwargs.get('tester', 'requests')
+        if self.tester == 'requests':
+            self.tester = proxytest.ProxyTest(db=self.health,
+                                              adaptive=kwargs.get('adaptive', False),
+                                              metrics=self.metrics,
+                                              results=kwargs.get('results', True))
+        elif self.tester == 'socket':
+            self.tester = probe.SocketTest(db=self.health, metrics=self.metrics,
+                                           keepalive=kwargs.get('keepalive', 0),
+                                           results=kwargs.get('results', True))
+        elif getattr(self.tester, 'metrics', False) is None:
+            self.tester.metrics = self.metrics
+        self.stats = kwargs.get('stats')
+        if self.stats is None:
+            self.stats = schedule.shared()
+        elif self.stats is True:
+            self.stats = schedule.SourceStats()
+        elif isinstance(self.stats, basestring):
+            self.stats = schedule.SourceStats(self.stats)
 
-        # Start threads to retrieve and test proxies:
-        for g in sources:
-            self._executing_getters.append(self.executor.submit(self._get_proxies, g))
+        # Retrieved proxies are deduplicated by key as they arrive and stored
+        # compactly; URIs are only constructed when proxies are requested. The
+        # condition is used to wake up consumers waiting for new proxies:
+        self.proxies_untested = proxy.ProxyArray()
+        self.proxies_tested = proxy.ProxyArray()
+        self._seen_untested = set()
+        self._seen_tested = set()
+        self._callbacks_untested = []
+        self._callbacks_tested = []
 
-        # Start thread to collect queued results:
-        self.proxies_untested = []
-        self.proxies_tested = []
-        self._executing_queues.append(self.executor.submit(self._get_from_queues))
+        # Countries and networks of the proxies, in the same order:
+        if self.geo is not None:
+            self._geo_untested = geo.GeoArray(self.geo)
+            self._geo_tested = geo.GeoArray(self.geo)
+        else:
+            self._geo_untested = self._geo_tested = None
+
+        # Keys of the proxies listed by each source and times of the last
+        # successful retrieval from each source; used to refresh stale sources:
+        self.sources = list(sources)
+        self._listed = collections.defaultdict(set)
+        self._fetched = {}
+        self._refreshing = None
+        self._cond = threading.Condition()
+        self._remaining = len(sources)
+        self._completed = {}
+        self._retrieved = False
+        self._stopped = False
+        self._done = False
+        self._finished = futures.Future()
+
+        # Proxies are tested as soon as they are retrieved; the bounded queue
+        # between the getters and the tester throttles retrieval whenever
+        # testing falls behind. Queued proxies with the best health scores are
+        # tested first:
+        if self.test:
+            self._test_queue = \
+                Queue.PriorityQueue(kwargs.get('test_queue_size', 1000))
+            self._test_count = itertools.count()
+            t = threading.Thread(target=self._test_proxies)
+            t.daemon = True
+            t.start()
+
+        # Start retrieving and testing proxies on the event loop:
+        self._executing_getters = []
+        self._pending_sources = self.stats.order(self.sources, self.test)
+        self._running = {}
+        self._schedule()
 
     @property
     def running_getters(self):
@@ -62,51 +250,412 @@ class ProxyGet(object):
         Return True if any of the proxy getters are still running.
         """
 
-        return any([e.running() for e in self._executing_getters])
+        return not all([e.done() for e in self._executing_getters])
 
     def wait(self):
         """
-        Wait until all proxy retrieval/collection threads finish running.
+        Wait until all proxy retrieval and testing finishes.
+        """
+
+        self._finished.result()
+
+    def stop(self):
+        """
+        Stop retrieving and testing proxies.
+
+        Notes
+        -----
+        Pending page downloads and proxy tests are cancelled; those already in
+        progress are allowed to finish in the background but their results
+        are discarded.
         """
 
-        futures.wait(self._executing_getters, return_when=futures.ALL_COMPLETED)
-        futures.wait(self._executing_queues, return_when=futures.ALL_COMPLETED)
+        with self._cond:
+            if self._stopped or self._done:
+                return
+            self._stopped = True
+
+            # Sources that were never started will not finish:
+            self._remaining -= len(self._pending_sources)
+            self._pending_sources = []
+            remaining = self._remaining
+        self.fetcher.cancel()
+        self.engine.cancel()
+        self.tester.cancel()
+
+        # Otherwise, the last running source stops the test thread:
+        if self.test and not remaining:
+            self._test_queue.put((float('inf'), None, None, None))
+        self._all_done()
+
+    def _schedule(self):
+
+        # Start the sources with the highest expected yield per second until
+        # the expected yield of the running sources covers the proxies that
+        # are still needed; at least one source is always kept running:
+        launch = []
+        with self._cond:
+            if self._stopped or self._done:
+                return
+            if self.n is None:
+                launch, self._pending_sources = self._pending_sources, []
+            else:
+                found = len(self.proxies_tested if self.test else self.proxies_untested)
+                expected = found+sum(self.stats.expected(source, self.test) \
+                                     for source in self._running)
+                while self._pending_sources and \
+                      (expected < self.n or not (self._running or launch)):
+                    source = self._pending_sources.pop(0)
+                    expected += self.stats.expected(source, self.test)
+                    launch.append(source)
+            for source in launch:
+                self._running[source] = (time.time(), self._counts(source))
+        for source in launch:
+
+            # Sources that cannot be started are treated as failed:
+            try:
+                f = self._get_proxies(source)
+            except Exception as e:
+                self.metrics.exception(source, e)
+                f = futures.Future()
+                f.set_exception(e)
+            f.add_done_callback(functools.partial(self._source_done, source))
+            self._executing_getters.append(f)
+
+    def _counts(self, source):
+        labels = {'source': source}
+        return [self.metrics.value(name, labels) for name in \
+                ('pages_total', 'proxies_unique_total', 'proxies_alive_total')]
 
     def _get_proxies(self, getter):
+        return self.engine.spawn(self._getters[getter],
+                                 functools.partial(self._retrieve, getter))
+
+    def _retrieve(self, source, uri):
+        if isinstance(uri, proxy.ProxyArray):
+            self._retrieve_batch(source, uri)
+            return
         try:
-            uri_list = getattr(getters, getter)()
-        except:
+            p = proxy.parse(uri)
+        except ValueError:
             return
-        else:
-            for uri in uri_list:
-                self.q_untested.put(uri)
+        self.metrics.inc('proxies_total', {'source': source})
+        if self._add(p, False, source) and self.test:
+            if self.health is not None:
+                uri = p.uri
+                priority = -self.health.scores([uri]).get(uri, 0.0)
+            else:
+                priority = 0.0
+            self._test_queue.put((priority, next(self._test_count), p, source))
 
-            if self.test:
-                uri_tested_list = self.tester.test(*uri_list)
-                for uri in uri_tested_list:
-                    self.q_tested.put(uri)
+    def _retrieve_batch(self, source, batch):
 
-    def _get_from_queues(self):
+        # Proxies listed in bulk are added with a single lock acquisition:
+        self.metrics.inc('proxies_total', {'source': source}, len(batch))
+        keys = batch.keys()
+        info = self.geo.enrich(batch) if self.geo is not None else None
+        with self._cond:
+            self._listed[source].update(keys)
+            if self._done:
+                return
+            seen = self._seen_untested
+            limit = self.n-len(self.proxies_untested) \
+                if self.n is not None and not self.test else len(keys)
+            indices = []
+            for i, key in enumerate(keys):
+                if len(indices) >= limit:
+                    break
+                if key not in seen:
+                    seen.add(key)
+                    indices.append(i)
+            added = batch.take(indices)
+            self.proxies_untested.extend(added)
+            if info is not None:
+                self._geo_untested.extend(info.take(indices))
+            self.metrics.inc('proxies_unique_total', {'source': source}, len(added))
+            for uri in added.uris() if self._callbacks_untested else []:
+                for callback in self._callbacks_untested:
+                    callback(uri)
+            self._cond.notify_all()
+            enough = self.n is not None and not self.test and \
+                len(self.proxies_untested) >= self.n
+        if enough:
+            self.stop()
+        if self.test:
+            uris = added.uris() if self.health is not None else None
+            scores = self.health.scores(uris) if uris else {}
+            for i, p in enumerate(added):
+                priority = -scores.get(uris[i], 0.0) if uris else 0.0
+                self._test_queue.put((priority, next(self._test_count), p, source))
+
+    def _test_proxies(self):
+        """
+        Test queued proxies until all getters have finished.
+        """
 
-        # Wait for getters: to finish running before getting results:
+        slots = threading.BoundedSemaphore(self.tester.max_workers)
         while True:
-            if not self.running_getters:
+            priority, i, p, source = self._test_queue.get()
+            if p is None:
                 break
+            if self._stopped:
+                continue
+            slots.acquire()
+            self.tester.submit(p, source).add_done_callback(
+                functools.partial(self._tested, p, source, slots))
+
+        # Wait for the outstanding tests to finish:
+        if not self._stopped:
+            for i in xrange(self.tester.max_workers):
+                slots.acquire()
+            self._record_alive()
+        self._all_done()
+
+    def _record_alive(self):
+        for source, counts in self._completed.iteritems():
+            pages, unique, alive = [after-before for before, after in \
+                                    zip(counts, self._counts(source))]
+            if unique:
+                self.stats.record_alive(source, float(alive)/unique)
+
+    def _tested(self, p, source, slots, f):
+        slots.release()
+        if f.result():
+            self.metrics.inc('proxies_alive_total', {'source': source})
+            self._add(p, True)
 
-        # Discard duplicates when saving results:
-        tmp = set()
-        while not self.q_untested.empty():
-            tmp.add(self.q_untested.get())
-            self.q_untested.task_done()
-        self.proxies_untested = list(tmp)
+    def _add(self, p, test, source=None):
+        if test:
+            seen, proxies, callbacks = \
+                self._seen_tested, self.proxies_tested, self._callbacks_tested
+        else:
+            seen, proxies, callbacks = \
+                self._seen_untested, self.proxies_untested, self._callbacks_untested
+        key = p.key
+        if self.geo is not None:
+            info = self.geo.enrich(proxy.ProxyArray([p]))
+        with self._cond:
+            if source is not None:
+                self._listed[source].add(key)
+            if key in seen or self._done:
+                return False
+            seen.add(key)
+            proxies.append(p)
+            if self.geo is not None:
+                (self._geo_tested if test else self._geo_untested).extend(info)
+            if source is not None:
+                self.metrics.inc('proxies_unique_total', {'source': source})
+            if callbacks:
+                uri = p.uri
+                for callback in callbacks:
+                    callback(uri)
+            self._cond.notify_all()
+            enough = self.n is not None and test == self.test and \
+                len(proxies) >= self.n
+        if enough:
+            self.stop()
+        return True
+
+    def _source_done(self, source, f):
+        with self._cond:
+            start, counts = self._running.pop(source)
+            succeeded = f.exception() is None
+            if succeeded:
+                self._fetched[source] = time.time()
+            completed = succeeded and not self._stopped
+            if completed:
+                self._completed[source] = counts
+                listed = len(self._listed[source])
+            self._remaining -= 1
+            remaining = self._remaining
+
+        # Retrievals interrupted by stop() are not representative of the cost
+        # of a source and are not recorded:
+        if completed:
+            self.stats.record(source, time.time()-start,
+                              self._counts(source)[0]-counts[0], listed)
+        if remaining:
+            self._schedule()
+            return
+        with self._cond:
+            self._retrieved = True
+            self._cond.notify_all()
         if self.test:
-            tmp = set()
-            while not self.q_tested.empty():
-                tmp.add(self.q_tested.get())
-                self.q_tested.task_done()
-            self.proxies_tested = list(tmp)
+            self._test_queue.put((float('inf'), None, None, None))
+        else:
+            self._all_done()
 
-    def get(self, n=None, test=False):
+    def _all_done(self):
+        with self._cond:
+            if self._done:
+                return
+            self._retrieved = True
+            self._done = True
+            self._cond.notify_all()
+        self._finished.set_result(None)
+
+    def refresh(self, max_age=None):
+        """
+        Update the retrieved proxies from sources whose lists are stale.
+
+        Parameters
+        ----------
+        max_age : float or dict
+            Maximum age in seconds of the proxies retrieved from a source, or
+            a dict mapping source names to maximum ages. By default, the TTLs
+            of the page cache (or 300 seconds if no cache is used) are used.
+
+        Returns
+        -------
+        result : concurrent.futures.Future
+            Future whose result is a dict mapping the name of every source
+            that was retrieved again to a dict containing the lists of the
+            URIs of the proxies that it `added` and `removed`.
+
+        Notes
+        -----
+        Only sources whose last successful retrieval is older than their
+        maximum age are retrieved again, and only proxies that were not
+        previously listed by any source are tested; earlier test results are
+        kept. Proxies that are no longer listed by any source are discarded.
+        `get()` returns the previous proxies until the refresh completes.
+
+        If retrieval is still in progress, the refresh starts once it
+        finishes. If a refresh is already in progress, its future is returned.
+        """
+
+        with self._cond:
+            if self._refreshing is not None:
+                return self._refreshing
+            self._refreshing = result = futures.Future()
+        def start(f):
+            try:
+                self._start_refresh(max_age, result)
+            except Exception as e:
+                with self._cond:
+                    self._refreshing = None
+                result.set_exception(e)
+        self._finished.add_done_callback(start)
+        return result
+
+    def _max_age(self, source, max_age):
+        if isinstance(max_age, dict):
+            max_age = max_age.get(source)
+        if max_age is not None:
+            return max_age
+        if self.fetcher.cache is not None:
+            return self.fetcher.cache.ttl_for(source)
+        return 300.0
+
+    def _start_refresh(self, max_age, result):
+        now = time.time()
+        with self._cond:
+            stale = [source for source in self.sources \
+                     if now-self._fetched.get(source, float('-inf')) >= \
+                     self._max_age(source, max_age)]
+            known = set().union(*self._listed.values())
+        if not stale:
+            self._merge({}, {}, proxy.ProxyArray(), result)
+            return
+
+        # Proxies are collected separately so that the current proxies remain
+        # available until all stale sources have been retrieved:
+        lock = threading.Lock()
+        listed = dict((source, set()) for source in stale)
+        found = collections.OrderedDict()
+        fetched = {}
+        remaining = [len(stale)]
+        def retrieved(source, uri):
+            if isinstance(uri, proxy.ProxyArray):
+                batch = uri
+            else:
+                try:
+                    batch = [proxy.parse(uri)]
+                except ValueError:
+                    return
+            self.metrics.inc('proxies_total', {'source': source}, len(batch))
+            with lock:
+                for p in batch:
+                    key = p.key
+                    listed[source].add(key)
+                    if key not in known and key not in found:
+                        found[key] = p
+        def source_done(source, f):
+            with lock:
+                if f.exception() is None:
+                    fetched[source] = time.time()
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            listed_now = dict((source, listed[source]) for source in fetched)
+            added = proxy.ProxyArray(p for key, p in found.iteritems() \
+                                     if any(key in keys for keys in listed_now.values()))
+            self._merge(listed_now, fetched, added, result)
+        for source in stale:
+            self.engine.spawn(self._getters[source],
+                              functools.partial(retrieved, source)).add_done_callback(
+                                  functools.partial(source_done, source))
+
+    def _merge(self, listed, fetched, added, result):
+        """
+        Test the newly listed proxies and merge them with the current ones.
+        """
+
+        def merge(alive):
+            with self._cond:
+                deltas = {}
+                for source, keys in listed.iteritems():
+                    old = self._listed.get(source, set())
+                    deltas[source] = \
+                        {'added': proxy.ProxyArray.from_keys(keys-old).uris(),
+                         'removed': proxy.ProxyArray.from_keys(old-keys).uris()}
+                previous = set().union(*self._listed.values())
+                self._listed.update(listed)
+                self._fetched.update(fetched)
+                gone = previous-set().union(*self._listed.values())
+
+                # Replace the proxies all at once, skipping those that were
+                # found by the getters while the refresh was under way:
+                untested, geo_untested = \
+                    self._without(self.proxies_untested, self._geo_untested, gone)
+                new_untested = added.difference(untested)
+                untested.extend(new_untested)
+                tested, geo_tested = \
+                    self._without(self.proxies_tested, self._geo_tested, gone)
+                new_tested = alive.difference(tested)
+                tested.extend(new_tested)
+                if self.geo is not None:
+                    geo_untested.extend(self.geo.enrich(new_untested))
+                    geo_tested.extend(self.geo.enrich(new_tested))
+                self.proxies_untested, self.proxies_tested = untested, tested
+                self._geo_untested, self._geo_tested = geo_untested, geo_tested
+                self._seen_untested = set(untested.keys())
+                self._seen_tested = set(tested.keys())
+                for proxies, callbacks in [(new_untested, self._callbacks_untested),
+                                           (new_tested, self._callbacks_tested)]:
+                    for uri in proxies.uris() if callbacks else []:
+                        for callback in callbacks:
+                            callback(uri)
+                self._refreshing = None
+                self._cond.notify_all()
+            result.set_result(deltas)
+        if self.test and len(added):
+            self.tester.test_async(added).add_done_callback(
+                lambda f: merge(f.result() if f.exception() is None \
+                                else proxy.ProxyArray()))
+        else:
+            merge(proxy.ProxyArray())
+
+    def _without(self, proxies, info, gone):
+        indices = [i for i, key in enumerate(proxies.keys()) if key not in gone]
+        return proxies.take(indices), \
+            info.take(indices) if info is not None else None
+
+    def _check_test(self, test):
+        if test and not self.test:
+            raise ValueError('class instance not configured to test proxies')
+
+    def get(self, n=None, test=False, country=None, exclude_asn=None):
         """
         Return retrieved proxies.
 
@@ -120,21 +669,142 @@ class ProxyGet(object):
             If True, return tested proxy URIs; if False, return untested URIs.
             Raises an exception of the class was not instantiated with the
             `test` argument set.
+        country : str or list of str
+            If specified, only return proxies located in this country or
+            these countries (two-letter codes).
+        exclude_asn : int, str, or list
+            If specified, do not return proxies in this autonomous system or
+            these systems (e.g., 15169 or 'AS15169').
 
         Returns
         -------
         result : list of str
-            List of proxy URIs.
+            List of proxy URIs. If retrieval is still in progress, only the
+            proxies found so far are returned. If a health database is used,
+            tested proxies are returned in order of decreasing score.
+
+        Raises
+        ------
+        ValueError
+            If filters are specified but the instance was created without an
+            IP range database.
         """
-        
-        if n is None:
-            s = slice(None, None, None)
-        else:
+
+        if n is not None:
             assert isinstance(n, numbers.Integral)
-            s = slice(None, n, None)
+        self._check_test(test)
+        filtered = country is not None or exclude_asn is not None
+        if filtered and self.geo is None:
+            raise ValueError('class instance not configured with an IP range database')
+        with self._cond:
+            if test:
+                proxies = self.proxies_tested[:]
+                info = self._geo_tested
+            else:
+                proxies = self.proxies_untested[:None if filtered else n]
+                info = self._geo_untested
+            if filtered:
+                info = info[:len(proxies)]
+
+        # Filter the proxies by their precomputed countries and networks:
+        if filtered:
+            indices = info.select(country, exclude_asn)
+            proxies = proxies.take(indices if test else indices[:n])
+
+        # Proxy URIs are only constructed here:
+        uris = proxies.uris()
+        if test and self.health is not None:
+            uris = self.health.rank(uris)
+        return uris[:n]
+
+    def iter_proxies(self, test=False):
+        """
+        Iterate over proxies as soon as they are retrieved.
+
+        Parameters
+        ----------
+        test : bool
+            If True, iterate over tested proxy URIs; if False, iterate over
+            untested URIs.
+
+        Returns
+        -------
+        result : iterator of str
+            Iterator over unique proxy URIs; it blocks until new proxies are
+            available and stops once retrieval has finished.
+        """
+
+        self._check_test(test)
         if test:
-            if not self.test:
-                raise ValueError('class instance not configured to test proxies')
-            return self.proxies_tested[:n]
+            proxies, attr = self.proxies_tested, '_done'
         else:
-            return self.proxies_untested[:n]
+            proxies, attr = self.proxies_untested, '_retrieved'
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(proxies) and not getattr(self, attr):
+                    self._cond.wait()
+                batch = proxies[i:]
+                done = getattr(self, attr)
+            i += len(batch)
+            for uri in batch.uris():
+                yield uri
+            if done and not batch:
+                return
+
+    def subscribe(self, callback, test=False):
+        """
+        Register a function to call with every retrieved proxy.
+
+        Parameters
+        ----------
+        callback : function
+            Function invoked with every unique proxy URI. Proxies retrieved
+            before registration are passed to the function immediately;
+            subsequent proxies are passed from the thread that retrieved them,
+            so the function should return quickly.
+        test : bool
+            If True, invoke the function with tested proxy URIs; if False,
+            invoke it with untested URIs.
+        """
+
+        self._check_test(test)
+        with self._cond:
+            if test:
+                proxies, callbacks = self.proxies_tested, self._callbacks_tested
+            else:
+                proxies, callbacks = self.proxies_untested, self._callbacks_untested
+            for uri in proxies.uris():
+                callback(uri)
+            callbacks.append(callback)
+
+    def as_future(self, n=None, test=False, country=None, exclude_asn=None):
+        """
+        Return a future for the retrieved proxies.
+
+        Parameters
+        ----------
+        n : int
+            Maximum number of proxies to retrieve. If not specified, all
+            available proxies are returned.
+        test : bool
+            If True, return tested proxy URIs; if False, return untested URIs.
+        country, exclude_asn
+            Filters; see `get()`.
+
+        Returns
+        -------
+        result : concurrent.futures.Future
+            Future whose result is the list of proxy URIs returned by `get()`
+            once retrieval has finished. It may be waited on or chained with
+            callbacks by applications that run their own event loop.
+        """
+
+        result = futures.Future()
+        def collected(f):
+            try:
+                result.set_result(self.get(n, test, country, exclude_asn))
+            except Exception as e:
+                result.set_exception(e)
+        self._finished.add_done_callback(collected)
+        return result
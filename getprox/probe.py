@@ -0,0 +1,625 @@
+#!/usr/bin/env python
+
+"""
+Non-blocking socket proxy tester.
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import collections
+import errno
+import os
+import select
+import socket
+import threading
+import time
+import urlparse
+import warnings
+
+from concurrent import futures
+
+import control
+import proxy
+import testcache
+
+# Responses whose headers exceed this size are not read to completion:
+_MAX_HEADER = 65536
+
+def _fd_limit():
+    """
+    Return the maximum number of open file descriptors, or None if unknown.
+    """
+
+    try:
+        import resource
+        limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    except (ImportError, ValueError):
+        return None
+    return limit if limit > 0 else None
+
+class _Poller(object):
+    """
+    Minimal wrapper around poll() that falls back to select() on platforms
+    that do not provide the former.
+    """
+
+    def __init__(self):
+        if hasattr(select, 'poll'):
+            self._poll = select.poll()
+        else:
+            self._poll = None
+            self._read = set()
+            self._write = set()
+
+    def register(self, fd, write=False):
+        if self._poll is not None:
+            self._poll.register(fd, select.POLLOUT if write else select.POLLIN)
+        elif write:
+            self._write.add(fd)
+        else:
+            self._read.add(fd)
+
+    def unregister(self, fd):
+        if self._poll is not None:
+            self._poll.unregister(fd)
+        else:
+            self._read.discard(fd)
+            self._write.discard(fd)
+
+    def modify(self, fd, write=False):
+        self.unregister(fd)
+        self.register(fd, write)
+
+    def poll(self, timeout):
+        """
+        Return the descriptors that are ready or that encountered an error.
+        """
+
+        if self._poll is not None:
+            return [fd for fd, event in self._poll.poll(1000*timeout)]
+        r, w, x = select.select(self._read, self._write,
+                                self._read | self._write, timeout)
+        return list(set(r) | set(w) | set(x))
+
+class _Probe(object):
+    def __init__(self, proxy, uri, source, future):
+        self.proxy = proxy
+        self.uri = uri
+        self.source = source
+        self.future = future
+        self.addr = None
+        self.sock = None
+        self.connected = False
+        self.reused = False
+        self.data = ''
+        self.start = None
+        self.deadline = None
+        self.connect_time = None
+        self.ttfb = None
+
+class SocketTest(object):
+    """
+    Test whether proxies are alive using non-blocking sockets.
+
+    All probes are multiplexed over a single thread; each probe connects to
+    the proxy, sends a minimal request for the judge URI, and considers the
+    proxy alive if it starts returning an HTTP response. The host names of
+    proxies that are not specified by IPv4 address are resolved by a few
+    other threads so that lookups do not hold up the probes. Failures caused
+    by exhaustion of local resources or by host name resolution are not
+    recorded in `db` or `results`.
+
+    If `keepalive` is nonzero, the connections to proxies that respond are
+    kept open so that subsequent probes of the same proxies (such as periodic
+    re-checks of a pool) are sent immediately over them, which takes a single
+    round trip instead of three. Idle connections are watched for closure; a
+    connection dropped by its proxy is discarded and the next probe of the
+    proxy opens a new one.
+
+    Parameters
+    ----------
+    timeout : float
+        Proxy response timeout in seconds.
+    max_workers : int
+        Maximum number of concurrent probes; lowered if necessary to fit
+        within the process's file descriptor limit.
+    judge : str
+        URI requested through the proxies.
+    method : str
+        HTTP method used to request the judge URI.
+    db : getprox.health.HealthDB
+        Database in which the results of all probes are recorded. Proxies
+        that the database considers dead are not probed again.
+    metrics : getprox.metrics.Metrics
+        If specified, the latency and outcome of every probe are recorded.
+    keepalive : int
+        Maximum number of idle persistent connections kept open; the least
+        recently used connection is closed when the limit is reached. If the
+        idle connections and `max_workers` probes do not both fit within the
+        process's file descriptor limit, `max_workers` is lowered to make
+        room for the idle connections, down to half of the available
+        descriptors; `keepalive` is only lowered (with a warning) beyond
+        that. If 0 (default), every probe uses a new connection.
+    idle_timeout : float
+        Time in seconds after which idle persistent connections are closed.
+    results : getprox.testcache.ResultCache or bool
+        Cache of recent test results; `submit()` does not probe proxies whose
+        results have not expired. If True (default), the cache shared by all
+        testers in the process is used; if None, every proxy is probed.
+    """
+
+    def __init__(self, timeout=1.0, max_workers=1000,
+                 judge='http://www.google.com/', method='HEAD', db=None,
+                 metrics=None, keepalive=0, idle_timeout=60.0, results=True):
+        self.timeout = timeout
+        self.judge = judge
+        self.method = method
+        self.db = db
+        self.metrics = metrics
+        self.results = testcache.shared() if results is True else results or None
+
+        # Probes and idle connections share the descriptors that are left
+        # over by the rest of the process:
+        limit = _fd_limit()
+        if limit is not None:
+            available = max(2, limit-64)
+            if keepalive+max_workers > available:
+                max_workers = min(max_workers,
+                                  max(available//2, available-keepalive))
+                if keepalive > available-max_workers:
+                    warnings.warn('keepalive lowered from %d to %d to fit '
+                                  'within the file descriptor limit' % \
+                                  (keepalive, available-max_workers))
+                    keepalive = available-max_workers
+        self.max_workers = max_workers
+        self.keepalive = keepalive
+        self.idle_timeout = idle_timeout
+        self._request = '%s %s HTTP/1.1\r\nHost: %s\r\nConnection: %s\r\n\r\n' % \
+                        (method, judge, urlparse.urlsplit(judge).netloc,
+                         'keep-alive' if keepalive else 'close')
+        self._lock = threading.Lock()
+        self._pending = collections.deque()
+        self._executor = None
+
+        # Since all probes share the same timeout, the probes are kept in the
+        # order in which they were started so that the oldest one is always
+        # the first to expire:
+        self._probes = collections.OrderedDict()
+        self._running = False
+        self._wakeup = None
+        self._signalled = False
+
+        # Idle persistent connections in order of last use, and the proxies
+        # to which they are connected; only accessed by the probing thread:
+        self._idle = collections.OrderedDict()
+        self._idle_fds = {}
+        self._closing = False
+
+    def probe(self, uri, source=None):
+        """
+        Probe a proxy without blocking.
+
+        Parameters
+        ----------
+        uri : str or getprox.proxy.Proxy
+            Proxy URI of the form `http://domain:port` or proxy.
+        source : str
+            Name of the source that listed the proxy.
+
+        Returns
+        -------
+        result : concurrent.futures.Future
+            Future whose result is a tuple containing a flag that is True if
+            the proxy responded, the time in seconds taken to connect to the
+            proxy, and the time in seconds until the first byte of the
+            response was received (the times are None if unavailable; the
+            connect time is None if a persistent connection was reused).
+        """
+
+        try:
+            p = proxy.parse(uri)
+        except ValueError:
+            p = None
+        else:
+            uri = p.uri
+        f = futures.Future()
+        if p is None or self.db is not None and self.db.is_dead(uri):
+            self._record('invalid' if p is None else 'dead')
+            f.set_result((False, None, None))
+            return f
+        probe = _Probe(p, uri, source, f)
+        if isinstance(p.host, basestring):
+            self._resolver().submit(self._resolve, probe)
+        else:
+            probe.addr = (socket.AF_INET, (p.address, p.port))
+            self._queue(probe)
+        return f
+
+    def _resolver(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = futures.ThreadPoolExecutor(4)
+            return self._executor
+
+    def _resolve(self, p):
+        try:
+            addr = socket.getaddrinfo(p.proxy.address, p.proxy.port, 0,
+                                      socket.SOCK_STREAM)[0]
+        except socket.error:
+            if p.future.set_running_or_notify_cancel():
+                p.start = time.time()
+                self._finish(p, False, outcome='unresolved')
+            return
+        p.addr = (addr[0], addr[4])
+        self._queue(p)
+
+    def _queue(self, p):
+        with self._lock:
+            self._pending.append(p)
+            self._signal()
+
+    def _signal(self):
+
+        # Start the probing thread or wake it up; must be called with the
+        # lock held:
+        if not self._running:
+            self._running = True
+            self._wakeup = os.pipe()
+            t = threading.Thread(target=self._run)
+            t.daemon = True
+            t.start()
+        elif not self._signalled:
+            self._signalled = True
+            os.write(self._wakeup[1], 'x')
+
+    def submit(self, uri, source=None):
+        """
+        Test whether a single proxy is alive without blocking.
+
+        Parameters
+        ----------
+        uri : str or getprox.proxy.Proxy
+            Proxy URI of the form `http://domain:port` or proxy.
+        source : str
+            Name of the source that listed the proxy.
+
+        Returns
+        -------
+        result : concurrent.futures.Future
+            Future whose result is True if the proxy responds to the test.
+        """
+
+        done = futures.Future()
+        if self.results is not None:
+            ok = self.results.get(uri.uri if isinstance(uri, proxy.Proxy) else uri)
+            if ok is not None:
+                self._record('cached')
+                done.set_result(ok)
+                return done
+        def finished(f):
+            done.set_result(not f.cancelled() and f.result()[0])
+        self.probe(uri, source).add_done_callback(finished)
+        return done
+
+    def test(self, *uris):
+        """
+        Test whether a list of proxies are alive.
+
+        Parameters
+        ----------
+        uris : list of str or getprox.proxy.ProxyArray
+            Proxy URIs of the form `http://domain:port` or `Proxy` instances,
+            or a single array of proxies.
+
+        Returns
+        -------
+        result : list of str or getprox.proxy.ProxyArray
+            Proxies that respond to test; if an array of proxies was
+            specified, the live proxies are returned in an array.
+        """
+
+        return self.test_async(*uris).result()
+
+    def test_async(self, *uris):
+        """
+        Test whether a list of proxies are alive without blocking.
+
+        Parameters
+        ----------
+        uris : list of str or getprox.proxy.ProxyArray
+            Proxy URIs of the form `http://domain:port` or `Proxy` instances,
+            or a single array of proxies.
+
+        Returns
+        -------
+        result : concurrent.futures.Future
+            Future whose result is the list (or array) of proxies that
+            respond to test.
+        """
+
+        done = futures.Future()
+        array = len(uris) == 1 and isinstance(uris[0], proxy.ProxyArray)
+        if array:
+            uris = uris[0]
+        if not uris:
+            done.set_result(proxy.ProxyArray() if array else [])
+            return done
+
+        r_list = map(self.submit, uris)
+        lock = threading.Lock()
+        remaining = [len(r_list)]
+        def callback(r):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            alive = [uri for r, uri in zip(r_list, uris) if r.result()]
+            done.set_result(proxy.ProxyArray(alive) if array else alive)
+        for r in r_list:
+            r.add_done_callback(callback)
+        return done
+
+    def cancel(self):
+        """
+        Cancel all probes that have not started yet.
+        """
+
+        with self._lock:
+            pending = list(self._pending)
+            self._pending.clear()
+        for p in pending:
+            p.future.cancel()
+
+    def close(self):
+        """
+        Close all idle persistent connections.
+        """
+
+        with self._lock:
+            if self._running:
+                self._closing = True
+                self._signal()
+
+    def _start(self, p, poller):
+        if not p.future.set_running_or_notify_cancel():
+            return
+        idle = self._idle.pop(p.uri, None)
+        if idle is not None:
+            sock = idle[0]
+            fd = sock.fileno()
+            poller.unregister(fd)
+            del self._idle_fds[fd]
+            p.start = time.time()
+            p.deadline = p.start+self.timeout
+            try:
+                sock.send(self._request)
+            except socket.error:
+                sock.close()
+                self._record('dropped')
+            else:
+                p.sock = sock
+                p.connected = True
+                p.reused = True
+                self._probes[fd] = p
+                poller.register(fd)
+                return
+        self._connect(p, poller)
+
+    def _connect(self, p, poller):
+        p.start = time.time()
+        p.deadline = p.start+self.timeout
+        try:
+            p.sock = socket.socket(p.addr[0], socket.SOCK_STREAM)
+            p.sock.setblocking(0)
+            err = p.sock.connect_ex(p.addr[1])
+        except socket.error as e:
+            self._finish(p, False, outcome='local_error' \
+                         if control.is_local_error(e) else None)
+            return
+        if err in control.LOCAL_ERRNOS:
+            self._finish(p, False, outcome='local_error')
+            return
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self._finish(p, False)
+            return
+        self._probes[p.sock.fileno()] = p
+        poller.register(p.sock.fileno(), True)
+
+    def _handle(self, p, poller):
+        now = time.time()
+        fd = p.sock.fileno()
+        try:
+            if not p.connected:
+                err = p.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err:
+                    raise socket.error(err, os.strerror(err))
+                p.connected = True
+                p.connect_time = now-p.start
+                p.sock.send(self._request)
+                poller.modify(fd, False)
+                return
+            data = p.sock.recv(4096 if self.keepalive else 16)
+        except socket.error as e:
+            if control.is_local_error(e):
+                poller.unregister(fd)
+                del self._probes[fd]
+                self._finish(p, False, outcome='local_error')
+                return
+            data = ''
+
+        # A reused connection that was closed by the proxy since its last
+        # probe is replaced by a new one:
+        if p.reused and not p.data and not data:
+            poller.unregister(fd)
+            del self._probes[fd]
+            p.sock.close()
+            p.sock = None
+            p.connected = p.reused = False
+            self._record('dropped')
+            self._connect(p, poller)
+            return
+        p.data += data
+        if p.ttfb is None:
+            if data and len(p.data) < 5 and 'HTTP/'.startswith(p.data):
+                return
+            if p.data.startswith('HTTP/'):
+                p.ttfb = now-p.start
+
+        # Persistent connections are only kept once the response has been
+        # read completely:
+        keep = False
+        if data and p.ttfb is not None and self.keepalive:
+            keep = self._complete(p)
+            if keep is None:
+                return
+        poller.unregister(fd)
+        del self._probes[fd]
+        self._finish(p, p.ttfb is not None, p.ttfb, poller=poller, keep=keep)
+
+    def _complete(self, p):
+        """
+        Return True if a complete response was received over a connection
+        that may be reused, False if the connection may not be reused, and
+        None if more of the response is expected.
+        """
+
+        end = p.data.find('\r\n\r\n')
+        if end < 0:
+            return None if len(p.data) < _MAX_HEADER else False
+        lines = p.data[:end].split('\r\n')
+        version, _, status = lines[0].partition(' ')
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip().lower()
+        connection = headers.get('connection', headers.get('proxy-connection', ''))
+        if version == 'HTTP/1.0' and connection != 'keep-alive' or \
+           connection == 'close':
+            return False
+        if self.method == 'HEAD' or status[:3] in ('204', '304'):
+            length = 0
+        else:
+            try:
+                length = int(headers['content-length'])
+            except (KeyError, ValueError):
+                return False
+        received = len(p.data)-end-4
+        if received < length:
+            return None
+        return received == length
+
+    def _park(self, p, poller):
+        if p.uri in self._idle:
+            p.sock.close()
+            return
+
+        # Close the least recently used connection if the pool is full:
+        if len(self._idle) >= self.keepalive:
+            self._drop(next(self._idle.itervalues())[0].fileno(), poller)
+        fd = p.sock.fileno()
+        self._idle[p.uri] = (p.sock, time.time())
+        self._idle_fds[fd] = p.uri
+        poller.register(fd)
+
+    def _drop(self, fd, poller):
+        sock = self._idle.pop(self._idle_fds.pop(fd))[0]
+        poller.unregister(fd)
+        sock.close()
+
+    def _finish(self, p, ok, ttfb=None, outcome=None, poller=None, keep=False):
+        if keep:
+            self._park(p, poller)
+        elif p.sock is not None:
+            p.sock.close()
+        if ok:
+            latency = ttfb
+        else:
+            latency = time.time()-p.start
+
+        # Failures caused by local resource limits or by the resolver say
+        # nothing about the proxy:
+        if ok or outcome not in ('local_error', 'unresolved'):
+            if self.db is not None:
+                self.db.record(p.uri, ok, latency, p.source)
+            if self.results is not None:
+                self.results.put(p.uri, ok)
+        if outcome is None:
+            outcome = 'ok' if ok else 'error'
+        self._record(outcome, latency)
+        p.future.set_result((ok, p.connect_time, ttfb if ok else None))
+
+    def _record(self, outcome, latency=None):
+        if self.metrics is None:
+            return
+        labels = {'tester': 'socket', 'outcome': outcome}
+        self.metrics.inc('probes_total', labels)
+        if latency is not None:
+            self.metrics.observe('probe_seconds', latency, labels)
+
+    def _run(self):
+        poller = _Poller()
+        wakeup_r, wakeup_w = self._wakeup
+        poller.register(wakeup_r)
+        while True:
+            with self._lock:
+                started = []
+                while self._pending and \
+                      len(self._probes)+len(started) < self.max_workers:
+                    started.append(self._pending.popleft())
+            for p in started:
+                self._start(p, poller)
+            with self._lock:
+                if not self._probes and not self._pending and not self._idle:
+                    self._running = False
+                    self._signalled = False
+                    self._closing = False
+                    break
+
+            now = time.time()
+            timeout = self.timeout
+            if self._probes:
+                oldest = next(self._probes.itervalues())
+                timeout = max(0.0, oldest.deadline-now)
+            if self._idle:
+                last_used = next(self._idle.itervalues())[1]
+                timeout = max(0.0, min(timeout, last_used+self.idle_timeout-now))
+            for fd in poller.poll(timeout):
+                if fd == wakeup_r:
+                    os.read(wakeup_r, 4096)
+                    with self._lock:
+                        self._signalled = False
+                elif fd in self._probes:
+                    self._handle(self._probes[fd], poller)
+
+                # Idle connections only become readable when they are
+                # closed by the proxy:
+                elif fd in self._idle_fds:
+                    self._drop(fd, poller)
+
+            # Give up on proxies that did not respond in time; proxies that
+            # started responding are alive even if the response is incomplete:
+            now = time.time()
+            while self._probes:
+                fd, p = next(self._probes.iteritems())
+                if p.deadline > now:
+                    break
+                poller.unregister(fd)
+                del self._probes[fd]
+                if p.ttfb is None:
+                    self._finish(p, False, outcome='timeout')
+                else:
+                    self._finish(p, True, p.ttfb)
+
+            # Close connections that have been idle for too long:
+            with self._lock:
+                closing, self._closing = self._closing, False
+            while self._idle:
+                sock, last_used = next(self._idle.itervalues())
+                if not closing and last_used+self.idle_timeout > now:
+                    break
+                self._drop(sock.fileno(), poller)
+        os.close(wakeup_r)
+        os.close(wakeup_w)
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+
+"""
+Compact proxy representation.
+
+Notes
+-----
+Proxies are represented internally by `Proxy` records and stored in
+`ProxyArray` collections that keep IPv4 addresses and ports in packed
+unsigned integer arrays; proxy URI strings are only constructed when they are
+requested. Proxies whose hosts are not IPv4 addresses are also supported, but
+are stored less compactly.
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import array
+import itertools
+import re
+
+# Type codes of the unsigned 32-bit and 16-bit integer arrays:
+_UINT32 = 'I' if array.array('I').itemsize == 4 else 'L'
+_UINT16 = 'H'
+
+_ipv4 = re.compile(r'^(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})$')
+
+def _ntoa(ip):
+    return '%d.%d.%d.%d' % (ip >> 24, (ip >> 16) & 255, (ip >> 8) & 255, ip & 255)
+
+class Proxy(object):
+    """
+    HTTP proxy.
+
+    Parameters
+    ----------
+    host : int or str
+        IPv4 address of the proxy as an unsigned integer, or its host name.
+    port : int
+        Port number of the proxy.
+    """
+
+    __slots__ = ('host', 'port')
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+
+    @property
+    def address(self):
+        """
+        Host of the proxy in dotted-quad notation or as a host name.
+        """
+
+        if isinstance(self.host, basestring):
+            return self.host
+        return _ntoa(self.host)
+
+    @property
+    def uri(self):
+        """
+        URI of the proxy of the form `http://host:port`.
+        """
+
+        return 'http://%s:%d' % (self.address, self.port)
+
+    @property
+    def key(self):
+        """
+        Key that identifies the proxy; an integer containing the address and
+        port of IPv4 proxies, or a string for other proxies.
+        """
+
+        if isinstance(self.host, basestring):
+            return '%s:%d' % (self.host, self.port)
+        return self.host << 16 | self.port
+
+    def __eq__(self, other):
+        return isinstance(other, Proxy) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __str__(self):
+        return self.uri
+
+    def __repr__(self):
+        return 'Proxy(%r)' % self.uri
+
+def parse(uri):
+    """
+    Parse a proxy URI.
+
+    Parameters
+    ----------
+    uri : str or Proxy
+        Proxy URI of the form `http://host:port` or `host:port`. `Proxy`
+        instances are returned unchanged.
+
+    Returns
+    -------
+    result : Proxy
+        Parsed proxy.
+
+    Raises
+    ------
+    ValueError
+        If the URI does not contain a host and valid port number.
+    """
+
+    if isinstance(uri, Proxy):
+        return uri
+    netloc = uri.strip().split('://', 1)[-1].split('/', 1)[0]
+    host, sep, port = netloc.rpartition(':')
+    port = int(port)
+    if not sep or not host or not 0 < port < 65536:
+        raise ValueError('invalid proxy URI: %r' % uri)
+    m = _ipv4.match(host)
+    if m is not None:
+        octets = [int(x) for x in m.groups()]
+        if max(octets) < 256 and octets[0]:
+            return Proxy(octets[0] << 24 | octets[1] << 16 | \
+                         octets[2] << 8 | octets[3], port)
+    return Proxy(host, port)
+
+class ProxyArray(object):
+    """
+    Compact array of proxies.
+
+    Parameters
+    ----------
+    proxies : iterable
+        Initial proxies, specified as `Proxy` instances or URIs.
+
+    Notes
+    -----
+    IPv4 addresses are stored as unsigned 32-bit integers and ports as
+    unsigned 16-bit integers. The addresses of proxies with host names are
+    set to 0 and their host names are stored separately.
+
+    Set differences are computed with a set of keys that combine each
+    proxy's address and port; the set is built once and reused until proxies
+    are appended to the array.
+    """
+
+    def __init__(self, proxies=()):
+        self.ips = array.array(_UINT32)
+        self.ports = array.array(_UINT16)
+        self.hosts = {}
+        self._key_set = None
+        self.extend(proxies)
+
+    @classmethod
+    def from_keys(cls, keys):
+        """
+        Create an array from proxy keys.
+
+        Parameters
+        ----------
+        keys : iterable
+            Keys returned by `Proxy.key` or `ProxyArray.keys()`.
+
+        Returns
+        -------
+        result : ProxyArray
+            Proxies with the specified keys.
+        """
+
+        result = cls()
+        for key in keys:
+            if isinstance(key, basestring):
+                result.append(parse(key))
+            else:
+                result.ips.append(key >> 16)
+                result.ports.append(key & 0xffff)
+        return result
+
+    def append(self, proxy):
+        """
+        Append a proxy specified as a `Proxy` instance or URI.
+        """
+
+        proxy = parse(proxy)
+        if isinstance(proxy.host, basestring):
+            self.hosts[len(self.ips)] = proxy.host
+            self.ips.append(0)
+        else:
+            self.ips.append(proxy.host)
+        self.ports.append(proxy.port)
+
+    def extend(self, proxies):
+        """
+        Append proxies specified as `Proxy` instances or URIs.
+        """
+
+        if isinstance(proxies, ProxyArray):
+            n = len(self.ips)
+            for i, host in proxies.hosts.iteritems():
+                self.hosts[n+i] = host
+            self.ips.extend(proxies.ips)
+            self.ports.extend(proxies.ports)
+        else:
+            for proxy in proxies:
+                self.append(proxy)
+
+    def take(self, indices):
+        """
+        Return the proxies at the specified indices.
+        """
+
+        result = ProxyArray()
+        ips, ports, hosts = self.ips, self.ports, self.hosts
+        if not isinstance(indices, (list, xrange)):
+            indices = list(indices)
+        result.ips.fromlist([ips[i] for i in indices])
+        result.ports.fromlist([ports[i] for i in indices])
+        if hosts:
+            for j, i in enumerate(indices):
+                if i in hosts:
+                    result.hosts[j] = hosts[i]
+        return result
+
+    def keys(self):
+        """
+        Return the keys of all proxies.
+
+        Returns
+        -------
+        result : list
+            Key of each proxy; see `Proxy.key`.
+        """
+
+        keys = [ip << 16 | port for ip, port in itertools.izip(self.ips, self.ports)]
+        for i, host in self.hosts.iteritems():
+            keys[i] = '%s:%d' % (host, self.ports[i])
+        return keys
+
+    def _keys(self):
+        n = len(self.ips)
+        if self._key_set is None or self._key_set[0] != n:
+            self._key_set = (n, frozenset(self.keys()))
+        return self._key_set[1]
+
+    def uris(self):
+        """
+        Return the URIs of all proxies.
+
+        Returns
+        -------
+        result : list of str
+            Proxy URIs of the form `http://host:port`.
+        """
+
+        uris = ['http://%d.%d.%d.%d:%d' % \
+                (ip >> 24, (ip >> 16) & 255, (ip >> 8) & 255, ip & 255, port) \
+                for ip, port in itertools.izip(self.ips, self.ports)]
+        for i, host in self.hosts.iteritems():
+            uris[i] = 'http://%s:%d' % (host, self.ports[i])
+        return uris
+
+    def difference(self, other):
+        """
+        Return the proxies that are not in another array, in their original
+        order.
+        """
+
+        exclude = other._keys()
+        return self.take([i for i, key in enumerate(self.keys()) \
+                          if key not in exclude])
+
+    def __len__(self):
+        return len(self.ips)
+
+    def __iter__(self):
+        hosts = self.hosts
+        for i, (ip, port) in enumerate(itertools.izip(self.ips, self.ports)):
+            yield Proxy(hosts[i] if i in hosts else ip, port)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            if self.hosts:
+                return self.take(xrange(*i.indices(len(self.ips))))
+            result = ProxyArray()
+            result.ips = self.ips[i]
+            result.ports = self.ports[i]
+            return result
+        if i < 0:
+            i += len(self.ips)
+        return Proxy(self.hosts[i] if i in self.hosts else self.ips[i],
+                     self.ports[i])
+
+    def __repr__(self):
+        return 'ProxyArray(%r)' % self.uris()
@@ -9,9 +9,18 @@ Proxy tester.
 # Distributed under the terms of the BSD license:
 # http://www.opensource.org/licenses/bsd-license
 
+import collections
+import threading
+import time
+
+from concurrent import futures
 import requests
 import requests_futures.sessions
 
+import control
+import proxy
+import testcache
+
 class ProxyTest(object):
     """
     Test whether proxies are alive.
@@ -22,13 +31,50 @@ class ProxyTest(object):
         Proxy response timeout in seconds.
     max_workers : int
         Number of concurrent threads to use when testing proxies.
+    judge : str
+        URI requested through the proxies.
+    db : getprox.health.HealthDB
+        Database in which the results of all probes are recorded. Proxies
+        that the database considers dead are not probed again.
+    adaptive : bool or getprox.control.AdaptiveController
+        If True, the number of concurrent tests and the timeout are adjusted
+        to the observed network conditions, starting from `max_workers` and
+        `timeout`; a controller with custom settings may also be specified.
+        The number of threads is then set to the controller's maximum
+        concurrency.
+    metrics : getprox.metrics.Metrics
+        If specified, the latency and outcome of every probe are recorded.
+    results : getprox.testcache.ResultCache or bool
+        Cache of recent test results; proxies whose results have not expired
+        are not probed again. If True (default), the cache shared by all
+        testers in the process is used; if None, every proxy is probed.
     """
 
-    def __init__(self, timeout=1.0, max_workers=10):
+    def __init__(self, timeout=1.0, max_workers=10,
+                 judge='http://www.google.com', db=None, adaptive=False,
+                 metrics=None, results=True):
+        if adaptive is True:
+            self.controller = control.AdaptiveController(max_workers,
+                                                         timeout=timeout)
+        elif adaptive:
+            self.controller = adaptive
+        else:
+            self.controller = None
+        if self.controller is not None:
+            max_workers = self.controller.max_concurrency
         self.session = \
             requests_futures.sessions.FuturesSession(max_workers=max_workers)
         self.timeout = timeout
+        self.max_workers = max_workers
+        self.judge = judge
+        self.db = db
+        self.metrics = metrics
+        self.results = testcache.shared() if results is True else results or None
         self.temp = []
+        self._lock = threading.Lock()
+        self._outstanding = set()
+        self._waiting = collections.deque()
+        self._active = 0
     def _get_result(self, r):
         try:
             r.result()
@@ -37,27 +83,207 @@ class ProxyTest(object):
         else:
             return True
 
+    def submit(self, uri, source=None):
+        """
+        Test whether a single proxy is alive without blocking.
+
+        Parameters
+        ----------
+        uri : str or getprox.proxy.Proxy
+            Proxy URI of the form `http://domain:port` or proxy.
+        source : str
+            Name of the source that listed the proxy.
+
+        Returns
+        -------
+        result : concurrent.futures.Future
+            Future whose result is True if the proxy responds to the test.
+        """
+
+        if isinstance(uri, proxy.Proxy):
+            uri = uri.uri
+        done = futures.Future()
+        if self.results is not None:
+            ok = self.results.get(uri)
+            if ok is not None:
+                self._record('cached')
+                done.set_result(ok)
+                return done
+        if self.db is not None and self.db.is_dead(uri):
+            self._record('dead')
+            done.set_result(False)
+            return done
+
+        # When adapting, tests beyond the current concurrency wait for a slot:
+        if self.controller is not None:
+            with self._lock:
+                if self._active >= self.controller.concurrency:
+                    self._waiting.append((uri, source, done))
+                    return done
+                self._active += 1
+        self._start(uri, source, done)
+        return done
+
+    def _start(self, uri, source, done):
+        start = time.time()
+        def finished(r):
+            with self._lock:
+                self._outstanding.discard(r)
+            ok = self._get_result(r)
+            if r.cancelled():
+                self._record('cancelled')
+            else:
+                if ok:
+                    latency = r.result().elapsed.total_seconds()
+                else:
+                    latency = time.time()-start
+                if self.db is not None:
+                    self.db.record(uri, ok, latency, source)
+                e = r.exception()
+                timed_out = isinstance(e, requests.exceptions.Timeout)
+                local_error = control.is_local_error(e)
+
+                # Only failures to connect to or through the proxy are
+                # cached; those caused by local resource limits or other
+                # errors say nothing about the proxy:
+                failed = isinstance(e, (requests.exceptions.ConnectionError,
+                                        requests.exceptions.Timeout))
+                if self.results is not None and not local_error and \
+                   (ok or failed):
+                    self.results.put(uri, ok)
+                if self.controller is not None:
+                    self.controller.record(ok, latency, timed_out, local_error)
+                if ok:
+                    self._record('ok', latency)
+                elif timed_out:
+                    self._record('timeout', latency)
+                elif local_error:
+                    self._record('local_error', latency)
+                else:
+                    self._record('error', latency)
+            done.set_result(ok)
+            if self.controller is not None:
+                self._release()
+        if self.controller is not None:
+            timeout = self.controller.timeout
+        else:
+            timeout = self.timeout
+        r = self.session.get(self.judge, proxies={'http': uri},
+                             timeout=timeout)
+        with self._lock:
+            self._outstanding.add(r)
+        r.add_done_callback(finished)
+
+    def _record(self, outcome, latency=None):
+        if self.metrics is None:
+            return
+        labels = {'tester': 'requests', 'outcome': outcome}
+        self.metrics.inc('probes_total', labels)
+        if latency is not None:
+            self.metrics.observe('probe_seconds', latency, labels)
+
+    def _release(self):
+        with self._lock:
+            self._active -= 1
+            waiting = []
+            while self._waiting and \
+                  self._active+len(waiting) < self.controller.concurrency:
+                waiting.append(self._waiting.popleft())
+            self._active += len(waiting)
+        for args in waiting:
+            self._start(*args)
+
+    def stats(self):
+        """
+        Return the concurrency and timeout currently used for testing.
+
+        Returns
+        -------
+        result : dict
+            Current concurrency and timeout; if testing is adaptive, the
+            statistics reported by the controller are also included.
+        """
+
+        if self.controller is None:
+            return {'concurrency': self.max_workers, 'timeout': self.timeout}
+        return self.controller.stats()
+
+    def cancel(self):
+        """
+        Cancel all tests that have not started yet.
+
+        Notes
+        -----
+        Cancelled tests report their proxies as not alive and are not recorded
+        in the health database.
+        """
+
+        with self._lock:
+            outstanding = list(self._outstanding)
+            waiting = list(self._waiting)
+            self._waiting.clear()
+        for r in outstanding:
+            r.cancel()
+        for uri, source, done in waiting:
+            done.set_result(False)
+
     def test(self, *uris):
         """
         Test whether a list of proxies are alive.
 
         Parameters
         ----------
-        uris : list of str
-            Proxy URIs of the form `http://domain:port`.
+        uris : list of str or getprox.proxy.ProxyArray
+            Proxy URIs of the form `http://domain:port` or `Proxy` instances,
+            or a single array of proxies.
 
         Returns
         -------
-        result : list of str
-            Proxies that respond to test.
+        result : list of str or getprox.proxy.ProxyArray
+            Proxies that respond to test; if an array of proxies was
+            specified, the live proxies are returned in an array.
         """
 
-        r_list = map(lambda p: self.session.get('http://www.google.com',
-                                                proxies={'http': p},
-                                                timeout=self.timeout), uris)
+        return self.test_async(*uris).result()
+
+    def test_async(self, *uris):
+        """
+        Test whether a list of proxies are alive without blocking.
+
+        Parameters
+        ----------
+        uris : list of str or getprox.proxy.ProxyArray
+            Proxy URIs of the form `http://domain:port` or `Proxy` instances,
+            or a single array of proxies.
+
+        Returns
+        -------
+        result : concurrent.futures.Future
+            Future whose result is the list (or array) of proxies that
+            respond to test.
+        """
+
+        done = futures.Future()
+        array = len(uris) == 1 and isinstance(uris[0], proxy.ProxyArray)
+        if array:
+            uris = uris[0]
+        if not uris:
+            done.set_result(proxy.ProxyArray() if array else [])
+            return done
+
+        r_list = map(self.submit, uris)
         self.temp.extend(r_list)
-        results = []
-        for r, uri in zip(r_list, uris):
-            if self._get_result(r):
-                results.append(uri)
-        return results
+
+        # Collect the results once the last test has completed:
+        lock = threading.Lock()
+        remaining = [len(r_list)]
+        def callback(r):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            alive = [uri for r, uri in zip(r_list, uris) if r.result()]
+            done.set_result(proxy.ProxyArray(alive) if array else alive)
+        for r in r_list:
+            r.add_done_callback(callback)
+        return done
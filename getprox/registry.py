@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""
+Registry of proxy sources.
+
+Notes
+-----
+Source names are listed here so that they are available without importing
+`getprox.getters` and the parsing libraries it requires.
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import importlib
+
+# Sources whose retrieval functions are defined in getprox.getters:
+SOURCES = ['freeproxylists',
+           'checkerproxy',
+           'letushide',
+           'freeproxylist',
+           'proxy_ip_list',
+           'aliveproxy',
+           'cool_proxy',
+           'proxynova',
+           'proxyhttp',
+           'samair']
+
+# Approximate numbers of pages downloaded and of proxies listed by a retrieval
+# from each source; used to schedule sources whose statistics have not been
+# recorded yet (see `getprox.schedule`):
+COSTS = {'freeproxylists': (21, 1000),
+         'checkerproxy': (1, 500),
+         'letushide': (19, 600),
+         'freeproxylist': (2, 5000),
+         'proxy_ip_list': (1, 100),
+         'aliveproxy': (1, 20),
+         'cool_proxy': (5, 100),
+         'proxynova': (100, 2000),
+         'proxyhttp': (9, 300),
+         'samair': (12, 500)}
+
+# Estimate for other sources, such as bulk lists:
+DEFAULT_COST = (1, 100)
+
+def available():
+    """
+    Return the names of the available sources.
+
+    Returns
+    -------
+    result : list of str
+        Sources in `SOURCES`.
+    """
+
+    return list(SOURCES)
+
+def getter(source):
+    """
+    Return the retrieval function of a source.
+
+    Parameters
+    ----------
+    source : str
+        Source name, or URI or path of a bulk list of proxies (see
+        `getprox.bulk`).
+
+    Returns
+    -------
+    result : function
+        Getter that accepts a `getprox.engine.Fetcher` instance.
+    """
+
+    if source not in SOURCES:
+        bulk = importlib.import_module('getprox.bulk')
+        if bulk.is_bulk(source):
+            return bulk.getter(source)
+    return getattr(importlib.import_module('getprox.getters'), source)
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+
+"""
+Proxy rotation for requests sessions.
+
+Notes
+-----
+`ProxySession` is a `requests.Session` that sends every request through a
+proxy drawn from a `ProxyGet` instance; proxies that repeatedly fail are
+ejected for a while and the instance is refreshed in the background when too
+few remain.
+
+Selecting a proxy does not acquire any lock: the selectable proxies are kept
+in an immutable tuple that is replaced whenever proxies are added or ejected,
+and per-proxy statistics are updated in place. Concurrent updates of the
+statistics may occasionally be lost, which only affects the accuracy of the
+selection heuristics.
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import itertools
+import random
+import threading
+import time
+
+import requests
+import requests.adapters
+
+import pg
+import proxy
+
+class _Entry(object):
+    __slots__ = ('uri', 'latency', 'failures', 'pending')
+
+    def __init__(self, uri):
+        self.uri = uri
+        self.latency = None
+        self.failures = 0
+        self.pending = 0
+
+    def cost(self):
+        # Proxies whose latency is unknown are tried first:
+        return (self.latency or 0.0)*(self.pending+1)
+
+class ProxyRotator(object):
+    """
+    Select proxies retrieved by a `ProxyGet` instance.
+
+    Parameters
+    ----------
+    proxy_get : getprox.ProxyGet
+        Source of proxies; proxies are added as soon as they are retrieved.
+    strategy : str
+        Selection strategy: 'round-robin' (default) cycles through the
+        proxies, 'least-latency' selects the proxy with the lowest average
+        latency, and 'power-of-two' selects the better of two random proxies
+        based on their latencies and numbers of pending requests.
+    max_failures : int
+        Number of consecutive failures after which a proxy is ejected.
+    min_proxies : int
+        If fewer proxies remain, `proxy_get` is refreshed.
+    min_refresh_interval : float
+        Minimum interval in seconds between refreshes.
+    timeout : float
+        Time in seconds to wait for a proxy if none is available.
+    alpha : float
+        Weight of the most recent request in the moving average of a proxy's
+        latency.
+    eject_ttl : float
+        Time in seconds after which an ejected proxy may be selected again
+        if it is still listed and, if `proxy_get` tests proxies, passes a
+        test.
+    """
+
+    def __init__(self, proxy_get, strategy='round-robin', max_failures=3,
+                 min_proxies=10, min_refresh_interval=60.0, timeout=30.0,
+                 alpha=0.3, eject_ttl=600.0):
+        try:
+            self._select = {'round-robin': self._round_robin,
+                            'least-latency': self._least_latency,
+                            'power-of-two': self._power_of_two}[strategy]
+        except KeyError:
+            raise ValueError('unknown selection strategy: %r' % strategy)
+        self.proxy_get = proxy_get
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.min_proxies = min_proxies
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self.alpha = alpha
+        self.eject_ttl = eject_ttl
+        self._entries = ()
+        self._uris = set()
+        self._ejected = {}
+        self._recovering = False
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._available = threading.Event()
+        self._last_refresh = time.time()
+        proxy_get.subscribe(self._add, proxy_get.test)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _add(self, uri):
+        with self._lock:
+            if uri in self._uris:
+                return
+            if uri in self._ejected:
+                if self._ejected[uri] > time.time():
+                    return
+                del self._ejected[uri]
+            self._uris.add(uri)
+            self._entries += (_Entry(uri),)
+            self._available.set()
+
+    def _round_robin(self, entries):
+        return entries[next(self._counter) % len(entries)]
+
+    def _least_latency(self, entries):
+        return min(entries, key=_Entry.cost)
+
+    def _power_of_two(self, entries):
+        a = entries[random.randrange(len(entries))]
+        b = entries[random.randrange(len(entries))]
+        return a if a.cost() <= b.cost() else b
+
+    def choose(self):
+        """
+        Select a proxy.
+
+        Returns
+        -------
+        entry : object
+            Selected proxy; its URI is stored in the `uri` attribute. The
+            outcome of the request sent through the proxy should be reported
+            with `succeeded()` or `failed()`.
+
+        Raises
+        ------
+        requests.exceptions.ConnectionError
+            If no proxy becomes available within the timeout.
+        """
+
+        entries = self._entries
+        if not entries:
+            self._refresh()
+            if not self._available.wait(self.timeout) or not self._entries:
+                raise requests.exceptions.ConnectionError('no proxies available')
+            entries = self._entries
+        return self._select(entries)
+
+    def succeeded(self, entry, latency):
+        """
+        Record a successful request sent through a proxy.
+        """
+
+        entry.failures = 0
+        if entry.latency is None:
+            entry.latency = latency
+        else:
+            entry.latency = self.alpha*latency+(1-self.alpha)*entry.latency
+
+    def failed(self, entry):
+        """
+        Record a failed request sent through a proxy.
+
+        Returns
+        -------
+        result : bool
+            True if the proxy was ejected.
+        """
+
+        entry.failures += 1
+        if self.proxy_get.health is not None:
+            self.proxy_get.health.record(entry.uri, False, None, 'session')
+        if entry.failures < self.max_failures:
+            return False
+        with self._lock:
+            if entry not in self._entries:
+                return False
+            self._entries = tuple(e for e in self._entries if e is not entry)
+            self._uris.discard(entry.uri)
+            self._ejected[entry.uri] = time.time()+self.eject_ttl
+            if not self._entries:
+                self._available.clear()
+            low = len(self._entries) < self.min_proxies
+        if low:
+            self._refresh()
+        return True
+
+    def _refresh(self):
+        with self._lock:
+            now = time.time()
+            if now-self._last_refresh < self.min_refresh_interval:
+                return
+            self._last_refresh = now
+        self.proxy_get.refresh(0).add_done_callback(self._refreshed)
+
+    def _refreshed(self, f):
+
+        # Drop ejections that have expired or whose proxies are no longer
+        # listed by any source:
+        listed = self.proxy_get.get(test=False)
+        current = set(listed)
+        now = time.time()
+        with self._lock:
+            self._ejected = dict((uri, expires) for uri, expires in \
+                                 self._ejected.iteritems() \
+                                 if expires > now and uri in current)
+
+            # Refreshing only yields newly listed proxies; when too few
+            # remain, the other listed proxies are used (or tested) again:
+            if len(self._entries) >= self.min_proxies or self._recovering:
+                return
+            uris = [uri for uri in listed \
+                    if uri not in self._uris and uri not in self._ejected]
+            if not uris:
+                return
+            self._recovering = True
+        if not self.proxy_get.test:
+            for uri in uris:
+                self._add(uri)
+            with self._lock:
+                self._recovering = False
+            return
+        def tested(f):
+            if f.exception() is None:
+                for uri in f.result().uris():
+                    self._add(uri)
+            with self._lock:
+                self._recovering = False
+        self.proxy_get.tester.test_async(proxy.ProxyArray(uris)).add_done_callback(tested)
+
+class ProxyAdapter(requests.adapters.HTTPAdapter):
+    """
+    Transport adapter that sends requests through rotated proxies.
+
+    Parameters
+    ----------
+    rotator : ProxyRotator
+        Proxy selector.
+    retries : int
+        Number of other proxies through which a request is sent again if its
+        proxy fails to connect or times out.
+    kwargs : dict
+        Extra arguments passed to `requests.adapters.HTTPAdapter`.
+
+    Notes
+    -----
+    The URI of the proxy through which a response was received is stored in
+    its `proxy` attribute.
+    """
+
+    def __init__(self, rotator, retries=2, **kwargs):
+        super(ProxyAdapter, self).__init__(**kwargs)
+        self.rotator = rotator
+        self.retries = retries
+
+    def send(self, request, **kwargs):
+        for i in xrange(self.retries+1):
+            entry = self.rotator.choose()
+            kwargs['proxies'] = {'http': entry.uri, 'https': entry.uri}
+            entry.pending += 1
+            start = time.time()
+            try:
+                r = super(ProxyAdapter, self).send(request, **kwargs)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+                error = e
+                if self.rotator.failed(entry):
+
+                    # Release the connections to ejected proxies:
+                    manager = self.proxy_manager.pop(entry.uri, None)
+                    if manager is not None:
+                        manager.clear()
+                continue
+            finally:
+                entry.pending -= 1
+            self.rotator.succeeded(entry, time.time()-start)
+            r.proxy = entry.uri
+            return r
+        raise error
+
+class ProxySession(requests.Session):
+    """
+    Session that sends every request through a rotated proxy.
+
+    Parameters
+    ----------
+    proxy_get : getprox.ProxyGet
+        Source of proxies. If None, tested proxies are retrieved from all
+        available sources.
+    strategy : str
+        Selection strategy; see `ProxyRotator`.
+    max_failures : int
+        Number of consecutive failures after which a proxy is ejected.
+    retries : int
+        Number of other proxies tried if a request's proxy fails.
+    eject_ttl : float
+        Time in seconds after which an ejected proxy may be selected again.
+
+    Attributes
+    ----------
+    rotator : ProxyRotator
+        Proxy selector.
+    """
+
+    def __init__(self, proxy_get=None, strategy='round-robin', max_failures=3,
+                 retries=2, eject_ttl=600.0):
+        super(ProxySession, self).__init__()
+        if proxy_get is None:
+            proxy_get = pg.ProxyGet(test=True)
+        self.rotator = ProxyRotator(proxy_get, strategy, max_failures,
+                                    eject_ttl=eject_ttl)
+        adapter = ProxyAdapter(self.rotator, retries)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+
+"""
+Cost-aware scheduling of proxy sources.
+
+Notes
+-----
+The duration, number of downloaded pages, and number of listed proxies of
+every completed retrieval from a source are recorded, as is the fraction of
+its proxies found alive when they are tested. Sources are started in order of
+decreasing expected yield per second; until a source has been retrieved, its
+cost and yield are estimated from `getprox.registry.COSTS`.
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import os
+import sqlite3
+import threading
+import time
+
+import registry
+
+# Estimated time in seconds taken to download a page and fraction of listed
+# proxies that are alive, used for sources without recorded statistics:
+PAGE_TIME = 0.5
+ALIVE_FRACTION = 0.1
+
+_lock = threading.Lock()
+
+class SourceStats(object):
+    """
+    Persistent record of the cost and yield of proxy sources.
+
+    Parameters
+    ----------
+    path : str
+        Database file. If None, `~/.getprox/sources.sqlite` is used; if
+        ':memory:', statistics are only kept by this instance.
+    alpha : float
+        Weight of the most recent retrieval in the moving averages.
+    """
+
+    def __init__(self, path=None, alpha=0.3):
+        if path is None:
+            path = os.path.join(os.path.expanduser('~'), '.getprox',
+                                'sources.sqlite')
+        if path != ':memory:':
+            d = os.path.dirname(path)
+            if d and not os.path.isdir(d):
+                os.makedirs(d)
+        self.path = path
+        self.alpha = alpha
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.executescript('''
+                CREATE TABLE IF NOT EXISTS sources (
+                    source TEXT PRIMARY KEY,
+                    runs INTEGER,
+                    duration REAL,
+                    pages REAL,
+                    proxies REAL,
+                    alive REAL,
+                    updated REAL);
+            ''')
+            self._conn.commit()
+
+    def _average(self, old, new):
+        if old is None:
+            return new
+        return self.alpha*new+(1-self.alpha)*old
+
+    def record(self, source, duration, pages, proxies):
+        """
+        Record a completed retrieval from a source.
+
+        Parameters
+        ----------
+        source : str
+            Source name.
+        duration : float
+            Time in seconds taken by the retrieval.
+        pages : int
+            Number of pages downloaded.
+        proxies : int
+            Number of proxies listed by the source.
+        """
+
+        with self._lock:
+            row = self._conn.execute('SELECT runs, duration, pages, proxies, '
+                                     'alive FROM sources WHERE source=?',
+                                     (source,)).fetchone()
+            runs, old_duration, old_pages, old_proxies, alive = \
+                row or (0, None, None, None, None)
+            self._conn.execute('INSERT OR REPLACE INTO sources VALUES '
+                               '(?, ?, ?, ?, ?, ?, ?)',
+                               (source, runs+1,
+                                self._average(old_duration, duration),
+                                self._average(old_pages, pages),
+                                self._average(old_proxies, proxies),
+                                alive, time.time()))
+            self._conn.commit()
+
+    def record_alive(self, source, fraction):
+        """
+        Record the fraction of the proxies listed by a source that were alive.
+        """
+
+        with self._lock:
+            row = self._conn.execute('SELECT alive FROM sources WHERE source=?',
+                                     (source,)).fetchone()
+            if row is None:
+                return
+            self._conn.execute('UPDATE sources SET alive=? WHERE source=?',
+                               (self._average(row[0], fraction), source))
+            self._conn.commit()
+
+    def get(self, source):
+        """
+        Return the statistics of a source.
+
+        Returns
+        -------
+        result : dict
+            Number of recorded retrievals (`runs`) and moving averages of the
+            `duration`, number of `pages`, number of listed `proxies`, and
+            `alive` fraction of a retrieval. If no retrieval was recorded,
+            estimates are returned and `runs` is 0.
+        """
+
+        with self._lock:
+            row = self._conn.execute('SELECT runs, duration, pages, proxies, '
+                                     'alive FROM sources WHERE source=?',
+                                     (source,)).fetchone()
+        if row is None:
+            pages, proxies = registry.COSTS.get(source, registry.DEFAULT_COST)
+            row = (0, pages*PAGE_TIME, pages, proxies, None)
+        runs, duration, pages, proxies, alive = row
+        return {'runs': runs, 'duration': duration, 'pages': pages,
+                'proxies': proxies,
+                'alive': ALIVE_FRACTION if alive is None else alive}
+
+    def expected(self, source, test=False):
+        """
+        Return the expected number of proxies retrieved from a source.
+
+        Parameters
+        ----------
+        source : str
+            Source name.
+        test : bool
+            If True, return the expected number of live proxies.
+        """
+
+        s = self.get(source)
+        return s['proxies']*s['alive'] if test else s['proxies']
+
+    def order(self, sources, test=False):
+        """
+        Sort sources by decreasing expected yield per second.
+
+        Parameters
+        ----------
+        sources : list of str
+            Source names.
+        test : bool
+            If True, rank sources by their expected yield of live proxies.
+
+        Returns
+        -------
+        result : list of str
+            Sorted source names.
+        """
+
+        def rate(source):
+            return self.expected(source, test)/max(self.get(source)['duration'], 1e-3)
+        return sorted(sources, key=lambda source: -rate(source))
+
+_shared = []
+
+def shared():
+    """
+    Return the in-memory statistics shared by all instances in this process.
+    """
+
+    with _lock:
+        if not _shared:
+            _shared.append(SourceStats(':memory:'))
+        return _shared[0]
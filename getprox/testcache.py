@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+"""
+In-memory cache of proxy test results.
+
+Notes
+-----
+Live proxies are few and are kept in a dict with least-recently-used
+eviction. Dead proxies are far more numerous and are only recorded in Bloom
+filters: the results of one period are added to the current filter, which
+replaces the previous one at the end of the period, so that a dead result is
+remembered for between one and two periods. A small fraction of untested
+proxies may be reported as dead by the filters.
+"""
+
+# Copyright (c) 2014-2015, Lev Givon
+# All rights reserved.
+# Distributed under the terms of the BSD license:
+# http://www.opensource.org/licenses/bsd-license
+
+import collections
+import hashlib
+import math
+import struct
+import threading
+import time
+
+class BloomFilter(object):
+    """
+    Set of strings with false positives but no false negatives.
+
+    Parameters
+    ----------
+    capacity : int
+        Number of items for which the filter is sized.
+    error_rate : float
+        False positive rate once the filter holds `capacity` items.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self.size = int(math.ceil(-capacity*math.log(error_rate)/math.log(2)**2))
+        self.hashes = max(1, int(round(self.size*math.log(2)/capacity)))
+        self.count = 0
+        self._bits = bytearray((self.size+7)//8)
+
+    def _positions(self, item):
+        if not isinstance(item, bytes):
+            item = item.encode('utf-8')
+
+        # Derive all positions from two hashes (Kirsch and Mitzenmacher):
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(item).digest())
+        return [(h1+i*h2) % self.size for i in xrange(self.hashes)]
+
+    def add(self, item):
+        """
+        Add an item to the filter.
+        """
+
+        for i in self._positions(item):
+            self._bits[i >> 3] |= 1 << (i & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self._bits
+        return all(bits[i >> 3] & (1 << (i & 7)) for i in self._positions(item))
+
+class ResultCache(object):
+    """
+    Cache of proxy test results with separate lifetimes for live and dead
+    proxies.
+
+    Parameters
+    ----------
+    alive_ttl : float
+        Time in seconds for which a proxy found alive is not tested again.
+    dead_ttl : float
+        Time in seconds for which a proxy found dead is not tested again; dead
+        results expire between `dead_ttl` and twice that time after they were
+        recorded.
+    max_alive : int
+        Maximum number of live proxies kept; the least recently used entries
+        are evicted first.
+    max_dead : int
+        Number of dead proxies recorded per period for which each Bloom filter
+        is sized; the filters are rotated early if this number is reached.
+    error_rate : float
+        Probability that an untested proxy is reported as dead.
+    """
+
+    def __init__(self, alive_ttl=300.0, dead_ttl=60.0, max_alive=100000,
+                 max_dead=100000, error_rate=0.01):
+        self.alive_ttl = alive_ttl
+        self.dead_ttl = dead_ttl
+        self.max_alive = max_alive
+        self.max_dead = max_dead
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """
+        Discard all results.
+        """
+
+        with self._lock:
+            self._alive = collections.OrderedDict()
+            self._dead = BloomFilter(self.max_dead, self.error_rate)
+            self._dead_previous = BloomFilter(self.max_dead, self.error_rate)
+            self._rotated = time.time()
+
+    def _rotate(self, now):
+        if now-self._rotated >= self.dead_ttl or \
+           self._dead.count >= self.max_dead:
+            self._dead_previous = self._dead
+            self._dead = BloomFilter(self.max_dead, self.error_rate)
+            self._rotated = now
+
+    def get(self, uri):
+        """
+        Return the cached test result of a proxy.
+
+        Parameters
+        ----------
+        uri : str
+            Proxy URI.
+
+        Returns
+        -------
+        result : bool
+            True if the proxy was recently found alive, False if it was
+            recently found dead, and None if it must be tested.
+        """
+
+        now = time.time()
+        with self._lock:
+            expires = self._alive.pop(uri, None)
+            if expires is not None:
+                if expires > now:
+                    self._alive[uri] = expires
+                    return True
+                return None
+            self._rotate(now)
+            if uri in self._dead or uri in self._dead_previous:
+                return False
+        return None
+
+    def put(self, uri, ok):
+        """
+        Record the test result of a proxy.
+
+        Parameters
+        ----------
+        uri : str
+            Proxy URI.
+        ok : bool
+            True if the proxy is alive. Only failures caused by the proxy
+            itself, such as timeouts and refused connections, should be
+            recorded; those caused by local errors would keep live proxies
+            from being tested again.
+        """
+
+        now = time.time()
+        with self._lock:
+            self._alive.pop(uri, None)
+            if ok:
+                if len(self._alive) >= self.max_alive:
+                    self._alive.popitem(last=False)
+                self._alive[uri] = now+self.alive_ttl
+            else:
+                self._rotate(now)
+                self._dead.add(uri)
+
+_lock = threading.Lock()
+_shared = []
+
+def shared():
+    """
+    Return the result cache shared by all testers in this process.
+    """
+
+    with _lock:
+        if not _shared:
+            _shared.append(ResultCache())
+        return _shared[0]
@@ -1,2 +1,3 @@
-import pkg_resources
-__version__ = pkg_resources.require('getprox')[0].version
+# The version is defined here rather than obtained from the installed
+# distribution because importing pkg_resources slows down package import:
+__version__ = '0.1.1'
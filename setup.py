@@ -13,7 +13,9 @@ from setuptools import find_packages
 from setuptools import setup
 
 NAME =               'getprox'
-VERSION =            '0.1.1'
+# Read the version without importing the package:
+exec(open(os.path.join('getprox', 'version.py')).read())
+VERSION =            __version__
 AUTHOR =             'Lev Givon'
 AUTHOR_EMAIL =       'lev@columbia.edu'
 URL =                'https://github.com/lebedov/getprox'